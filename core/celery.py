@@ -1,16 +1,83 @@
+import logging
 import os
+import time
 from celery import Celery
 from django.conf import settings
 from celery.schedules import crontab
+from celery.signals import task_postrun, task_prerun, worker_process_init, worker_ready
+
+from tracker.metrics import TASK_SECONDS, start_exporter
+from tracker.queries import QueryRecorder, repeat_threshold
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
 
+logger = logging.getLogger(__name__)
+
 app = Celery("core")
 app.config_from_object("django.conf:settings", namespace="CELERY")
 app.autodiscover_tasks()
 
+# Query recorders of the tasks currently running, keyed by task id. Connected
+# here rather than in tracker.signals so web processes never import Celery
+_task_recorders = {}
+
+
+@task_prerun.connect
+def start_task_query_recorder(task_id=None, task=None, **kwargs):
+    if getattr(settings, "QUERY_INSTRUMENTATION", False):
+        _task_recorders[task_id] = QueryRecorder().__enter__()
+
+
+@task_postrun.connect
+def stop_task_query_recorder(task_id=None, task=None, **kwargs):
+    recorder = _task_recorders.pop(task_id, None)
+    if recorder:
+        recorder.__exit__(None, None, None)
+        recorder.report(f"task {task.name}", repeat_threshold())
+
+
+_task_started = {}
+
+
+@task_prerun.connect
+def start_task_timer(task_id=None, **kwargs):
+    _task_started[task_id] = time.perf_counter()
+
+
+@task_postrun.connect
+def stop_task_timer(task_id=None, task=None, **kwargs):
+    started = _task_started.pop(task_id, None)
+    if started is not None:
+        TASK_SECONDS.observe(time.perf_counter() - started, task=task.name)
+
+
+@worker_ready.connect
+@worker_process_init.connect
+def start_metrics_exporter(**kwargs):
+    # ? metrics live in the process that ran the task, so the main process
+    # and each pool child serve their own, each on the first free port of
+    # METRICS_EXPORTER_PORT..+METRICS_EXPORTER_PORTS. Which process gets which
+    # port depends on start order, so scrape the whole range
+    port = getattr(settings, "METRICS_EXPORTER_PORT", 0)
+    if not port:
+        return
+    tries = getattr(settings, "METRICS_EXPORTER_PORTS", 16)
+    host = getattr(settings, "METRICS_EXPORTER_HOST", "127.0.0.1")
+    server = start_exporter(port, tries=tries, host=host)
+    if server:
+        logger.info(
+            f"Serving metrics of pid {os.getpid()} on {host}:{server.server_port}"
+        )
+    else:
+        logger.warning(f"No free metrics port in {port}-{port + tries - 1} on {host}")
+
+
 # Configure periodic tasks
 app.conf.beat_schedule = {
+    "send-pending-alerts": {
+        "task": "tracker.tasks.send_pending_alerts",
+        "schedule": 30.0,  # Drain the alert outbox every 30 seconds
+    },
     "check-daily-price-drops": {
         "task": "tracker.tasks.check_daily_price_drops",
         "schedule": crontab(hour=8, minute=0),  # Run every day at 8 AM
@@ -1,6 +1,7 @@
 from pathlib import Path
 import environ
 from datetime import timedelta
+from django.core.exceptions import ImproperlyConfigured
 
 env = environ.Env()
 
@@ -30,6 +31,9 @@ INSTALLED_APPS = [
 INSTALLED_APPS += ["accounts", "tracker"]
 
 MIDDLEWARE = [
+    "tracker.metrics.RequestMetricsMiddleware",
+    "tracker.queries.QueryCountMiddleware",
+    "django.middleware.gzip.GZipMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "corsheaders.middleware.CorsMiddleware",
@@ -42,6 +46,10 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = "core.urls"
 
+# Per-request/task query recording and N+1 warnings (see tracker.queries)
+QUERY_INSTRUMENTATION = env.bool("QUERY_INSTRUMENTATION", default=DEBUG)
+QUERY_REPEAT_THRESHOLD = 5
+
 TEMPLATES = [
     {
         "BACKEND": "django.template.backends.django.DjangoTemplates",
@@ -60,12 +68,59 @@ TEMPLATES = [
 
 WSGI_APPLICATION = "core.wsgi.application"
 
-DATABASES = {
-    "default": {
-        "ENGINE": "django.db.backends.sqlite3",
-        "NAME": BASE_DIR / "db.sqlite3",
+# "sqlite" for local development, "postgres" for production
+DATABASE_PROFILE = env("DATABASE_PROFILE", default="sqlite")
+
+if DATABASE_PROFILE == "postgres":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.postgresql",
+            "NAME": env("DATABASE_NAME", default="dealdoko"),
+            "USER": env("DATABASE_USER", default="postgres"),
+            "PASSWORD": env("DATABASE_PASSWORD", default=""),
+            "HOST": env("DATABASE_HOST", default="localhost"),
+            "PORT": env("DATABASE_PORT", default="5432"),
+            "CONN_HEALTH_CHECKS": True,
+        }
     }
-}
+    if env.bool("DATABASE_POOL", default=False):
+        # ? psycopg[pool]; Django refuses a pool together with persistent connections
+        DATABASES["default"]["CONN_MAX_AGE"] = 0
+        DATABASES["default"]["OPTIONS"] = {
+            "pool": {
+                "min_size": env.int("DATABASE_POOL_MIN_SIZE", default=2),
+                "max_size": env.int("DATABASE_POOL_MAX_SIZE", default=10),
+                "timeout": env.int("DATABASE_POOL_TIMEOUT", default=10),
+            }
+        }
+    else:
+        DATABASES["default"]["CONN_MAX_AGE"] = env.int(
+            "DATABASE_CONN_MAX_AGE", default=60
+        )
+elif DATABASE_PROFILE == "sqlite":
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": env("DATABASE_NAME", default=str(BASE_DIR / "db.sqlite3")),
+            "OPTIONS": {
+                # ? WAL lets API reads run while a refresh task holds the write lock
+                "init_command": (
+                    "PRAGMA journal_mode=WAL;"
+                    "PRAGMA synchronous=NORMAL;"
+                    f"PRAGMA busy_timeout={env.int('SQLITE_BUSY_TIMEOUT', default=5000)};"
+                    f"PRAGMA mmap_size={env.int('SQLITE_MMAP_SIZE', default=134217728)};"
+                    "PRAGMA temp_store=MEMORY"
+                ),
+                # ? take the write lock up front instead of failing on upgrade
+                "transaction_mode": "IMMEDIATE",
+                "timeout": 20,
+            },
+        }
+    }
+else:
+    raise ImproperlyConfigured(
+        f"Unknown DATABASE_PROFILE {DATABASE_PROFILE!r}, use 'sqlite' or 'postgres'"
+    )
 
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -100,8 +155,16 @@ REST_FRAMEWORK = {
     "DEFAULT_AUTHENTICATION_CLASSES": (
         "rest_framework_simplejwt.authentication.JWTAuthentication",
     ),
+    "DEFAULT_RENDERER_CLASSES": (
+        "tracker.renderers.ORJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+    ),
 }
 
+# Serve product list and detail from `.values()` rows instead of the
+# serializer (see tracker.serializers.product_rows)
+PRODUCT_FAST_READS = True
+
 SIMPLE_JWT = {
     "AUTH_HEADER_TYPES": ("Bearer",),
     "ACCESS_TOKEN_LIFETIME": timedelta(days=365),
@@ -128,6 +191,97 @@ EMAIL_FRONTEND_SITE_NAME = "NostalgiaBox"
 EMAIL_FRONTEND_DOMAIN = "localhost:5173"
 EMAIL_FRONTEND_PROTOCOL = "http"
 
+# Digest emails are sent in chunks over one SMTP connection (see tracker.digests)
+DIGEST_EMAIL_CHUNK_SIZE = env.int("DIGEST_EMAIL_CHUNK_SIZE", default=200)
+DIGEST_EMAIL_MAX_RETRIES = 3
+DIGEST_EMAIL_RETRY_DELAY = 5  # seconds, doubled on every retry
+
+# Instant alerts are queued in tracker.AlertOutbox and sent by a Celery task
+ALERT_OUTBOX_BATCH_SIZE = 100
+ALERT_OUTBOX_MAX_ATTEMPTS = 5
+ALERT_OUTBOX_BACKOFF = 60  # seconds, doubled on every failed attempt
+
+# Product refreshes run as fetch threads -> parser processes -> one DB writer
+# (see tracker.pipeline). 0 parse workers parses on a thread instead, as do
+# Celery prefork workers, which are daemonic and can't start processes. Run the
+# refresh queue on a threads or solo pool to parse in processes there
+REFRESH_FETCH_WORKERS = env.int("REFRESH_FETCH_WORKERS", default=8)
+REFRESH_PARSE_WORKERS = env.int("REFRESH_PARSE_WORKERS", default=2)
+REFRESH_QUEUE_SIZE = 16  # ? pages buffered between stages before fetchers block
+SCRAPER_DEBUG_HTML = env.bool("SCRAPER_DEBUG_HTML", default=False)
+# Compact JSON documents fetched instead of product pages (see tracker.stores),
+# as URL templates formatted with the product URL's url, origin, path and
+# item_id. Stores left out are scraped from their HTML. Shopify storefronts
+# serve /products/<handle>.js, which {"generic": "{origin}{path}.js"} would
+# use, but it costs an extra request for every other generic store
+STORE_JSON_ENDPOINTS = {}
+# Listing pages that carried no tracked item are refetched after this long, to
+# discover newly listed items (see tracker.listings)
+LISTING_REDISCOVER_AFTER = 24 * 60 * 60  # seconds
+# Stream pages and stop once the store's parser has what it needs
+SCRAPER_STREAMING = env.bool("SCRAPER_STREAMING", default=True)
+# Store items that fail to scrape wait SCRAPE_BACKOFF_BASE seconds before the
+# next try, doubled on every failure in a row up to SCRAPE_BACKOFF_MAX, and are
+# parked after the given number of failures of a kind (see tracker.failures)
+SCRAPE_BACKOFF_BASE = 3 * 60 * 60  # ? so a first failure is retried on the next run
+SCRAPE_BACKOFF_MAX = 7 * 24 * 60 * 60
+SCRAPE_PARK_AFTER = {
+    "gone": 3,
+    "parse": 8,
+    "timeout": 12,
+    "error": 12,
+    # ? being blocked says nothing about the item, so it's never parked
+    "blocked": None,
+}
+# Log every scrape's per-stage timing spans (see tracker.tracing)
+SCRAPE_TRACING = env.bool("SCRAPE_TRACING", default=False)
+
+# Old products are archived then deleted in small batches (see tracker.cleanup)
+CLEANUP_BATCH_SIZE = env.int("CLEANUP_BATCH_SIZE", default=500)
+CLEANUP_BATCH_PAUSE = env.float("CLEANUP_BATCH_PAUSE", default=0.5)  # seconds
+CLEANUP_ARCHIVE_DIR = env("CLEANUP_ARCHIVE_DIR", default=str(BASE_DIR / "archive"))
+
+# The API serves metrics at /api/metrics/, for whichever web worker process
+# answers. Celery has no HTTP server, so its main and pool processes each
+# serve their own, every one on the first free port from METRICS_EXPORTER_PORT
+# (0 disables) up to METRICS_EXPORTER_PORTS ports on; scrape that whole range.
+# The exporter has no authentication, so it listens on loopback unless
+# METRICS_EXPORTER_HOST says otherwise
+METRICS_EXPORTER_PORT = env.int("METRICS_EXPORTER_PORT", default=0)
+METRICS_EXPORTER_PORTS = 16  # ? at least the pool's concurrency + 1
+METRICS_EXPORTER_HOST = env("METRICS_EXPORTER_HOST", default="127.0.0.1")
+
+# Replaces the logging.basicConfig that tracker.utils used to run on import
+LOGGING = {
+    "version": 1,
+    "disable_existing_loggers": False,
+    "formatters": {
+        "verbose": {
+            "format": "%(asctime)s - %(name)s - %(levelname)s - %(message)s",
+        },
+    },
+    "handlers": {
+        "console": {
+            "class": "logging.StreamHandler",
+            "formatter": "verbose",
+        },
+    },
+    "root": {
+        "handlers": ["console"],
+        "level": env("LOG_LEVEL", default="INFO"),
+    },
+}
+
+# ? only log to a file when asked, e.g. LOG_FILE=scraper.log
+if env("LOG_FILE", default=""):
+    LOGGING["handlers"]["file"] = {
+        "class": "logging.FileHandler",
+        "filename": env("LOG_FILE"),
+        "formatter": "verbose",
+        "delay": True,  # ? the file is only opened on the first record
+    }
+    LOGGING["root"]["handlers"].append("file")
+
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
 
@@ -1,5 +1,12 @@
 from django.contrib import admin
-from .models import Product, UserPreference
+from .models import (
+    AlertOutbox,
+    ExtractionStrategyScore,
+    ListingPage,
+    Product,
+    ScrapeFailure,
+    UserPreference,
+)
 
 
 @admin.register(Product)
@@ -13,9 +20,17 @@ class ProductAdmin(admin.ModelAdmin):
         "is_in_stock",
         "last_checked",
     )
+    list_select_related = ("user",)
+    show_full_result_count = False
     list_filter = ("store", "is_in_stock", "created_at")
     search_fields = ("title", "user__email", "description")
-    readonly_fields = ("lowest_price", "highest_price", "last_checked", "created_at")
+    readonly_fields = (
+        "lowest_price",
+        "highest_price",
+        "price_points",
+        "last_checked",
+        "created_at",
+    )
     fieldsets = (
         (
             "Basic Information",
@@ -28,7 +43,7 @@ class ProductAdmin(admin.ModelAdmin):
                     "current_price",
                     "lowest_price",
                     "highest_price",
-                    "price_history",
+                    "price_points",
                     "alert_threshold",
                 )
             },
@@ -45,5 +60,54 @@ class UserPreferenceAdmin(admin.ModelAdmin):
         "notification_frequency",
         "target_price_drop",
     )
+    list_select_related = ("user",)
     list_filter = ("email_notifications", "notification_frequency")
     search_fields = ("user__email",)
+
+
+@admin.register(AlertOutbox)
+class AlertOutboxAdmin(admin.ModelAdmin):
+    list_display = ("subject", "user", "status", "attempts", "next_attempt_at")
+    list_select_related = ("user",)
+    list_filter = ("status",)
+    search_fields = ("user__email", "dedupe_key")
+    readonly_fields = ("created_at", "sent_at", "last_error")
+
+
+@admin.register(ListingPage)
+class ListingPageAdmin(admin.ModelAdmin):
+    list_display = ("__str__", "store", "is_active", "item_count", "last_fetched")
+    list_filter = ("store", "is_active")
+    search_fields = ("name", "url")
+    readonly_fields = ("item_keys", "last_fetched", "last_error", "created_at")
+
+    @admin.display(description="Items")
+    def item_count(self, obj):
+        return len(obj.item_keys)
+
+
+@admin.register(ExtractionStrategyScore)
+class ExtractionStrategyScoreAdmin(admin.ModelAdmin):
+    list_display = (
+        "store",
+        "fingerprint",
+        "strategy",
+        "score",
+        "attempts",
+        "updated_at",
+    )
+    list_filter = ("store", "strategy")
+    ordering = ("store", "fingerprint", "-score")
+
+
+@admin.register(ScrapeFailure)
+class ScrapeFailureAdmin(admin.ModelAdmin):
+    list_display = ("canonical_key", "kind", "failures", "parked", "retry_at")
+    list_filter = ("kind", "parked", "store")
+    search_fields = ("canonical_key", "url")
+    readonly_fields = ("first_failed_at", "last_failed_at", "message")
+    actions = ["retry_now"]
+
+    @admin.action(description="Retry on the next refresh")
+    def retry_now(self, request, queryset):
+        queryset.update(parked=False, retry_at=None)
@@ -0,0 +1,195 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.db.models import ExpressionWrapper, F, FloatField, Q
+from django.utils import timezone
+
+from .metrics import EMAIL_SECONDS, EMAILS
+from .models import AlertOutbox, Product
+
+logger = logging.getLogger(__name__)
+
+ALERT_FROM_EMAIL = "pricetrackerapp@example.com"
+
+
+def find_triggered_watchers(canonical_key, new_price, product_ids=None):
+    """
+    Products tracking `canonical_key` whose alert is newly satisfied by
+    `new_price`, ordered by threshold.
+
+    A watcher with an `alert_threshold` triggers when the price moves from
+    above the threshold to at or below it. Without a threshold, their
+    `target_price_drop` percentage below the highest price is used instead.
+    Only owners with instant email notifications are matched. Evaluate before
+    the new price is saved, since rows are compared to their stored price.
+    """
+    watchers = Product.objects.filter(
+        canonical_key=canonical_key,
+        user__preferences__email_notifications=True,
+        user__preferences__notification_frequency="instant",
+    )
+    if product_ids is not None:
+        watchers = watchers.filter(pk__in=product_ids)
+
+    return (
+        watchers.annotate(
+            target_price_drop=F("user__preferences__target_price_drop"),
+            # ? price at which the owner's percentage target is reached
+            target_price=ExpressionWrapper(
+                F("highest_price")
+                * (100 - F("user__preferences__target_price_drop"))
+                / 100.0,
+                output_field=FloatField(),
+            ),
+        )
+        .filter(
+            Q(alert_threshold__gte=new_price, alert_threshold__lt=F("current_price"))
+            | Q(
+                alert_threshold__isnull=True,
+                target_price__gte=new_price,
+                target_price__lt=F("current_price"),
+            )
+        )
+        .order_by(F("alert_threshold").asc(nulls_last=True))
+    )
+
+
+def price_alert_message(product, new_price):
+    """Subject and body of the alert for a triggered watcher"""
+    if product.alert_threshold is not None:
+        reason = f"below your alert at Rs. {product.alert_threshold}"
+    else:
+        reason = f"{product.target_price_drop}% below its highest price"
+
+    return (
+        "🔥 Price Drop Alert!",
+        f"The price of {product.title} has dropped from Rs. {product.current_price} "
+        f"to Rs. {new_price}, {reason}!",
+    )
+
+
+def queue_watcher_alerts(canonical_key, new_price, product_ids=None):
+    """
+    Queue instant alerts for every watcher triggered by `new_price` with one
+    matching query and one bulk insert.
+
+    Call it inside the transaction that saves the new price, before saving, so
+    the alerts are only ever sent for committed prices. Returns the number of
+    watchers matched.
+    """
+    alerts = []
+    for product in find_triggered_watchers(canonical_key, new_price, product_ids):
+        subject, message = price_alert_message(product, new_price)
+        alerts.append(
+            AlertOutbox(
+                user_id=product.user_id,
+                product=product,
+                subject=subject,
+                message=message,
+                dedupe_key=f"price-drop:{product.pk}:{new_price}:{timezone.localdate()}",
+            )
+        )
+
+    # ? repeat alerts for the same product, price and day are dropped
+    AlertOutbox.objects.bulk_create(alerts, ignore_conflicts=True)
+    return len(alerts)
+
+
+def claim_pending_alerts(batch_size, lease):
+    """
+    Claim a batch of due alerts by pushing their next attempt past the lease,
+    so concurrent workers skip them.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        ids = list(
+            AlertOutbox.objects.select_for_update(skip_locked=True)
+            .filter(status="pending", next_attempt_at__lte=now)
+            .order_by("next_attempt_at")
+            .values_list("id", flat=True)[:batch_size]
+        )
+        AlertOutbox.objects.filter(id__in=ids).update(next_attempt_at=now + lease)
+
+    return list(AlertOutbox.objects.filter(id__in=ids).select_related("user"))
+
+
+def drain_alert_outbox():
+    """
+    Send due alerts over one connection, backing off exponentially on failure.
+
+    Returns counts of sent, retried and failed alerts.
+    """
+    batch_size = getattr(settings, "ALERT_OUTBOX_BATCH_SIZE", 100)
+    max_attempts = getattr(settings, "ALERT_OUTBOX_MAX_ATTEMPTS", 5)
+    backoff = getattr(settings, "ALERT_OUTBOX_BACKOFF", 60)
+
+    alerts = claim_pending_alerts(batch_size, lease=timedelta(minutes=5))
+    stats = {"sent": 0, "retried": 0, "failed": 0}
+    if not alerts:
+        return stats
+
+    sent, retried = [], []
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+        for alert in alerts:
+            try:
+                with EMAIL_SECONDS.time(kind="alert"):
+                    connection.send_messages(
+                        [
+                            EmailMessage(
+                                alert.subject,
+                                alert.message,
+                                ALERT_FROM_EMAIL,
+                                [alert.user.email],
+                            )
+                        ]
+                    )
+                sent.append(alert)
+            except Exception as e:
+                alert.last_error = str(e)
+                retried.append(alert)
+    except Exception as e:
+        # ? couldn't connect at all, back off every unsent alert in the batch
+        logger.error(f"Failed to open email connection: {str(e)}")
+        done = {alert.pk for alert in sent + retried}
+        for alert in alerts:
+            if alert.pk not in done:
+                alert.last_error = str(e)
+                retried.append(alert)
+    finally:
+        connection.close()
+
+    now = timezone.now()
+    for alert in sent:
+        alert.status = "sent"
+        alert.sent_at = now
+        alert.attempts += 1
+    for alert in retried:
+        alert.attempts += 1
+        if alert.attempts >= max_attempts:
+            alert.status = "failed"
+            stats["failed"] += 1
+        else:
+            alert.next_attempt_at = now + timedelta(
+                seconds=backoff * 2 ** (alert.attempts - 1)
+            )
+            stats["retried"] += 1
+
+    AlertOutbox.objects.bulk_update(
+        sent + retried,
+        ["status", "sent_at", "attempts", "next_attempt_at", "last_error"],
+    )
+
+    stats["sent"] = len(sent)
+    for outcome, count in stats.items():
+        if count:
+            EMAILS.inc(count, kind="alert", outcome=outcome)
+    if retried:
+        logger.warning(f"Alert outbox: {stats}")
+    else:
+        logger.info(f"Alert outbox: {stats}")
+    return stats
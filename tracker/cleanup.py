@@ -0,0 +1,75 @@
+import gzip
+import json
+import logging
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+from .history import merge_history, series_to_history
+from .models import Product
+from .signals import bumps_deferred
+
+logger = logging.getLogger(__name__)
+
+
+def archive_path(prefix="products"):
+    """New gzipped NDJSON file in the configured archive directory"""
+    directory = Path(getattr(settings, "CLEANUP_ARCHIVE_DIR", "archive"))
+    directory.mkdir(parents=True, exist_ok=True)
+    stamp = timezone.now().strftime("%Y%m%dT%H%M%S")
+    return directory / f"{prefix}-{stamp}.ndjson.gz"
+
+
+def archive_and_delete(queryset, path, batch_size=None, pause=None):
+    """
+    Delete the products in `queryset` in bounded batches, appending each row
+    (price history included) to a gzipped NDJSON archive first.
+
+    Every batch is archived and deleted in its own short transaction, with a
+    pause in between so refresh tasks and API writes get the write lock.
+    Returns the number of products deleted.
+    """
+    if batch_size is None:
+        batch_size = getattr(settings, "CLEANUP_BATCH_SIZE", 500)
+    if pause is None:
+        pause = getattr(settings, "CLEANUP_BATCH_PAUSE", 0.5)
+
+    fields = [field.attname for field in Product._meta.concrete_fields]
+    deleted = 0
+
+    with gzip.open(path, "at", encoding="utf-8") as archive:
+        while True:
+            ids = list(
+                queryset.order_by("pk").values_list("pk", flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+
+            with transaction.atomic():
+                # ? re-apply the filter so rows refreshed meanwhile are kept
+                batch = queryset.filter(pk__in=ids)
+                rows = list(batch.values(*fields))
+                for row in rows:
+                    # ? legacy points too, in case they weren't encoded yet
+                    row["price_history"] = series_to_history(
+                        *merge_history(row.pop("price_series"), row["price_history"])
+                    )
+                    archive.write(json.dumps(row, cls=DjangoJSONEncoder) + "\n")
+                archive.flush()
+
+                # ? one version bump per owner rather than per deleted row
+                with bumps_deferred():
+                    batch.filter(pk__in=[row["id"] for row in rows]).delete()
+
+            deleted += len(rows)
+            logger.info(f"Archived and deleted {deleted} products so far")
+
+            if len(ids) < batch_size:
+                break
+            time.sleep(pause)
+
+    return deleted
@@ -0,0 +1,190 @@
+import logging
+import time
+from itertools import groupby, islice
+from operator import attrgetter
+
+from django.conf import settings
+from django.core.mail import EmailMultiAlternatives, get_connection
+from django.template.loader import get_template
+from django.utils import timezone
+
+from .metrics import EMAIL_SECONDS, EMAILS
+from .models import PriceDropEvent
+
+logger = logging.getLogger(__name__)
+
+DIGEST_FROM_EMAIL = "pricetrackerapp@example.com"
+DIGEST_BASE_URL = "http://yourdomain.com"  # Replace with your frontend URL
+
+
+def digest_products(frequency, since):
+    """
+    Yield `(user, products)` for every opted-in user whose products dropped in
+    price since `since`, read from the price drop events in a single query.
+
+    Each product gets `previous_price` (its price before the first drop in the
+    period) and `drop_percentage` attributes. Products that have since climbed
+    back to or above that price are left out.
+    """
+    events = (
+        PriceDropEvent.objects.filter(
+            created_at__gte=since,
+            user__preferences__email_notifications=True,
+            user__preferences__notification_frequency=frequency,
+        )
+        .select_related("user", "product")
+        .order_by("user_id", "created_at")
+    )
+
+    for user_id, user_events in groupby(
+        events.iterator(chunk_size=2000), key=attrgetter("user_id")
+    ):
+        user_events = list(user_events)
+        user = user_events[0].user
+
+        # ? events are oldest first, so the first one per product holds the
+        # ? price it had before the period's drops
+        products = {}
+        for event in user_events:
+            if event.product_id not in products:
+                product = event.product
+                product.previous_price = event.old_price
+                products[event.product_id] = product
+
+        dropped = []
+        for product in products.values():
+            if product.current_price < product.previous_price:
+                product.drop_percentage = round(
+                    (product.previous_price - product.current_price)
+                    / product.previous_price
+                    * 100,
+                    2,
+                )
+                dropped.append(product)
+
+        if dropped:
+            dropped.sort(key=attrgetter("drop_percentage"), reverse=True)
+            yield user, dropped
+
+
+def chunked(iterable, size):
+    iterator = iter(iterable)
+    while chunk := list(islice(iterator, size)):
+        yield chunk
+
+
+class DigestStats:
+    """Throughput counters for one digest run"""
+
+    def __init__(self, frequency):
+        self.frequency = frequency
+        self.sent = 0
+        self.failed = 0
+        self.chunks = 0
+        self.retries = 0
+        self.started = time.monotonic()
+
+    @property
+    def elapsed(self):
+        return time.monotonic() - self.started
+
+    def as_dict(self):
+        elapsed = self.elapsed
+        return {
+            "frequency": self.frequency,
+            "sent": self.sent,
+            "failed": self.failed,
+            "chunks": self.chunks,
+            "retries": self.retries,
+            "seconds": round(elapsed, 2),
+            "per_second": round(self.sent / elapsed, 2) if elapsed else 0.0,
+        }
+
+
+def send_chunk(connection, chunk, stats, max_retries, retry_delay):
+    """
+    Send one chunk over an open connection, retrying from the first unsent
+    message so nobody gets the same email twice.
+    """
+    pending = chunk
+    attempt = 0
+
+    while pending:
+        sent = 0
+        try:
+            if attempt:
+                # ? the connection is usually dead after an SMTP error. If the
+                # ? server is still down, reopening fails like any attempt
+                connection.close()
+                connection.open()
+            for message in pending:
+                with EMAIL_SECONDS.time(kind="digest"):
+                    connection.send_messages([message])
+                sent += 1
+                EMAILS.inc(kind="digest", outcome="sent")
+            stats.sent += sent
+            return
+        except Exception as e:
+            stats.sent += sent
+            pending = pending[sent:]
+            attempt += 1
+
+            if attempt > max_retries:
+                logger.error(
+                    f"Giving up on {len(pending)} {stats.frequency} digest emails: {str(e)}"
+                )
+                stats.failed += len(pending)
+                EMAILS.inc(len(pending), kind="digest", outcome="failed")
+                return
+
+            stats.retries += 1
+            EMAILS.inc(kind="digest", outcome="retried")
+            logger.warning(
+                f"Digest chunk failed ({str(e)}), retry {attempt}/{max_retries}"
+            )
+            time.sleep(retry_delay * 2 ** (attempt - 1))
+
+
+def send_price_drop_digests(frequency, period, template_name, subject, plain_message):
+    """
+    Render and send the price drop digest for every user on `frequency`.
+
+    Emails are sent in chunks over one persistent connection. `plain_message`
+    is formatted with the user's username. Returns throughput stats.
+    """
+    chunk_size = getattr(settings, "DIGEST_EMAIL_CHUNK_SIZE", 200)
+    max_retries = getattr(settings, "DIGEST_EMAIL_MAX_RETRIES", 3)
+    retry_delay = getattr(settings, "DIGEST_EMAIL_RETRY_DELAY", 5)
+
+    since = timezone.now() - period
+    template = get_template(template_name)  # ? compiled once per run
+    stats = DigestStats(frequency)
+
+    def messages():
+        for user, products in digest_products(frequency, since):
+            context = {
+                "user": user,
+                "products": products,
+                "base_url": DIGEST_BASE_URL,
+            }
+            message = EmailMultiAlternatives(
+                subject=subject,
+                body=plain_message.format(username=user.username),
+                from_email=DIGEST_FROM_EMAIL,
+                to=[user.email],
+            )
+            message.attach_alternative(template.render(context), "text/html")
+            yield message
+
+    connection = get_connection(fail_silently=False)
+    connection.open()
+    try:
+        for chunk in chunked(messages(), chunk_size):
+            stats.chunks += 1
+            send_chunk(connection, chunk, stats, max_retries, retry_delay)
+    finally:
+        connection.close()
+
+    result = stats.as_dict()
+    logger.info(f"Sent {frequency} price drop digests: {result}")
+    return result
@@ -0,0 +1,85 @@
+import csv
+
+import orjson
+
+from .history import merge_history, series_to_history
+from .serializers import ProductSerializer, product_rows, render_product_row
+
+EXPORT_FORMATS = {"csv": "text/csv", "ndjson": "application/x-ndjson"}
+
+# ? the catalog, one row per product, or its history, one row per price point
+PRODUCT_FIELDS = [
+    name for name in ProductSerializer.Meta.fields if name != "price_history"
+]
+HISTORY_FIELDS = ["product_id", "url", "store", "date", "price"]
+EXPORT_FIELDS = {"products": PRODUCT_FIELDS, "history": HISTORY_FIELDS}
+
+# Rows fetched per round trip. On PostgreSQL iterator() reads them from a
+# server-side cursor, so memory doesn't grow with the export
+CHUNK_SIZE = 500
+# ? rows are written out in blocks of about this many bytes, which also
+# ? gives GZipMiddleware something worth compressing
+BLOCK_SIZE = 64 * 1024
+
+
+def product_records(products):
+    for row in product_rows(products, PRODUCT_FIELDS).iterator(chunk_size=CHUNK_SIZE):
+        yield render_product_row(row, PRODUCT_FIELDS)
+
+
+def history_records(products):
+    rows = products.values("id", "url", "store", "price_series", "price_history")
+    for row in rows.iterator(chunk_size=CHUNK_SIZE):
+        history = merge_history(row["price_series"], row["price_history"])
+        for point in series_to_history(*history):
+            yield {
+                "product_id": row["id"],
+                "url": row["url"],
+                "store": row["store"],
+                **point,
+            }
+
+
+class _Line:
+    """File-like object handing back what csv.writer writes"""
+
+    def write(self, value):
+        return value
+
+
+def csv_lines(records, fields):
+    writer = csv.writer(_Line())
+    yield writer.writerow(fields)
+    for record in records:
+        yield writer.writerow([record[name] for name in fields])
+
+
+def ndjson_lines(records):
+    for record in records:
+        yield orjson.dumps(record, option=orjson.OPT_APPEND_NEWLINE).decode()
+
+
+def export_products(products, export_format="csv", data="products"):
+    """
+    Yield `products`, a queryset, as CSV or NDJSON in blocks of bytes,
+    holding only a chunk of rows in memory at a time. `data` is "products"
+    for the catalog or "history" for every price point.
+    """
+    fields = EXPORT_FIELDS[data]
+    records = (product_records if data == "products" else history_records)(
+        products.order_by("id")
+    )
+    if export_format == "csv":
+        lines = csv_lines(records, fields)
+    else:
+        lines = ndjson_lines(records)
+
+    block, size = [], 0
+    for line in lines:
+        block.append(line)
+        size += len(line)
+        if size >= BLOCK_SIZE:
+            yield "".join(block).encode()
+            block, size = [], 0
+    if block:
+        yield "".join(block).encode()
@@ -0,0 +1,78 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import ScrapeFailure
+
+logger = logging.getLogger(__name__)
+
+
+def classify_error(stage, error):
+    """
+    Kind of a failure in the pipeline's fetch or parse `stage`: gone,
+    blocked, timeout, error or parse. `error` is None if the page parsed but
+    had no price.
+    """
+    import requests
+
+    if stage == "parse":
+        return "parse"
+    if isinstance(error, requests.Timeout):
+        return "timeout"
+    response = getattr(error, "response", None)
+    if isinstance(error, requests.HTTPError) and response is not None:
+        if response.status_code in [404, 410]:
+            return "gone"
+        if response.status_code in [401, 403, 429]:
+            return "blocked"
+    return "error"
+
+
+def backoff_delay(failures):
+    """How long to wait before scraping an item that failed `failures` times"""
+    base = getattr(settings, "SCRAPE_BACKOFF_BASE", 3 * 60 * 60)
+    cap = getattr(settings, "SCRAPE_BACKOFF_MAX", 7 * 24 * 60 * 60)
+    return timedelta(seconds=min(base * 2 ** (failures - 1), cap))
+
+
+def should_park(kind, failures):
+    park_after = getattr(settings, "SCRAPE_PARK_AFTER", {}).get(kind)
+    return park_after is not None and failures >= park_after
+
+
+def backed_off_keys():
+    """Canonical keys that refreshes should skip for now"""
+    return ScrapeFailure.objects.filter(
+        Q(parked=True) | Q(retry_at__gt=timezone.now())
+    ).values("canonical_key")
+
+
+def record_failure(canonical_key, url, store, kind, message):
+    """Count another consecutive failure of a store item and back it off"""
+    now = timezone.now()
+    failure, created = ScrapeFailure.objects.get_or_create(
+        canonical_key=canonical_key,
+        defaults={"url": url, "store": store, "first_failed_at": now},
+    )
+    failure.failures += 1
+    failure.kind = kind
+    failure.message = message[:1000]
+    failure.last_failed_at = now
+    failure.retry_at = now + backoff_delay(failure.failures)
+    failure.parked = should_park(kind, failure.failures)
+    failure.save()
+
+    if failure.parked:
+        logger.warning(
+            f"Parked {canonical_key} after {failure.failures} {kind} failures: {url}"
+        )
+    return failure
+
+
+def clear_failures(canonical_keys):
+    """Forget the failures of items that were just scraped successfully"""
+    if canonical_keys:
+        ScrapeFailure.objects.filter(canonical_key__in=canonical_keys).delete()
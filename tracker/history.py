@@ -0,0 +1,225 @@
+import struct
+import zlib
+from datetime import datetime, timezone as dt_timezone
+
+import numpy as np
+from django.utils.dateparse import parse_date, parse_datetime
+
+# Named bucket widths in seconds
+RESOLUTIONS = {
+    "hour": 60 * 60,
+    "day": 24 * 60 * 60,
+    "week": 7 * 24 * 60 * 60,
+}
+
+MAX_POINTS = 500
+
+# Encoded price series: magic, format version and run count, then a zlib
+# compressed little-endian int64 body (see encode_series)
+SERIES_MAGIC = b"PS"
+SERIES_VERSION = 1
+SERIES_HEADER = struct.Struct("<2sBI")
+
+
+def parse_bound(value):
+    """
+    Parse a `from`/`to` query value (ISO date or datetime) into epoch seconds.
+
+    Naive values are treated as UTC, which is how price history is stored.
+    Returns None for an empty value and raises ValueError if it can't be parsed.
+    """
+    if not value:
+        return None
+
+    parsed = parse_datetime(value)
+    if parsed is None:
+        day = parse_date(value)
+        if day is None:
+            raise ValueError(f"Invalid date: '{value}'")
+        parsed = datetime(day.year, day.month, day.day)
+
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=dt_timezone.utc)
+    return int(parsed.timestamp())
+
+
+def history_arrays(price_history):
+    """
+    Convert a list of `{"date", "price"}` dicts into sorted NumPy arrays of
+    epoch seconds and prices.
+    """
+    if not price_history:
+        return np.empty(0, dtype="int64"), np.empty(0, dtype="float64")
+
+    timestamps = (
+        np.array([point["date"] for point in price_history], dtype="datetime64[us]")
+        .astype("datetime64[s]")
+        .astype("int64")
+    )
+    prices = np.array([point["price"] for point in price_history], dtype="float64")
+
+    order = np.argsort(timestamps, kind="stable")
+    return timestamps[order], prices[order]
+
+
+def encode_series(timestamps, prices):
+    """
+    Encode a price series into a compact binary blob.
+
+    Consecutive points with an unchanged price collapse into one run that keeps
+    only its first and last timestamp. Run starts, run lengths (in seconds) and
+    prices (in paisa) are delta-encoded as int64 and zlib compressed, so a long
+    and mostly flat history costs a few bytes per price change.
+    """
+    timestamps = np.asarray(timestamps, dtype="int64")
+    cents = np.rint(np.asarray(prices, dtype="float64") * 100).astype("int64")
+
+    if not timestamps.size:
+        return b""
+
+    # ? a run starts wherever the price differs from the previous point
+    starts = np.flatnonzero(np.diff(cents, prepend=cents[0] - 1))
+    ends = np.append(starts[1:], timestamps.size) - 1
+
+    run_starts = timestamps[starts]
+    body = np.concatenate(
+        [
+            np.diff(run_starts, prepend=0),
+            timestamps[ends] - run_starts,
+            np.diff(cents[starts], prepend=0),
+        ]
+    )
+    header = SERIES_HEADER.pack(SERIES_MAGIC, SERIES_VERSION, starts.size)
+    return header + zlib.compress(body.astype("<i8").tobytes())
+
+
+def decode_series(blob):
+    """
+    Decode a blob from `encode_series` into NumPy arrays of epoch seconds and
+    prices. Each run decodes to its first point, plus its last point if the
+    price held for a while.
+    """
+    if not blob:
+        return np.empty(0, dtype="int64"), np.empty(0, dtype="float64")
+
+    blob = bytes(blob)
+    magic, version, runs = SERIES_HEADER.unpack_from(blob)
+    if magic != SERIES_MAGIC or version != SERIES_VERSION:
+        raise ValueError("Unknown price series format")
+
+    body = np.frombuffer(zlib.decompress(blob[SERIES_HEADER.size :]), dtype="<i8")
+    run_starts = np.cumsum(body[:runs])
+    spans = body[runs : 2 * runs]
+    prices = np.cumsum(body[2 * runs :]) / 100
+
+    # ? interleave run starts with the ends of runs that span any time
+    timestamps = np.column_stack([run_starts, run_starts + spans]).ravel()
+    prices = np.repeat(prices, 2)
+    keep = np.ones(timestamps.size, dtype=bool)
+    keep[1::2] = spans > 0
+    return timestamps[keep], prices[keep]
+
+
+def append_point(blob, timestamp, price):
+    """Return `blob` with one more point at the end of the series"""
+    timestamps, prices = decode_series(blob)
+    return encode_series(np.append(timestamps, timestamp), np.append(prices, price))
+
+
+def merge_history(blob, points):
+    """
+    The encoded series in `blob` plus the legacy `{"date", "price"}` list
+    `points`, as sorted arrays of epoch seconds and prices
+    """
+    timestamps, prices = decode_series(blob)
+    if not points:
+        return timestamps, prices
+    legacy_timestamps, legacy_prices = history_arrays(points)
+    timestamps = np.concatenate([legacy_timestamps, timestamps])
+    prices = np.concatenate([legacy_prices, prices])
+    order = np.argsort(timestamps, kind="stable")
+    return timestamps[order], prices[order]
+
+
+def series_to_history(timestamps, prices):
+    """Decoded series as the `[{"date", "price"}]` list the API has always returned"""
+    # ? formatted by NumPy in one go, the same as naive UTC isoformat()
+    dates = np.datetime_as_string(
+        np.asarray(timestamps, dtype="int64").astype("datetime64[s]")
+    )
+    return [
+        {"date": date, "price": price}
+        for date, price in zip(
+            dates.tolist(), np.asarray(prices, dtype="float64").tolist()
+        )
+    ]
+
+
+def bucket_width(span, resolution="auto", max_points=MAX_POINTS):
+    """
+    Pick the bucket width in seconds for a time span, widening the requested
+    resolution if it would produce more than `max_points` buckets.
+    """
+    # ? smallest width that keeps the bucket count within max_points
+    minimum = span // (max_points - 1) + 1
+
+    if resolution == "auto":
+        for width in RESOLUTIONS.values():
+            if width >= minimum:
+                return width
+        return minimum
+
+    if resolution not in RESOLUTIONS:
+        raise ValueError(f"Invalid resolution: '{resolution}'")
+    return max(RESOLUTIONS[resolution], minimum)
+
+
+def downsample(timestamps, prices, start=None, end=None, resolution="auto"):
+    """
+    Bucket a price series into min/max/avg/last values.
+
+    Returns `(width, buckets)` where each bucket is a dict keyed by its start
+    date. Buckets without any points are left out.
+    """
+    mask = np.ones(timestamps.size, dtype=bool)
+    if start is not None:
+        mask &= timestamps >= start
+    if end is not None:
+        mask &= timestamps <= end
+    timestamps = timestamps[mask]
+    prices = prices[mask]
+
+    low = start if start is not None else (timestamps[0] if timestamps.size else 0)
+    high = end if end is not None else (timestamps[-1] if timestamps.size else 0)
+    width = bucket_width(max(int(high) - int(low), 0), resolution)
+
+    if not timestamps.size:
+        return width, []
+
+    keys = timestamps // width
+    boundaries = np.flatnonzero(np.diff(keys)) + 1
+    starts = np.concatenate(([0], boundaries))
+    ends = np.append(boundaries, timestamps.size)
+
+    counts = ends - starts
+    mins = np.minimum.reduceat(prices, starts)
+    maxs = np.maximum.reduceat(prices, starts)
+    avgs = np.add.reduceat(prices, starts) / counts
+    lasts = prices[ends - 1]
+
+    buckets = [
+        {
+            "date": datetime.fromtimestamp(
+                int(key) * width, tz=dt_timezone.utc
+            ).isoformat(),
+            "min": float(low_price),
+            "max": float(high_price),
+            "avg": round(float(avg), 2),
+            "last": float(last),
+            "count": int(count),
+        }
+        for key, low_price, high_price, avg, last, count in zip(
+            keys[starts], mins, maxs, avgs, lasts, counts
+        )
+    ]
+    return width, buckets
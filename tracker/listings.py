@@ -0,0 +1,52 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from .models import ListingPage
+from .stores import get_adapter
+
+logger = logging.getLogger(__name__)
+
+
+def listing_pages_for(tracked_keys):
+    """
+    Active listing pages that carried any of `tracked_keys` on their last
+    fetch, plus new and stale pages so newly listed items get discovered.
+    """
+    rediscover_after = getattr(settings, "LISTING_REDISCOVER_AFTER", 86400)
+    stale = timezone.now() - timedelta(seconds=rediscover_after)
+
+    return [
+        page
+        for page in ListingPage.objects.filter(is_active=True).order_by("pk")
+        if page.last_fetched is None
+        or page.last_fetched < stale
+        or tracked_keys.intersection(page.item_keys)
+    ]
+
+
+def refresh_from_listings(tracked_keys):
+    """
+    Fetch each listing page covering `tracked_keys` once and return the
+    scraped data of every tracked item found, keyed by canonical key.
+    """
+    found = {}
+    for page in listing_pages_for(tracked_keys):
+        adapter = get_adapter(page.store)
+        try:
+            items = adapter.parse_listing(adapter.fetch_listing(page.url))
+        except Exception as e:
+            logger.warning(f"Listing page {page.url} failed: {str(e)}")
+            ListingPage.objects.filter(pk=page.pk).update(last_error=str(e))
+            continue
+
+        ListingPage.objects.filter(pk=page.pk).update(
+            item_keys=sorted(items), last_fetched=timezone.now(), last_error=""
+        )
+        for key in tracked_keys.intersection(items):
+            found.setdefault(key, items[key])
+
+    logger.info(f"Listing pages priced {len(found)} of {len(tracked_keys)} items")
+    return found
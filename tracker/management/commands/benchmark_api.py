@@ -0,0 +1,162 @@
+import gzip
+import json
+import statistics
+import time
+from contextlib import contextmanager
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test.utils import override_settings
+from rest_framework.renderers import BrowsableAPIRenderer, JSONRenderer
+from rest_framework.test import APIClient
+
+from tracker.history import encode_series
+from tracker.models import CollectionVersion, Product
+from tracker.renderers import ORJSONRenderer
+from tracker.views import ProductViewSet
+
+from .benchmark_db import percentile
+
+User = get_user_model()
+
+BENCHMARK_USERNAME = "benchmark-api"
+
+# ? (name, fast read path, renderer) in the order they are reported
+MODES = [
+    ("serializer + json", False, JSONRenderer),
+    ("values + orjson", True, ORJSONRenderer),
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Request the product list and detail endpoints for a user with many "
+        "products, through the serializer and json, and through the fast read "
+        "path and orjson, and report requests/s for each"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--products", type=int, default=500)
+        parser.add_argument(
+            "--requests", type=int, default=200, help="per endpoint and mode"
+        )
+        parser.add_argument(
+            "--history", type=int, default=90, help="price points per product"
+        )
+        parser.add_argument(
+            "--no-gzip", action="store_true", help="don't ask for gzip responses"
+        )
+
+    def handle(self, *args, **options):
+        user = self.setup(options["products"], options["history"])
+        product = Product.objects.filter(user=user).first()
+        endpoints = [
+            ("list", "/api/products/"),
+            ("list, 200 expanded", "/api/products/?expand=true&page_size=200"),
+            ("detail", f"/api/products/{product.pk}/"),
+        ]
+        client = APIClient()
+        client.force_authenticate(user)
+        headers = {} if options["no_gzip"] else {"HTTP_ACCEPT_ENCODING": "gzip"}
+
+        results = {}
+        try:
+            # ? DEBUG would record every query, ALLOWED_HOSTS may not allow
+            # ? the test client's host
+            with override_settings(DEBUG=False, ALLOWED_HOSTS=["*"]):
+                for mode in MODES:
+                    with self.mode(*mode[1:]):
+                        for endpoint, path in endpoints:
+                            results[mode[0], endpoint] = self.run(
+                                client, path, options["requests"], headers
+                            )
+        finally:
+            user.delete()
+
+        self.report(results, endpoints, options)
+
+    def setup(self, count, points):
+        User.objects.filter(username=BENCHMARK_USERNAME).delete()
+        user = User.objects.create_user("benchmark-api@example.com", BENCHMARK_USERNAME)
+        CollectionVersion.current(user.pk)
+
+        start = int(time.time()) - points * 86400
+        products = []
+        for i in range(count):
+            prices = [1000 - (day * 7 + i) % 300 for day in range(points)]
+            product = Product(
+                url=f"https://www.daraz.com.np/products/benchmark-i{i}.html",
+                title=f"Benchmark product {i}",
+                current_price=prices[-1],
+                lowest_price=min(prices),
+                highest_price=max(prices),
+                image_url=f"https://static.daraz.com.np/benchmark-{i}.jpg",
+                description="A product for benchmarking. " * 20,
+                price_series=encode_series(
+                    [start + day * 86400 for day in range(points)], prices
+                ),
+                store="daraz",
+                user=user,
+            )
+            product.canonical_key = f"daraz:benchmark-{i}"
+            products.append(product)
+        Product.objects.bulk_create(products)
+        return user
+
+    @contextmanager
+    def mode(self, fast_reads, renderer):
+        with override_settings(PRODUCT_FAST_READS=fast_reads), mock.patch.object(
+            ProductViewSet, "renderer_classes", [renderer, BrowsableAPIRenderer]
+        ):
+            yield
+
+    def run(self, client, path, count, headers):
+        # ? warm up caches and lazy imports
+        for _ in range(5):
+            client.get(path, **headers)
+
+        timings = []
+        for _ in range(count):
+            start = time.perf_counter()
+            response = client.get(path, **headers)
+            timings.append(time.perf_counter() - start)
+            assert response.status_code == 200, response.status_code
+
+        content = response.content
+        if response.get("Content-Encoding") == "gzip":
+            content = gzip.decompress(content)
+        return {
+            "timings": timings,
+            "bytes": len(response.content),
+            "data": json.loads(content),
+        }
+
+    def report(self, results, endpoints, options):
+        self.stdout.write(
+            f"{options['products']} products, {options['history']} price points "
+            f"each, {options['requests']} requests per endpoint"
+            + (", gzip" if not options["no_gzip"] else "")
+        )
+        baseline = MODES[0][0]
+        for endpoint, _ in endpoints:
+            self.stdout.write(self.style.MIGRATE_HEADING(endpoint))
+            for name, *_ in MODES:
+                result = results[name, endpoint]
+                timings = result["timings"]
+                rate = len(timings) / sum(timings)
+                speedup = rate / (
+                    len(timings) / sum(results[baseline, endpoint]["timings"])
+                )
+                self.stdout.write(
+                    f"  {name:<18} {rate:>8.1f} req/s  x{speedup:<5.2f} "
+                    f"p50 {statistics.median(timings) * 1000:>7.2f} ms  "
+                    f"p95 {percentile(timings, 0.95) * 1000:>7.2f} ms  "
+                    f"{result['bytes'] / 1024:>8.1f} KiB"
+                )
+
+            if any(
+                results[name, endpoint]["data"] != results[baseline, endpoint]["data"]
+                for name, *_ in MODES
+            ):
+                self.stdout.write(self.style.ERROR("  responses differ"))
@@ -0,0 +1,158 @@
+import random
+import statistics
+import threading
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import OperationalError, close_old_connections, connection, transaction
+
+from tracker.models import CollectionVersion, Product
+
+User = get_user_model()
+
+BENCHMARK_USERNAME = "benchmark-db"
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+class Command(BaseCommand):
+    help = (
+        "Run a mixed read/write load against the configured database profile "
+        "and report throughput, latency and lock errors"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--threads", type=int, default=8)
+        parser.add_argument("--duration", type=float, default=10, help="seconds")
+        parser.add_argument(
+            "--write-ratio",
+            type=float,
+            default=0.2,
+            help="share of operations that save a new price",
+        )
+        parser.add_argument("--products", type=int, default=200)
+
+    def handle(self, *args, **options):
+        user = self.setup(options["products"])
+        product_ids = list(
+            Product.objects.filter(user=user).values_list("pk", flat=True)
+        )
+
+        results = {"read": [], "write": [], "errors": []}
+        lock = threading.Lock()
+        deadline = time.monotonic() + options["duration"]
+
+        def worker():
+            reads, writes, errors = [], [], []
+            while time.monotonic() < deadline:
+                # ? what request_started/finished do around every API request
+                close_old_connections()
+                is_write = random.random() < options["write_ratio"]
+                start = time.perf_counter()
+                try:
+                    if is_write:
+                        self.write(random.choice(product_ids))
+                    else:
+                        self.read(user)
+                except OperationalError as e:
+                    errors.append(str(e))
+                    continue
+                (writes if is_write else reads).append(time.perf_counter() - start)
+            connection.close()
+
+            with lock:
+                results["read"] += reads
+                results["write"] += writes
+                results["errors"] += errors
+
+        threads = [threading.Thread(target=worker) for _ in range(options["threads"])]
+        try:
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        finally:
+            user.delete()
+
+        self.report(results, options)
+
+    def setup(self, count):
+        User.objects.filter(username=BENCHMARK_USERNAME).delete()
+        user = User.objects.create_user("benchmark-db@example.com", BENCHMARK_USERNAME)
+        CollectionVersion.current(user.pk)
+
+        products = []
+        for i in range(count):
+            product = Product(
+                url=f"https://www.daraz.com.np/products/benchmark-i{i}.html",
+                title=f"Benchmark product {i}",
+                current_price=1000,
+                lowest_price=1000,
+                highest_price=1000,
+                store="daraz",
+                user=user,
+            )
+            product.canonical_key = f"daraz:benchmark-{i}"
+            products.append(product)
+        Product.objects.bulk_create(products)
+        return user
+
+    def read(self, user):
+        # ? first page of the product list endpoint
+        list(
+            Product.objects.filter(user=user)
+            .defer("description", "price_series")
+            .order_by("-created_at")[:50]
+        )
+
+    def write(self, product_id):
+        with transaction.atomic():
+            product = Product.objects.get(pk=product_id)
+            product.current_price = random.randint(500, 1500)
+            product.save()
+
+    def report(self, results, options):
+        database = settings.DATABASES["default"]
+        reads, writes, errors = results["read"], results["write"], results["errors"]
+        total = len(reads) + len(writes)
+
+        self.stdout.write(
+            f"Profile: {settings.DATABASE_PROFILE} ({connection.vendor}), "
+            f"CONN_MAX_AGE={database.get('CONN_MAX_AGE', 0)}, "
+            f"pool={'pool' in database.get('OPTIONS', {})}"
+        )
+        if connection.vendor == "sqlite":
+            with connection.cursor() as cursor:
+                cursor.execute("PRAGMA journal_mode")
+                self.stdout.write(f"Journal mode: {cursor.fetchone()[0]}")
+        connection.close()
+
+        self.stdout.write(
+            f"{options['threads']} threads, {options['duration']}s, "
+            f"write ratio {options['write_ratio']}"
+        )
+        self.stdout.write(
+            f"Throughput: {total / options['duration']:.1f} ops/s "
+            f"({len(reads)} reads, {len(writes)} writes)"
+        )
+        for label, samples in (("Reads", reads), ("Writes", writes)):
+            if samples:
+                self.stdout.write(
+                    f"{label}: p50 {statistics.median(samples) * 1000:.1f} ms, "
+                    f"p95 {percentile(samples, 0.95) * 1000:.1f} ms, "
+                    f"p99 {percentile(samples, 0.99) * 1000:.1f} ms"
+                )
+
+        if errors:
+            self.stdout.write(
+                self.style.WARNING(f"Errors: {len(errors)} ({statistics.mode(errors)})")
+            )
+        else:
+            self.stdout.write(self.style.SUCCESS("Errors: 0"))
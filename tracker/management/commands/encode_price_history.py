@@ -0,0 +1,48 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from tracker.history import encode_series, merge_history
+from tracker.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Move price history stored in the legacy price_history JSON list into "
+        "the encoded price_series, keeping points recorded since. Safe to run "
+        "again; converted rows are left with an empty list"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+
+    def handle(self, *args, **options):
+        pending = Product.objects.exclude(price_history=[]).only(
+            "id", "price_history", "price_series"
+        )
+        converted = points = 0
+
+        while True:
+            with transaction.atomic():
+                batch = list(
+                    pending.select_for_update().order_by("pk")[: options["batch_size"]]
+                )
+                if not batch:
+                    break
+                for product in batch:
+                    # ? the old code reset anything but a list before appending
+                    legacy = product.price_history
+                    if not isinstance(legacy, list):
+                        legacy = []
+                    points += len(legacy)
+                    product.price_series = encode_series(
+                        *merge_history(product.price_series, legacy)
+                    )
+                    product.price_history = []
+                # ? bulk_update skips save(), which would append a new point
+                Product.objects.bulk_update(batch, ["price_series", "price_history"])
+            converted += len(batch)
+            self.stdout.write(f"  {converted} products converted")
+
+        self.stdout.write(
+            self.style.SUCCESS(f"Encoded {points} points of {converted} products")
+        )
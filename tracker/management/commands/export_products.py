@@ -0,0 +1,55 @@
+import gzip
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+
+from tracker.exports import EXPORT_FIELDS, EXPORT_FORMATS, export_products
+from tracker.models import Product
+
+
+class Command(BaseCommand):
+    help = (
+        "Stream products, or their price history, to CSV or NDJSON without "
+        "loading them all into memory. Output ending in .gz is gzipped"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=list(EXPORT_FORMATS), default="csv")
+        parser.add_argument(
+            "--data",
+            choices=list(EXPORT_FIELDS),
+            default="products",
+            help="one row per product, or per price point",
+        )
+        parser.add_argument("--store", action="append", help="repeatable")
+        parser.add_argument(
+            "--user", action="append", help="username or email, repeatable"
+        )
+        parser.add_argument("--output", "-o", help="file to write (default: stdout)")
+
+    def handle(self, *args, **options):
+        products = Product.objects.all()
+        if options["store"]:
+            products = products.filter(store__in=options["store"])
+        if options["user"]:
+            products = products.filter(
+                Q(user__username__in=options["user"])
+                | Q(user__email__in=options["user"])
+            )
+
+        blocks = export_products(products, options["format"], options["data"])
+        output = options["output"]
+        if not output:
+            for block in blocks:
+                self.stdout.write(block.decode(), ending="")
+            return
+
+        opener = gzip.open if output.endswith(".gz") else open
+        written = 0
+        with opener(output, "wb") as file:
+            for block in blocks:
+                file.write(block)
+                written += len(block)
+        self.stderr.write(
+            f"Wrote {written / 1024:.1f} KiB of {options['data']} to {output}"
+        )
@@ -0,0 +1,118 @@
+import json
+import os
+import re
+import subprocess
+import sys
+from collections import defaultdict
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+# What each kind of process imports before it can serve its first job
+TARGETS = {
+    "web": ["core.wsgi", "core.urls"],
+    "worker": ["core.celery", "tracker.tasks"],
+}
+
+# Modules that should only be loaded by processes that actually scrape.
+# requests is left out as rest_framework.compat imports it when installed
+SCRAPER_MODULES = ["bs4"]
+
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+) \|\s+(\d+) \|( *)(\S+)$")
+
+
+def measure_imports(modules):
+    """
+    Import `modules` in a fresh interpreter with `-X importtime` after Django
+    setup. Returns the parsed `(module, self_us, cumulative_us, depth)` rows and
+    the set of modules loaded.
+    """
+    script = (
+        "import json, sys, django\n"
+        "django.setup()\n"
+        + "".join(f"import {module}\n" for module in modules)
+        + "print(json.dumps(sorted(sys.modules)))\n"
+    )
+    env = {
+        **os.environ,
+        "DJANGO_SETTINGS_MODULE": os.environ.get(
+            "DJANGO_SETTINGS_MODULE", "core.settings"
+        ),
+    }
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", script],
+        capture_output=True,
+        text=True,
+        cwd=settings.BASE_DIR,
+        env=env,
+    )
+    if result.returncode:
+        raise CommandError(result.stderr.strip().splitlines()[-1])
+
+    rows = []
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, module = match.groups()
+            rows.append((module, int(self_us), int(cumulative_us), len(indent) // 2))
+    return rows, set(json.loads(result.stdout.strip().splitlines()[-1]))
+
+
+class Command(BaseCommand):
+    help = "Break down the import time of web and worker process startup"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "targets",
+            nargs="*",
+            default=list(TARGETS),
+            help=f"{', '.join(TARGETS)} or dotted module paths",
+        )
+        parser.add_argument(
+            "--top", type=int, default=15, help="number of packages to list"
+        )
+        parser.add_argument(
+            "--json", action="store_true", help="print a machine-readable summary"
+        )
+
+    def handle(self, *args, **options):
+        summary = {}
+        for target in options["targets"]:
+            rows, loaded = measure_imports(TARGETS.get(target, [target]))
+
+            # ? top-level rows already include everything imported beneath them
+            total = sum(cumulative for _, _, cumulative, depth in rows if depth == 0)
+            packages = defaultdict(int)
+            for module, self_us, _, _ in rows:
+                packages[module.split(".")[0]] += self_us
+
+            summary[target] = {
+                "total_ms": round(total / 1000, 1),
+                "modules": len(rows),
+                "scraper_modules": [m for m in SCRAPER_MODULES if m in loaded],
+                "packages_ms": {
+                    package: round(us / 1000, 1)
+                    for package, us in sorted(
+                        packages.items(), key=lambda item: item[1], reverse=True
+                    )[: options["top"]]
+                },
+            }
+
+        if options["json"]:
+            self.stdout.write(json.dumps(summary, indent=2))
+            return
+
+        for target, result in summary.items():
+            self.stdout.write(
+                self.style.MIGRATE_HEADING(
+                    f"{target}: {result['total_ms']} ms, {result['modules']} modules"
+                )
+            )
+            for package, ms in result["packages_ms"].items():
+                self.stdout.write(f"  {package:<30} {ms:>8} ms")
+            if result["scraper_modules"]:
+                self.stdout.write(
+                    self.style.WARNING(
+                        f"  scraper stack loaded: {', '.join(result['scraper_modules'])}"
+                    )
+                )
@@ -0,0 +1,168 @@
+import cProfile
+import io
+import pstats
+import statistics
+import tracemalloc
+from collections import defaultdict
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from tracker.stores import ADAPTERS, fetch_product, parse_fetched
+from tracker.strategies import load_ranking
+from tracker.tracing import Trace
+from tracker.utils import detect_store
+
+
+def source_store(source):
+    """The store of a URL, or of a page saved as `<store>_raw.html`"""
+    if "://" in source:
+        return detect_store(source)
+    prefix = Path(source).name.split("_")[0]
+    return prefix if prefix in ADAPTERS else "generic"
+
+
+class Command(BaseCommand):
+    help = (
+        "Scrape fixture files or live URLs under cProfile and tracemalloc and "
+        "report time per stage, hot functions and memory use"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "sources",
+            nargs="*",
+            help="saved pages or product URLs (default: daraz_raw.html)",
+        )
+        parser.add_argument(
+            "--store", help="store parser to use (default: from the URL or file name)"
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=1, help="times to scrape each source"
+        )
+        parser.add_argument(
+            "--top", type=int, default=20, help="number of functions and lines to list"
+        )
+        parser.add_argument(
+            "--sort", choices=["cumulative", "tottime"], default="cumulative"
+        )
+        parser.add_argument(
+            "--no-memory",
+            action="store_true",
+            help="skip tracemalloc, which slows everything down",
+        )
+
+    def handle(self, *args, **options):
+        sources = options["sources"] or [str(settings.BASE_DIR / "daraz_raw.html")]
+        for source in sources:
+            if "://" not in source and not Path(source).is_file():
+                raise CommandError(f"No such file: {source}")
+
+        # ? loaded up front so their import time doesn't rank as a hot spot
+        import bs4  # noqa: F401
+        import requests  # noqa: F401
+
+        # ? try extraction strategies in the order refreshes would
+        load_ranking()
+
+        profiler = cProfile.Profile()
+        spans = defaultdict(list)
+        peaks = {}
+        trace_memory = not options["no_memory"]
+        if trace_memory:
+            tracemalloc.start()
+            baseline = tracemalloc.take_snapshot()
+
+        for round in range(options["repeat"]):
+            for source in sources:
+                store = options["store"] or source_store(source)
+                trace = Trace("profile", source=source)
+                if trace_memory:
+                    tracemalloc.reset_peak()
+
+                with trace.activate():
+                    profiler.enable()
+                    try:
+                        data = self.scrape(source, store)
+                    finally:
+                        profiler.disable()
+
+                if trace_memory:
+                    peaks[source] = max(
+                        peaks.get(source, 0), tracemalloc.get_traced_memory()[1]
+                    )
+                for span in trace.as_dict()["spans"]:
+                    spans[(span["depth"], span["name"])].append(span["ms"])
+                if round == 0:
+                    self.report_result(source, store, data)
+
+        if trace_memory:
+            ignored = [
+                tracemalloc.Filter(False, module.__file__)
+                for module in (cProfile, tracemalloc)
+            ]
+            retained = (
+                tracemalloc.take_snapshot()
+                .filter_traces(ignored)
+                .compare_to(baseline.filter_traces(ignored), "lineno")
+            )
+            tracemalloc.stop()
+
+        self.report_spans(spans)
+        self.report_profile(profiler, options)
+        if trace_memory:
+            self.report_memory(peaks, retained, options["top"])
+
+    def scrape(self, source, store):
+        if "://" in source:
+            kind, body = fetch_product(source, store)
+        else:
+            kind = "json" if source.endswith(".json") else "html"
+            body = Path(source).read_text(encoding="utf-8")
+        return parse_fetched(kind, body, store)
+
+    def report_result(self, source, store, data):
+        if data:
+            self.stdout.write(
+                f"{source}: {store}, {data.get('strategy')}, "
+                f"price {data.get('price')}"
+            )
+        else:
+            self.stdout.write(self.style.WARNING(f"{source}: {store}, no data"))
+
+    def report_spans(self, spans):
+        self.stdout.write(self.style.MIGRATE_HEADING("Stages"))
+        # ? in the order stages first started, so nested ones follow their parent
+        for (depth, name), samples in spans.items():
+            label = f"{'  ' * depth}{name}"
+            self.stdout.write(
+                f"  {label:<24} {len(samples):>5}x  "
+                f"median {statistics.median(samples):>9.2f} ms  "
+                f"total {sum(samples):>10.2f} ms"
+            )
+
+    def report_profile(self, profiler, options):
+        self.stdout.write(
+            self.style.MIGRATE_HEADING(f"Hot spots (by {options['sort']})")
+        )
+        stream = io.StringIO()
+        stats = pstats.Stats(profiler, stream=stream)
+        stats.strip_dirs().sort_stats(options["sort"]).print_stats(options["top"])
+        # ? skip pstats' preamble, up to the column headers
+        text = stream.getvalue()
+        self.stdout.write(text[text.find("   ncalls") :].rstrip())
+
+    def report_memory(self, peaks, retained, top):
+        self.stdout.write(self.style.MIGRATE_HEADING("Memory"))
+        for source, peak in peaks.items():
+            self.stdout.write(f"  peak {peak / 1024:>10.1f} KiB  {source}")
+
+        self.stdout.write("  retained after scraping, by line:")
+        grown = [stat for stat in retained if stat.size_diff > 0]
+        for stat in grown[:top]:
+            frame = stat.traceback[0]
+            self.stdout.write(
+                f"  {stat.size_diff / 1024:>10.1f} KiB  {stat.count_diff:>6} blocks  "
+                f"{frame.filename}:{frame.lineno}"
+            )
@@ -0,0 +1,220 @@
+import json
+import time
+from datetime import timedelta
+from pathlib import Path
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db.models import Q
+from django.utils import timezone
+
+from tracker.failures import backed_off_keys
+from tracker.models import Product
+from tracker.refresh import fill_canonical_keys, refresh_products
+
+COUNTS = [
+    "updated",
+    "price_drops",
+    "missing",
+    "skipped",
+    "listed",
+    "fetch_errors",
+    "write_errors",
+]
+
+
+class Command(BaseCommand):
+    help = (
+        "Refresh selected products in this process, in batches of store items, "
+        "checkpointing after each batch so an interrupted run can be resumed. "
+        "Nothing is queued on Celery"
+    )
+
+    def add_arguments(self, parser):
+        selection = parser.add_argument_group("selection")
+        selection.add_argument("--store", action="append", help="repeatable")
+        selection.add_argument(
+            "--user", action="append", help="username or email, repeatable"
+        )
+        selection.add_argument(
+            "--stale",
+            type=float,
+            metavar="HOURS",
+            help="only products not checked for this many hours",
+        )
+        selection.add_argument("--min-id", type=int)
+        selection.add_argument("--max-id", type=int)
+
+        parser.add_argument("--fetch-workers", type=int)
+        parser.add_argument("--parse-workers", type=int)
+        parser.add_argument(
+            "--batch-size",
+            type=int,
+            default=200,
+            help="store items refreshed between checkpoints",
+        )
+        parser.add_argument(
+            "--no-listings",
+            action="store_true",
+            help="scrape every item's own page, even if a listing page has it",
+        )
+        parser.add_argument(
+            "--retry-failing",
+            action="store_true",
+            help="include items that are backed off or parked after failing",
+        )
+        parser.add_argument(
+            "--dry-run",
+            action="store_true",
+            help="fetch and parse, but save nothing and report what would change",
+        )
+        parser.add_argument(
+            "--checkpoint",
+            default=str(settings.BASE_DIR / "refresh_products.checkpoint.json"),
+        )
+        parser.add_argument(
+            "--resume",
+            action="store_true",
+            help="continue after the last completed batch of the checkpoint",
+        )
+
+    def handle(self, *args, **options):
+        selection = {
+            name: options[name]
+            for name in ["store", "user", "stale", "min_id", "max_id"]
+            if options[name] is not None
+        }
+        products = self.select(selection)
+        if not options["dry_run"]:
+            # ? batches and the checkpoint go by key, which blank rows lack
+            fill_canonical_keys(products)
+        checkpoint = Path(options["checkpoint"])
+        counts = dict.fromkeys(COUNTS, 0)
+
+        if options["resume"]:
+            if not checkpoint.exists():
+                raise CommandError(f"No checkpoint at {checkpoint}")
+            state = json.loads(checkpoint.read_text())
+            if state["selection"] != selection:
+                raise CommandError(
+                    f"The checkpoint is for another selection: {state['selection']}"
+                )
+            counts.update(state["counts"])
+            products = products.filter(canonical_key__gt=state["last_key"])
+            self.stdout.write(f"Resuming after {state['last_key']}")
+        elif checkpoint.exists() and not options["dry_run"]:
+            self.stdout.write(
+                self.style.WARNING(f"Replacing the unfinished run in {checkpoint}")
+            )
+
+        if not options["retry_failing"]:
+            # ? counted across the whole selection, so a resumed run's
+            # ? checkpoint already has them
+            if not options["resume"]:
+                counts["skipped"] = (
+                    products.filter(canonical_key__in=backed_off_keys())
+                    .values("canonical_key")
+                    .distinct()
+                    .count()
+                )
+            products = products.exclude(canonical_key__in=backed_off_keys())
+
+        keys = list(
+            products.order_by("canonical_key")
+            .values_list("canonical_key", flat=True)
+            .distinct()
+        )
+        batch_size = max(options["batch_size"], 1)
+        self.stdout.write(
+            f"{len(keys)} store items ({products.count()} products) to refresh"
+            + (", dry run" if options["dry_run"] else "")
+        )
+
+        started = time.monotonic()
+        done = 0
+        try:
+            for i in range(0, len(keys), batch_size):
+                batch = keys[i : i + batch_size]
+                result = refresh_products(
+                    products.filter(canonical_key__in=batch),
+                    fetch_workers=options["fetch_workers"],
+                    parse_workers=options["parse_workers"],
+                    listings=not options["no_listings"],
+                    dry_run=options["dry_run"],
+                    # ? backed off items were already left out above
+                    backoff=False,
+                )
+                stages = result["stages"]
+                result["fetch_errors"] = stages["fetch"]["errors"]
+                result["write_errors"] = stages["write"]["errors"]
+                for name in COUNTS:
+                    counts[name] += result[name]
+                done += len(batch)
+
+                if not options["dry_run"]:
+                    checkpoint.write_text(
+                        json.dumps(
+                            {
+                                "selection": selection,
+                                "last_key": batch[-1],
+                                "counts": counts,
+                            }
+                        )
+                    )
+                elapsed = time.monotonic() - started
+                self.stdout.write(
+                    f"  {done}/{len(keys)} items, {done / elapsed:.1f} items/s, "
+                    f"{counts['fetch_errors']} fetch errors"
+                )
+        except KeyboardInterrupt:
+            self.stdout.write(
+                self.style.WARNING(
+                    f"Interrupted after {done} items; run again with --resume"
+                )
+            )
+            self.report(counts, done, time.monotonic() - started)
+            return
+
+        if checkpoint.exists() and not options["dry_run"]:
+            checkpoint.unlink()
+        self.report(counts, done, time.monotonic() - started)
+
+    def select(self, selection):
+        products = Product.objects.all()
+        if "store" in selection:
+            products = products.filter(store__in=selection["store"])
+        if "user" in selection:
+            products = products.filter(
+                Q(user__username__in=selection["user"])
+                | Q(user__email__in=selection["user"])
+            )
+        if "stale" in selection:
+            products = products.filter(
+                last_checked__lt=timezone.now() - timedelta(hours=selection["stale"])
+            )
+        if "min_id" in selection:
+            products = products.filter(pk__gte=selection["min_id"])
+        if "max_id" in selection:
+            products = products.filter(pk__lte=selection["max_id"])
+        return products
+
+    def report(self, counts, items, elapsed):
+        self.stdout.write(self.style.MIGRATE_HEADING("Summary"))
+        self.stdout.write(
+            f"  {items} store items in {elapsed:.1f}s "
+            f"({items / elapsed if elapsed else 0:.1f} items/s)"
+        )
+        self.stdout.write(
+            f"  {counts['updated']} products updated, "
+            f"{counts['price_drops']} price drops, {counts['listed']} from listings, "
+            f"{counts['skipped']} backed off after failing"
+        )
+        failures = counts["missing"] + counts["write_errors"]
+        style = self.style.WARNING if failures else self.style.SUCCESS
+        self.stdout.write(
+            style(
+                f"  {counts['missing']} items without data "
+                f"({counts['fetch_errors']} fetch errors), "
+                f"{counts['write_errors']} write errors"
+            )
+        )
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand
+
+from tracker.models import Product, canonical_product_key
+
+
+class Command(BaseCommand):
+    help = (
+        "Recompute every product's canonical key, after the way keys are "
+        "derived from URLs changed. Refreshes group rows by these keys"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500)
+        parser.add_argument(
+            "--dry-run", action="store_true", help="count the keys that would change"
+        )
+
+    def handle(self, *args, **options):
+        products = Product.objects.only("id", "url", "store", "canonical_key")
+        changed = []
+        total = 0
+        for product in products.iterator(chunk_size=options["batch_size"]):
+            key = canonical_product_key(product.url, product.store)
+            if key != product.canonical_key:
+                product.canonical_key = key
+                changed.append(product)
+            total += 1
+
+        # ? bulk_update skips save(), whose price bookkeeping doesn't apply
+        if not options["dry_run"]:
+            Product.objects.bulk_update(
+                changed, ["canonical_key"], batch_size=options["batch_size"]
+            )
+        self.stdout.write(
+            f"{len(changed)} of {total} canonical keys "
+            + ("would change" if options["dry_run"] else "updated")
+        )
@@ -0,0 +1,285 @@
+import threading
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """A named metric with one value per combination of label values"""
+
+    type = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """`(suffix, labels, value)` for every exported sample"""
+        with self._lock:
+            values = dict(self._values)
+        for key, value in sorted(values.items()):
+            yield "", dict(zip(self.labelnames, key)), value
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {_escape(self.documentation)}",
+            f"# TYPE {self.name} {self.type}",
+        ]
+        for suffix, labels, value in self.samples():
+            label_text = ",".join(f'{k}="{_escape(v)}"' for k, v in labels.items())
+            label_text = f"{{{label_text}}}" if label_text else ""
+            lines.append(f"{self.name}{suffix}{label_text} {_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    type = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+
+class Histogram(Metric):
+    type = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            # ? [per-bucket counts, sum, count]; count doubles as the +Inf bucket
+            state = self._values.setdefault(key, [[0] * len(self.buckets), 0.0, 0])
+            index = bisect_left(self.buckets, value)
+            if index < len(self.buckets):
+                state[0][index] += 1
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            values = {
+                key: (list(c), total, n) for key, (c, total, n) in self._values.items()
+            }
+        for key, (counts, total, count) in sorted(values.items()):
+            labels = dict(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                bucket_labels = {**labels, "le": _format_value(float(bound))}
+                yield "_bucket", bucket_labels, cumulative
+            yield "_bucket", {**labels, "le": "+Inf"}, count
+            yield "_sum", labels, total
+            yield "_count", labels, count
+
+
+class Registry:
+    """
+    Metrics of this process, rendered in the Prometheus text format.
+
+    Collectors are callables returning extra metrics built at render time,
+    for state that is already tracked elsewhere.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+        self._lock = threading.Lock()
+
+    def _register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def counter(self, name, documentation, labelnames=()):
+        return self._register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self._register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        metrics = list(self._metrics.values())
+        for collector in self._collectors:
+            metrics.extend(collector())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+registry = Registry()
+
+FETCH_SECONDS = registry.histogram(
+    "dealdoko_fetch_seconds", "Time to download a product page", ["store"]
+)
+FETCH_RESPONSES = registry.counter(
+    "dealdoko_fetch_responses_total",
+    "Store responses by HTTP status",
+    ["store", "status"],
+)
+PARSE_SECONDS = registry.histogram(
+    "dealdoko_parse_seconds", "Time to extract product data from a page", ["store"]
+)
+EXTRACTIONS = registry.counter(
+    "dealdoko_extractions_total",
+    "Parsed pages by the extraction strategy that produced the data",
+    ["store", "strategy"],
+)
+ZERO_PRICES = registry.counter(
+    "dealdoko_zero_price_total", "Parsed pages without a usable price", ["store"]
+)
+WRITE_SECONDS = registry.histogram(
+    "dealdoko_refresh_write_seconds", "Database write time per refreshed store item"
+)
+REFRESH_SECONDS = registry.histogram(
+    "dealdoko_refresh_run_seconds",
+    "Duration of full product refresh runs",
+    buckets=(10, 30, 60, 120, 300, 600, 1200, 1800, 3600, 7200),
+)
+REFRESH_LAST_RUN = registry.gauge(
+    "dealdoko_refresh_last_run_timestamp_seconds", "When the last refresh run finished"
+)
+EMAIL_SECONDS = registry.histogram(
+    "dealdoko_email_send_seconds", "Time to send one email", ["kind"]
+)
+EMAILS = registry.counter(
+    "dealdoko_emails_total", "Emails by kind and outcome", ["kind", "outcome"]
+)
+TASK_SECONDS = registry.histogram(
+    "dealdoko_task_seconds",
+    "Celery task run time",
+    ["task"],
+    buckets=(0.1, 0.5, 1, 5, 10, 30, 60, 300, 900, 1800, 3600),
+)
+REQUEST_SECONDS = registry.histogram(
+    "dealdoko_http_request_seconds", "API request latency", ["view", "method", "status"]
+)
+
+
+def transfer_metrics():
+    """Fetcher byte and page counters from `utils.transfer_stats`"""
+    from .utils import transfer_stats
+
+    transferred = Counter(
+        "dealdoko_fetch_bytes_total",
+        "Bytes fetched per store: wire (compressed), decoded, and saved by stopping early",
+        ["store", "kind"],
+    )
+    events = Counter(
+        "dealdoko_fetch_events_total",
+        "Fetcher events per store: pages, pages per content coding, early stops, "
+        "JSON endpoint hits and fallbacks, listing pages",
+        ["store", "event"],
+    )
+    for store, counts in transfer_stats.as_dict().items():
+        for name, value in counts.items():
+            if name.endswith("_bytes") or name.startswith("bytes_"):
+                kind = name.replace("_bytes", "").replace("bytes_", "")
+                transferred.inc(value, store=store, kind=kind)
+            else:
+                events.inc(value, store=store, event=name)
+    return [transferred, events]
+
+
+registry.add_collector(transfer_metrics)
+
+
+class RequestMetricsMiddleware:
+    """Records API request latency per view, method and status"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        start = time.perf_counter()
+        response = self.get_response(request)
+
+        match = getattr(request, "resolver_match", None)
+        # ? view names keep the label set bounded, unlike raw paths
+        view = match.view_name if match else "unmatched"
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - start,
+            view=view,
+            method=request.method,
+            status=response.status_code,
+        )
+        return response
+
+
+class ExporterHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        body = registry.render().encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_exporter(port, tries=1, host="127.0.0.1"):
+    """
+    Serve this process's metrics over HTTP in a background thread, on the
+    first free port from `port` on. There is no authentication, so it only
+    listens on loopback unless given another `host`. Returns the server, or
+    None if every port was taken.
+    """
+    for candidate in range(port, port + tries):
+        try:
+            server = ThreadingHTTPServer((host, candidate), ExporterHandler)
+        except OSError:
+            continue
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        return server
+    return None
@@ -1,6 +1,39 @@
+import re
+from urllib.parse import parse_qs, urlparse
+
 from django.db import models
+from django.db.models import F, Q
+from django.utils import timezone
 from accounts.models import User
 
+# Store item ids embedded in product URLs. Every matched group is part of the
+# key, so Daraz SKU variants, which are priced separately, get their own
+CANONICAL_ID_PATTERNS = {
+    "daraz": re.compile(r"-i(\d+)(-s\d+)?\.html"),
+    "amazon": re.compile(r"/(?:dp|gp/product)/([A-Z0-9]{10})"),
+    "aliexpress": re.compile(r"/item/(\d+)\.html"),
+}
+
+
+def canonical_product_key(url, store):
+    """
+    Identify the store item behind a product URL, so every user's row for the
+    same item shares one key regardless of tracking parameters.
+    """
+    parsed = urlparse(url)
+
+    pattern = CANONICAL_ID_PATTERNS.get(store)
+    match = pattern.search(parsed.path) if pattern else None
+    if match:
+        return f"{store}:{''.join(group for group in match.groups() if group)}"
+
+    if store == "flipkart":
+        pid = parse_qs(parsed.query).get("pid")
+        if pid:
+            return f"flipkart:{pid[0]}"
+
+    return f"{store}:{parsed.netloc.lower()}{parsed.path.rstrip('/')}"[:255]
+
 
 class Product(models.Model):
     url = models.URLField()
@@ -12,17 +45,41 @@ class Product(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="products")
     image_url = models.URLField(blank=True, null=True)
     description = models.TextField(blank=True, null=True)
+    # ? history from before price_series, no longer written. Kept until
+    # ? `manage.py encode_price_history` has moved it into price_series
     price_history = models.JSONField(default=list)
+    # ? encoded with history.encode_series, exposed through price_points
+    price_series = models.BinaryField(default=bytes, blank=True, editable=False)
     alert_threshold = models.IntegerField(null=True, blank=True)
     is_in_stock = models.BooleanField(default=True)
     store = models.CharField(max_length=50, default="daraz")  # Store identifier
+    # ? same store item across users, see canonical_product_key
+    canonical_key = models.CharField(max_length=255, blank=True, editable=False)
     created_at = models.DateTimeField(auto_now_add=True)
 
     class Meta:
         unique_together = ("url", "user")  # One user can track a URL only once
+        indexes = [
+            # ? product list: filter(user=...).order_by("-created_at")
+            models.Index(
+                fields=["user", "-created_at"], name="product_user_created_idx"
+            ),
+            # ? cleanup: last_checked__lt=cutoff
+            models.Index(fields=["last_checked"], name="product_last_checked_idx"),
+            # ? refresh/admin filters on store and stock status
+            models.Index(
+                fields=["store", "is_in_stock"], name="product_store_stock_idx"
+            ),
+            # ? alert fan-out: canonical_key=... and alert_threshold >= new price
+            models.Index(
+                fields=["canonical_key", "alert_threshold"],
+                name="product_canonical_alert_idx",
+            ),
+        ]
 
     def save(self, *args, **kwargs):
         is_new = self.pk is None
+        self.canonical_key = canonical_product_key(self.url, self.store)
         if is_new:
             self.lowest_price = self.current_price
             self.highest_price = self.current_price
@@ -35,19 +92,37 @@ class Product(models.Model):
         super().save(*args, **kwargs)
 
         if not is_new:
-            from datetime import datetime
+            import time
+            from .history import append_point
+
+            self.price_series = append_point(
+                self.price_series, int(time.time()), self.current_price
+            )
+            super().save(update_fields=["price_series"])
 
-            timestamp = datetime.now().isoformat()
+    def price_arrays(self):
+        """
+        Price history as NumPy arrays of epoch seconds and prices, including
+        legacy points not yet moved into price_series
+        """
+        from .history import merge_history
 
-            if not isinstance(self.price_history, list):
-                self.price_history = []
+        return merge_history(self.price_series, self.price_history)
 
-            self.price_history.append({"date": timestamp, "price": self.current_price})
+    @property
+    def price_points(self):
+        """Price history as a list of `{"date", "price"}` dicts"""
+        from .history import series_to_history
 
-            if len(self.price_history) > 100:
-                self.price_history = self.price_history[-100:]
+        return series_to_history(*self.price_arrays())
 
-            super().save(update_fields=["price_history"])
+    @price_points.setter
+    def price_points(self, points):
+        from .history import encode_series, history_arrays
+
+        self.price_series = encode_series(*history_arrays(points))
+        # ? `points` replaces the whole history, legacy points included
+        self.price_history = []
 
     def __str__(self):
         return f"{self.title} - {self.user.email}"
@@ -67,3 +142,195 @@ class UserPreference(models.Model):
 
     def __str__(self):
         return f"Preferences for {self.user.email}"
+
+
+class PriceDropEvent(models.Model):
+    """A price drop seen while refreshing a product"""
+
+    product = models.ForeignKey(
+        Product, on_delete=models.CASCADE, related_name="price_drops"
+    )
+    # ? denormalized from product so digests can range-scan per user
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="price_drops")
+    old_price = models.FloatField()
+    new_price = models.FloatField()
+    drop_percentage = models.FloatField()
+    created_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["created_at"], name="pricedrop_created_idx"),
+            models.Index(
+                fields=["user", "created_at"], name="pricedrop_user_created_idx"
+            ),
+        ]
+
+    @classmethod
+    def build(cls, product, old_price, new_price):
+        """Unsaved event for a drop from `old_price` to `new_price`, if it is one"""
+        if not old_price or new_price >= old_price:
+            return None
+
+        return cls(
+            product=product,
+            user_id=product.user_id,
+            old_price=old_price,
+            new_price=new_price,
+            drop_percentage=round(((old_price - new_price) / old_price) * 100, 2),
+        )
+
+    @classmethod
+    def record(cls, product, old_price, new_price):
+        """Store a drop from `old_price` to `new_price`, if it is one"""
+        event = cls.build(product, old_price, new_price)
+        if event:
+            event.save()
+        return event
+
+    def __str__(self):
+        return f"{self.product_id}: Rs. {self.old_price} -> Rs. {self.new_price}"
+
+
+class CollectionVersion(models.Model):
+    """Per-user counter bumped whenever the user's products or preferences change"""
+
+    user = models.OneToOneField(
+        User,
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="collection_version",
+    )
+    version = models.PositiveBigIntegerField(default=0)
+
+    @classmethod
+    def current(cls, user_id):
+        # ? the row is created on first read so later bumps only need an UPDATE
+        obj, created = cls.objects.get_or_create(user_id=user_id)
+        return obj.version
+
+    @classmethod
+    def bump(cls, user_id):
+        cls.objects.filter(user_id=user_id).update(version=F("version") + 1)
+
+    def __str__(self):
+        return f"Collection version {self.version} for user {self.user_id}"
+
+
+class AlertOutbox(models.Model):
+    """
+    Instant alert emails waiting to be sent.
+
+    Rows are written in the same transaction as the price update that caused
+    them and drained by the `send_pending_alerts` task.
+    """
+
+    STATUS_CHOICES = [("pending", "Pending"), ("sent", "Sent"), ("failed", "Failed")]
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="alerts")
+    product = models.ForeignKey(
+        Product, on_delete=models.SET_NULL, null=True, blank=True, related_name="alerts"
+    )
+    subject = models.CharField(max_length=255)
+    message = models.TextField()
+    # ? repeat alerts for the same product and price collapse into one row
+    dedupe_key = models.CharField(max_length=255, unique=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default="pending")
+    attempts = models.PositiveSmallIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=["next_attempt_at"],
+                condition=Q(status="pending"),
+                name="outbox_pending_idx",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.subject} ({self.status})"
+
+
+class ListingPage(models.Model):
+    """
+    A store category, search or flash-sale page whose items are priced in bulk.
+
+    Refreshes fetch it once and update every tracked product listed on it,
+    so those products skip their own page scrape.
+    """
+
+    url = models.URLField(max_length=500, unique=True)
+    store = models.CharField(max_length=50, default="daraz")
+    name = models.CharField(max_length=255, blank=True)
+    is_active = models.BooleanField(default=True)
+    # ? canonical keys listed on the last fetch, see canonical_product_key
+    item_keys = models.JSONField(default=list, blank=True, editable=False)
+    last_fetched = models.DateTimeField(null=True, blank=True)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return self.name or self.url
+
+
+class ExtractionStrategyScore(models.Model):
+    """
+    How well one extraction strategy has been doing on a store's pages, as a
+    decayed success score. Parsers try the best scoring strategy first; see
+    tracker.strategies.
+    """
+
+    store = models.CharField(max_length=50)
+    # ? page template, see page_fingerprint. Blank for the store as a whole
+    fingerprint = models.CharField(max_length=40, blank=True)
+    strategy = models.CharField(max_length=50)
+    score = models.FloatField()
+    attempts = models.PositiveIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=["store", "fingerprint", "strategy"],
+                name="strategy_score_unique",
+            )
+        ]
+
+    def __str__(self):
+        return (
+            f"{self.store} {self.fingerprint or '*'} {self.strategy}: {self.score:.2f}"
+        )
+
+
+class ScrapeFailure(models.Model):
+    """
+    A store item whose latest scrapes failed, and when to try it again.
+
+    Refreshes skip it until `retry_at`, doubling the wait on every failure in
+    a row, and skip it for good once parked. A successful scrape deletes it.
+    """
+
+    KIND_CHOICES = [
+        ("gone", "Gone (404/410)"),
+        ("blocked", "Blocked (401/403/429)"),
+        ("timeout", "Timed out"),
+        ("parse", "No price found"),
+        ("error", "Other error"),
+    ]
+
+    canonical_key = models.CharField(max_length=255, unique=True)
+    url = models.URLField()
+    store = models.CharField(max_length=50)
+    kind = models.CharField(max_length=10, choices=KIND_CHOICES, blank=True)
+    message = models.TextField(blank=True)
+    failures = models.PositiveIntegerField(default=0)  # ? in a row
+    first_failed_at = models.DateTimeField()
+    last_failed_at = models.DateTimeField(null=True, blank=True)
+    retry_at = models.DateTimeField(null=True, blank=True)
+    parked = models.BooleanField(default=False)
+
+    def __str__(self):
+        return f"{self.canonical_key}: {self.failures} x {self.kind}"
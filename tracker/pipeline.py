@@ -0,0 +1,268 @@
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+
+from django.conf import settings
+
+from .metrics import EXTRACTIONS, PARSE_SECONDS, WRITE_SECONDS, ZERO_PRICES
+from . import strategies
+from .stores import fetch_product, parse_fetched
+from .tracing import Trace, activated, span, tracing_enabled
+
+logger = logging.getLogger(__name__)
+
+# Marks the end of a stage's output
+_DONE = object()
+# ? how often threads blocked on a queue check whether the pipeline stopped
+_POLL = 0.1
+
+
+def _put(q, item, stop):
+    """Put `item` on `q`, unless `stop` is set while waiting for room"""
+    while not stop.is_set():
+        try:
+            q.put(item, timeout=_POLL)
+            return True
+        except queue.Full:
+            pass
+    return False
+
+
+def _get(q, stop):
+    """Next item from `q`, or _DONE once `stop` is set"""
+    while not stop.is_set():
+        try:
+            return q.get(timeout=_POLL)
+        except queue.Empty:
+            pass
+    return _DONE
+
+
+class StageMetrics:
+    """Throughput counters for one pipeline stage"""
+
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.errors = 0
+        self.busy = 0.0  # ? seconds spent working, summed over the stage's workers
+        self.started = time.monotonic()
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def record(self, seconds, error=False):
+        with self._lock:
+            self.items += 1
+            self.errors += error
+            self.busy += seconds
+
+    def finish(self):
+        self.finished = time.monotonic()
+
+    def as_dict(self):
+        elapsed = (self.finished or time.monotonic()) - self.started
+        return {
+            "items": self.items,
+            "errors": self.errors,
+            "busy_seconds": round(self.busy, 2),
+            "seconds": round(elapsed, 2),
+            "per_second": round(self.items / elapsed, 2) if elapsed else 0.0,
+        }
+
+
+def record_extraction(store, data):
+    """Count which extraction strategy produced `data`, and missing prices"""
+    strategy = data.get("strategy", "unknown") if data else "failed"
+    EXTRACTIONS.inc(store=store, strategy=strategy)
+    if not data or not data.get("price"):
+        ZERO_PRICES.inc(store=store)
+
+
+def timed_parse(kind, body, store, traced=False):
+    """
+    Parse in a worker process, returning the result, the time it took, the
+    extraction strategy outcomes to record in the parent and, when `traced`,
+    the spans recorded while parsing
+    """
+    trace = Trace("parse") if traced else None
+    start = time.perf_counter()
+    with activated(trace), strategies.capture_outcomes() as outcomes:
+        data = parse_fetched(kind, body, store)
+    seconds = time.perf_counter() - start
+    return data, seconds, outcomes, trace.spans if trace else None
+
+
+def run_refresh_pipeline(
+    items, write, fetch_workers=None, parse_workers=None, on_error=None
+):
+    """
+    Fetch, parse and write `items`, `(key, url, store)` tuples, in three stages.
+
+    Fetcher threads download pages into a bounded queue. A dispatcher hands
+    them to a pool of parser processes, so parsing isn't serialized on the
+    GIL, and a bounded queue of pending parses feeds `write(key, data)`, which
+    runs on the calling thread, so all database work stays on one connection.
+    A full queue blocks the stage feeding it. `data` is None when the fetch
+    or parse failed. Returns per-stage metrics.
+
+    In a daemonic process, such as a Celery prefork worker, pages are parsed
+    on the dispatcher thread instead.
+
+    Items without a price are first passed to `on_error(key, stage, error)`
+    on the same thread, with the stage that failed, "fetch" or "parse", and
+    its exception, or None if the page parsed without a price.
+
+    With SCRAPE_TRACING on, every item's spans across the three stages are
+    collected into one trace and logged once it's written.
+
+    If `write` raises, the error is logged and counted in the write stage's
+    metrics, and the run goes on with the next item. If the run is
+    interrupted, the other stages stop after the item they are on and
+    pending parses are cancelled.
+    """
+    if fetch_workers is None:
+        fetch_workers = getattr(settings, "REFRESH_FETCH_WORKERS", 8)
+    if parse_workers is None:
+        parse_workers = getattr(settings, "REFRESH_PARSE_WORKERS", 2)
+    if parse_workers and multiprocessing.current_process().daemon:
+        # ? daemonic processes, like the children of Celery's prefork pool,
+        # ? can't start parser processes of their own
+        logger.info("Parsing in threads, daemonic processes can't have children")
+        parse_workers = 0
+    queue_size = getattr(settings, "REFRESH_QUEUE_SIZE", 16)
+    traced = tracing_enabled()
+
+    metrics = {name: StageMetrics(name) for name in ("fetch", "parse", "write")}
+    items = iter(items)
+    items_lock = threading.Lock()
+    fetched = queue.Queue(maxsize=queue_size)
+    parsing = queue.Queue(maxsize=queue_size)
+    stop = threading.Event()
+    # ? spawned, not forked: forking while fetcher threads hold locks can hang
+    executor = (
+        ProcessPoolExecutor(
+            parse_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            # ? parsers start from this process's strategy ranking
+            initializer=strategies.set_ranking,
+            initargs=(strategies.ranking.as_dict(),),
+        )
+        if parse_workers
+        else None
+    )
+
+    def fetch():
+        while not stop.is_set():
+            with items_lock:
+                item = next(items, None)
+            if item is None:
+                break
+
+            key, url, store = item
+            trace = Trace("refresh", key=key, url=url, store=store) if traced else None
+            start = time.perf_counter()
+            page = error = None
+            try:
+                with activated(trace), span("fetch"):
+                    page = fetch_product(url, store)
+            except Exception as e:
+                logger.error(f"Fetch failed for {url}: {str(e)}")
+                error = e
+            metrics["fetch"].record(time.perf_counter() - start, error=page is None)
+            _put(fetched, (key, url, store, trace, page, error), stop)
+
+    def dispatch():
+        while (item := _get(fetched, stop)) is not _DONE:
+            key, url, store, trace, page, error = item
+            if page is None:
+                future = Future()
+                future.set_result((None, 0.0, [], None))
+            elif executor:
+                try:
+                    future = executor.submit(timed_parse, *page, store, traced)
+                except Exception as e:
+                    # ? e.g. a broken pool, fails this item rather than the run
+                    future = Future()
+                    future.set_exception(e)
+            else:
+                future = Future()
+                try:
+                    future.set_result(timed_parse(*page, store, traced))
+                except Exception as e:
+                    future.set_exception(e)
+            if not _put(parsing, (key, url, store, trace, error, future), stop):
+                future.cancel()
+        _put(parsing, _DONE, stop)
+
+    fetchers = [threading.Thread(target=fetch) for _ in range(max(fetch_workers, 1))]
+    dispatcher = threading.Thread(target=dispatch)
+    for thread in [*fetchers, dispatcher]:
+        thread.start()
+
+    def close_fetch_stage():
+        for thread in fetchers:
+            thread.join()
+        metrics["fetch"].finish()
+        _put(fetched, _DONE, stop)
+
+    closer = threading.Thread(target=close_fetch_stage)
+    closer.start()
+
+    completed = False
+    try:
+        while (item := parsing.get()) is not _DONE:
+            key, url, store, trace, fetch_error, future = item
+            data = None
+            failure = ("fetch", fetch_error) if fetch_error else None
+            if not fetch_error:
+                try:
+                    data, seconds, outcomes, spans = future.result()
+                    metrics["parse"].record(seconds, error=not data)
+                    PARSE_SECONDS.observe(seconds, store=store)
+                    if executor:
+                        # ? parsed in another process, whose ranking is its own
+                        strategies.ranking.apply(outcomes)
+                    if trace and spans:
+                        trace.merge(spans, time.perf_counter() - seconds)
+                except Exception as e:
+                    logger.error(f"Parse failed for {url}: {str(e)}")
+                    metrics["parse"].record(0.0, error=True)
+                    failure = ("parse", e)
+                record_extraction(store, data)
+                if not failure and not (data and data.get("price")):
+                    failure = ("parse", None)
+
+            if failure and on_error:
+                try:
+                    on_error(key, *failure)
+                except Exception as e:
+                    logger.error(f"Error recording failure of {key}: {str(e)}")
+
+            start = time.perf_counter()
+            try:
+                with activated(trace), span("write"):
+                    write(key, data)
+                metrics["write"].record(time.perf_counter() - start)
+            except Exception as e:
+                logger.error(f"Error updating products for {key}: {str(e)}")
+                metrics["write"].record(time.perf_counter() - start, error=True)
+            WRITE_SECONDS.observe(time.perf_counter() - start)
+            if trace:
+                trace.emit()
+        completed = True
+    finally:
+        # ? on an error or Ctrl-C, threads blocked on full queues give up
+        stop.set()
+        closer.join()
+        dispatcher.join()
+        if executor:
+            executor.shutdown(wait=completed, cancel_futures=True)
+        metrics["parse"].finish()
+        metrics["write"].finish()
+
+    result = {name: stage.as_dict() for name, stage in metrics.items()}
+    logger.info(f"Refresh pipeline: {result}")
+    return result
@@ -0,0 +1,131 @@
+import logging
+import re
+import time
+from collections import Counter
+from contextlib import ExitStack, contextmanager
+
+from django.conf import settings
+from django.db import connections
+
+logger = logging.getLogger(__name__)
+
+# Same query shape executed this many times in one unit of work is a likely N+1
+DEFAULT_REPEAT_THRESHOLD = 5
+
+_STRING_LITERAL = re.compile(r"'(?:[^']|'')*'")
+_NUMBER_LITERAL = re.compile(r"\b\d+(?:\.\d+)?\b")
+_IN_LIST = re.compile(r"\bIN \((?:[^()]*)\)", re.IGNORECASE)
+
+
+def query_shape(sql):
+    """Normalize SQL so queries that only differ in literals compare equal"""
+    sql = _STRING_LITERAL.sub("?", sql)
+    sql = _NUMBER_LITERAL.sub("?", sql)
+    sql = _IN_LIST.sub("IN (...)", sql)
+    return " ".join(sql.split())
+
+
+class QueryRecorder:
+    """
+    Records every query executed on the database connections while active.
+
+    Use as a context manager around a request, task or test block.
+    """
+
+    def __init__(self, using=None):
+        self.using = using
+        self.queries = []
+        self._stack = None
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append(
+                {"sql": sql, "time": time.perf_counter() - start, "many": many}
+            )
+
+    def __enter__(self):
+        self._stack = ExitStack()
+        aliases = [self.using] if self.using else connections
+        for alias in aliases:
+            self._stack.enter_context(connections[alias].execute_wrapper(self))
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stack.close()
+        self._stack = None
+
+    @property
+    def count(self):
+        return len(self.queries)
+
+    @property
+    def duration(self):
+        return sum(query["time"] for query in self.queries)
+
+    def shapes(self):
+        return Counter(query_shape(query["sql"]) for query in self.queries)
+
+    def repeated(self, threshold=DEFAULT_REPEAT_THRESHOLD):
+        """Query shapes executed at least `threshold` times"""
+        return {
+            shape: count for shape, count in self.shapes().items() if count >= threshold
+        }
+
+    def report(self, label, threshold=DEFAULT_REPEAT_THRESHOLD):
+        """Log the query count and warn about repeated query shapes"""
+        logger.debug(f"{label}: {self.count} queries in {self.duration * 1000:.1f} ms")
+        for shape, count in self.repeated(threshold).items():
+            logger.warning(f"{label}: possible N+1, {count}x {shape}")
+
+
+def repeat_threshold():
+    return getattr(settings, "QUERY_REPEAT_THRESHOLD", DEFAULT_REPEAT_THRESHOLD)
+
+
+class QueryCountMiddleware:
+    """
+    Records queries per request, exposes the count in an `X-Query-Count`
+    header and logs repeated query shapes.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if not getattr(settings, "QUERY_INSTRUMENTATION", False):
+            return self.get_response(request)
+
+        with QueryRecorder() as recorder:
+            response = self.get_response(request)
+
+        response["X-Query-Count"] = str(recorder.count)
+        recorder.report(f"{request.method} {request.path}", repeat_threshold())
+        return response
+
+
+@contextmanager
+def query_budget(max_queries, max_repeats=None, using=None):
+    """
+    Test helper failing when a block runs more than `max_queries` queries, or
+    repeats one query shape more than `max_repeats` times.
+    """
+    with QueryRecorder(using=using) as recorder:
+        yield recorder
+
+    problems = []
+    if recorder.count > max_queries:
+        problems.append(f"{recorder.count} queries, budget is {max_queries}")
+    if max_repeats is not None:
+        for shape, count in recorder.repeated(max_repeats + 1).items():
+            problems.append(f"{count}x (max {max_repeats}) {shape}")
+
+    if problems:
+        executed = "\n".join(
+            f"{i}. {query['sql']}" for i, query in enumerate(recorder.queries, 1)
+        )
+        raise AssertionError(
+            "Query budget exceeded:\n" + "\n".join(problems) + "\n\n" + executed
+        )
@@ -0,0 +1,182 @@
+import logging
+
+from django.db import transaction
+
+from .alerts import queue_watcher_alerts
+from .failures import backed_off_keys, classify_error, clear_failures, record_failure
+from .listings import refresh_from_listings
+from .metrics import WRITE_SECONDS
+from .models import (
+    CollectionVersion,
+    PriceDropEvent,
+    Product,
+    ScrapeFailure,
+    canonical_product_key,
+)
+from .pipeline import record_extraction, run_refresh_pipeline
+from .strategies import load_ranking, save_ranking
+from .tracing import span, start_trace
+
+logger = logging.getLogger(__name__)
+
+
+def fill_canonical_keys(products):
+    """
+    Derive the canonical key of the rows in `products` saved before there
+    was one, which would otherwise all be refreshed as one blank-keyed item.
+    Returns how many were filled in.
+    """
+    blank = list(products.filter(canonical_key="").only("id", "url", "store"))
+    for product in blank:
+        product.canonical_key = canonical_product_key(product.url, product.store)
+    # ? bulk_update skips save(), whose price bookkeeping doesn't apply
+    Product.objects.bulk_update(blank, ["canonical_key"], batch_size=500)
+    return len(blank)
+
+
+def refresh_products(
+    products,
+    fetch_workers=None,
+    parse_workers=None,
+    listings=True,
+    dry_run=False,
+    backoff=True,
+):
+    """
+    Refresh `products`, a queryset, scraping every store item once for all
+    the users tracking it. Items priced on a listing page are taken from
+    there unless `listings` is False.
+
+    Items that keep failing are backed off and eventually parked (see
+    tracker.failures) and skipped, unless `backoff` is False.
+
+    With `dry_run`, items are still fetched and parsed but nothing is saved,
+    extraction strategy scores included, and the counts say what would have
+    changed. Returns counts of updated
+    products, price drops, items without data, backed off and listed items,
+    plus the pipeline's per-stage metrics.
+    """
+    if not dry_run:
+        fill_canonical_keys(products)
+
+    skipped = 0
+    if backoff:
+        backed_off = products.filter(canonical_key__in=backed_off_keys())
+        skipped = backed_off.values("canonical_key").distinct().count()
+        products = products.exclude(canonical_key__in=backed_off_keys())
+    products = products.order_by("canonical_key", "id")
+
+    # Every user's row for the same store item is refreshed from one scrape
+    groups = {}
+    for product in products.iterator():
+        # ? a dry run leaves blank keys unsaved, so derives them here
+        canonical_key = product.canonical_key or canonical_product_key(
+            product.url, product.store
+        )
+        groups.setdefault(canonical_key, []).append(product)
+    logger.info(f"Starting update of {len(groups)} store items")
+
+    counts = {"updated": 0, "price_drops": 0, "missing": 0}
+    failing = set(ScrapeFailure.objects.values_list("canonical_key", flat=True))
+
+    def on_error(canonical_key, stage, error):
+        if dry_run:
+            return
+        product = groups[canonical_key][0]
+        kind = classify_error(stage, error)
+        record_failure(
+            canonical_key, product.url, product.store, kind, str(error or "No price")
+        )
+
+    def write(canonical_key, data):
+        group = groups.pop(canonical_key)
+
+        if not (data and data.get("price")):
+            counts["missing"] += 1
+        if dry_run:
+            if data and data.get("price"):
+                counts["updated"] += len(group)
+                counts["price_drops"] += sum(
+                    1
+                    for product in group
+                    if PriceDropEvent.build(
+                        product, product.current_price, data["price"]
+                    )
+                )
+            return
+
+        if data and data.get("price"):
+            with transaction.atomic():
+                # Queue instant alerts for every triggered watcher at once.
+                # ? only the rows refreshed here, as a selection may leave out
+                # ? other users' rows of the item, which keep their old price
+                with span("queue_alerts"):
+                    queue_watcher_alerts(
+                        canonical_key,
+                        data["price"],
+                        [product.pk for product in group],
+                    )
+
+                events = []
+                for product in group:
+                    old_price = product.current_price
+
+                    # Update product
+                    product.current_price = data["price"]
+                    if "image_url" in data and data["image_url"]:
+                        product.image_url = data["image_url"]
+                    if "description" in data and data["description"]:
+                        product.description = data["description"]
+
+                    product.is_in_stock = True
+                    with span("save"):
+                        product.save()
+
+                    counts["updated"] += 1
+
+                    # Record the drop for digests
+                    event = PriceDropEvent.build(product, old_price, data["price"])
+                    if event:
+                        events.append(event)
+
+                with span("save_events"):
+                    PriceDropEvent.objects.bulk_create(events)
+                counts["price_drops"] += len(events)
+                if canonical_key in failing:
+                    clear_failures([canonical_key])
+        else:
+            # Product might be out of stock or page changed. Updated without
+            # save(), so last_checked keeps saying when it last scraped fine
+            Product.objects.filter(pk__in=[product.pk for product in group]).update(
+                is_in_stock=False
+            )
+            # ? update() sends no post_save, so invalidate the owners' ETags here
+            for user_id in {product.user_id for product in group}:
+                CollectionVersion.bump(user_id)
+
+    # Items priced on a listing page skip their own page scrape. Listing
+    # pages record what they carried, so a dry run doesn't read them
+    listed = refresh_from_listings(set(groups)) if listings and not dry_run else {}
+    for canonical_key, data in listed.items():
+        store = groups[canonical_key][0].store
+        record_extraction(store, data)
+        try:
+            with start_trace("refresh", key=canonical_key, store=store):
+                with WRITE_SECONDS.time(), span("write"):
+                    write(canonical_key, data)
+        except Exception as e:
+            logger.error(f"Error updating products for {canonical_key}: {str(e)}")
+
+    items = [
+        (canonical_key, group[0].url, group[0].store)
+        for canonical_key, group in groups.items()
+    ]
+    load_ranking()
+    stages = run_refresh_pipeline(
+        items, write, fetch_workers, parse_workers, on_error=on_error
+    )
+    # ? a dry run's learned scores only last until the ranking is next loaded
+    if not dry_run:
+        save_ranking()
+
+    return {**counts, "skipped": skipped, "listed": len(listed), "stages": stages}
@@ -1,3 +1,8 @@
+from datetime import datetime
+
+from django.db.models import Case, F, FloatField, Value, When
+
+from .history import merge_history, series_to_history
 from .models import Product, UserPreference
 from accounts.serializers import UserCreateSerializer, UserSerializer
 from rest_framework import serializers
@@ -10,8 +15,25 @@ class UserPreferenceSerializer(serializers.ModelSerializer):
 
 
 class ProductSerializer(serializers.ModelSerializer):
+    # Large fields left out of list responses unless explicitly requested,
+    # mapped to the model columns that back them
+    HEAVY_FIELDS = {
+        "description": ["description"],
+        "price_history": ["price_series", "price_history"],
+    }
+
     price_drop_percentage = serializers.SerializerMethodField()
-    price_history = serializers.JSONField(read_only=True)
+    # ? the encoded series plus legacy points encode_price_history hasn't moved
+    price_history = serializers.ReadOnlyField(source="price_points")
+
+    def __init__(self, *args, **kwargs):
+        # ? optional subset of fields to render, used for sparse responses
+        fields = kwargs.pop("fields", None)
+        super().__init__(*args, **kwargs)
+
+        if fields is not None:
+            for field_name in set(self.fields) - set(fields):
+                self.fields.pop(field_name)
 
     class Meta:
         model = Product
@@ -40,7 +62,6 @@ class ProductSerializer(serializers.ModelSerializer):
             "last_checked",
             "image_url",
             "description",
-            "price_history",
         ]
 
     def get_price_drop_percentage(self, obj):
@@ -49,3 +70,58 @@ class ProductSerializer(serializers.ModelSerializer):
             percentage = drop / obj.highest_price
             return round(percentage, 2)
         return 0
+
+
+# Fast read path: the list and detail views fetch plain rows with `.values()`
+# and shape them like ProductSerializer would, without building model
+# instances or serializer fields for every product
+
+# ? model columns read for fields not backed by the column of their name
+ROW_COLUMNS = {"price_history": ["price_series", "price_history"]}
+
+# ? (highest - current) / highest as get_price_drop_percentage computes it,
+# ? or NULL without a highest price. Rounded in Python, where halves round the
+# ? same way as in the serializer
+PRICE_DROP_RATIO = Case(
+    When(
+        highest_price__gt=0,
+        then=(F("highest_price") - F("current_price")) / F("highest_price"),
+    ),
+    default=Value(None),
+    output_field=FloatField(),
+)
+
+_datetime_field = serializers.DateTimeField()
+
+
+def product_rows(queryset, fields):
+    """`queryset` as dicts holding just what rendering `fields` needs"""
+    columns = {
+        column
+        for name in fields
+        if name != "price_drop_percentage"
+        for column in ROW_COLUMNS.get(name, [name])
+    }
+    # ? cursor pagination reads the ordering column from every row
+    columns.add("created_at")
+    annotations = {}
+    if "price_drop_percentage" in fields:
+        annotations["price_drop_percentage"] = PRICE_DROP_RATIO
+    return queryset.values(*columns, **annotations)
+
+
+def render_product_row(row, fields):
+    """A row from `product_rows` as ProductSerializer renders the product"""
+    data = {}
+    for name in fields:
+        value = row[name]
+        if name == "price_history":
+            value = series_to_history(
+                *merge_history(row["price_series"], row["price_history"])
+            )
+        elif name == "price_drop_percentage":
+            value = 0 if value is None else round(value, 2)
+        elif isinstance(value, datetime):
+            value = _datetime_field.to_representation(value)
+        data[name] = value
+    return data
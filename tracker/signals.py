@@ -0,0 +1,36 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .models import CollectionVersion, Product, UserPreference
+
+# ? owners to bump once at the end of a bulk change, instead of once per row
+_pending_bumps = ContextVar("pending_bumps", default=None)
+
+
+@contextmanager
+def bumps_deferred():
+    """Bump every affected owner's collection version once, on success"""
+    user_ids = set()
+    token = _pending_bumps.set(user_ids)
+    try:
+        yield
+    finally:
+        _pending_bumps.reset(token)
+    for user_id in user_ids:
+        CollectionVersion.bump(user_id)
+
+
+@receiver(post_save, sender=Product)
+@receiver(post_delete, sender=Product)
+@receiver(post_save, sender=UserPreference)
+@receiver(post_delete, sender=UserPreference)
+def bump_collection_version(sender, instance, **kwargs):
+    """Invalidate the owner's cached product listings (ETags)"""
+    pending = _pending_bumps.get()
+    if pending is not None:
+        pending.add(instance.user_id)
+    else:
+        CollectionVersion.bump(instance.user_id)
@@ -0,0 +1,244 @@
+import json
+import logging
+import re
+from urllib.parse import parse_qs, urlencode, urlparse
+
+from django.conf import settings
+
+from .tracing import span
+from .utils import fetch_page, parse_product, transfer_stats
+
+logger = logging.getLogger(__name__)
+
+_TAGS = re.compile(r"<[^>]+>")
+_AMOUNT = re.compile(r"\d[\d,]*(?:\.\d+)?")
+_DARAZ_MODULE_DATA = re.compile(r"var __moduleData__ = ")
+
+
+def strip_tags(html):
+    return " ".join(_TAGS.sub(" ", html or "").split())
+
+
+def parse_amount(text):
+    """First amount in a display price like "Rs. 1,650", or 0.0"""
+    match = _AMOUNT.search(str(text or ""))
+    return float(match.group().replace(",", "")) if match else 0.0
+
+
+class StoreAdapter:
+    """
+    Gets product data for one store, preferring its compact JSON endpoint.
+
+    The endpoint comes from the STORE_JSON_ENDPOINTS setting, a URL template
+    formatted with the product URL's `url`, `origin`, `path` and `item_id`.
+    When a store has none, or it fails or answers without a usable price, the
+    product page is fetched instead.
+    Fetching runs in the pipeline's fetcher threads and parsing in its parser
+    processes, so `parse` and everything it calls must not need Django.
+    """
+
+    store = "generic"
+
+    def __init__(self, store=None):
+        self.store = store or self.store
+
+    def endpoint_url(self, url):
+        template = getattr(settings, "STORE_JSON_ENDPOINTS", {}).get(self.store)
+        if not template:
+            return None
+
+        from .models import CANONICAL_ID_PATTERNS
+
+        parsed = urlparse(url)
+        pattern = CANONICAL_ID_PATTERNS.get(self.store)
+        match = pattern.search(parsed.path) if pattern else None
+        if "{item_id}" in template and not match:
+            return None
+
+        return template.format(
+            url=url,
+            origin=f"{parsed.scheme}://{parsed.netloc}",
+            path=parsed.path.rstrip("/"),
+            item_id=match.group(1) if match else "",
+        )
+
+    def fetch(self, url):
+        """Download the product's data, returning `(kind, body)`"""
+        endpoint = self.endpoint_url(url)
+        if endpoint:
+            try:
+                body = fetch_page(endpoint, self.store, accept="application/json")
+                # ? checked here, while the page can still be fetched instead
+                data = self.parse_json(json.loads(body))
+                if not (data and data.get("price")):
+                    raise ValueError("no price in the JSON payload")
+                transfer_stats.record(self.store, json_pages=1)
+                return "json", body
+            except Exception as e:
+                logger.info(
+                    f"JSON endpoint failed for {url}, falling back to HTML: {str(e)}"
+                )
+                transfer_stats.record(self.store, json_fallbacks=1)
+
+        return "html", fetch_page(url, self.store)
+
+    def parse(self, kind, body):
+        with span("parse", kind=kind):
+            return self._parse(kind, body)
+
+    def _parse(self, kind, body):
+        if kind == "json":
+            result = self.parse_json(json.loads(body))
+            if result and result.get("price"):
+                result["strategy"] = "json_endpoint"
+                return result
+            # ? an endpoint without a usable price is no better than no endpoint
+            logger.warning(f"{self.store} JSON payload had no price")
+            return None
+        return self.parse_html(body)
+
+    def parse_json(self, payload):
+        return None
+
+    def parse_html(self, html):
+        return parse_product(html, self.store)
+
+    def listing_url(self, url):
+        """Where a listing page's items can be read in bulk, if supported"""
+        return None
+
+    def fetch_listing(self, url):
+        listing_url = self.listing_url(url)
+        if not listing_url:
+            raise ValueError(f"{self.store} listing pages are not supported")
+        transfer_stats.record(self.store, listing_pages=1)
+        return fetch_page(listing_url, self.store, accept="application/json")
+
+    def parse_listing(self, body):
+        """Scraped data of every priced item on a listing, by canonical key"""
+        return {}
+
+
+class DarazAdapter(StoreAdapter):
+    """
+    Daraz pages embed the whole product as `__moduleData__`, so it is decoded
+    straight from the page text and BeautifulSoup only runs if that stops
+    being the best ranked strategy.
+    """
+
+    store = "daraz"
+
+    def parse_json(self, payload):
+        fields = payload.get("data", {}).get("root", {}).get("fields", payload)
+        product = fields.get("product") or {}
+        if not product.get("title"):
+            return None
+
+        sku_id = str(fields.get("primaryKey", {}).get("skuId", "0"))
+        sku = fields.get("skuInfos", {}).get(sku_id) or {}
+
+        price = sku.get("price", {}).get("salePrice", {}).get("value")
+        if price is None:
+            price = parse_amount(fields.get("tracking", {}).get("pdt_price"))
+
+        image_url = sku.get("image", "")
+        gallery = fields.get("skuGalleries", {}).get(sku_id) or []
+        if gallery:
+            image_url = gallery[0].get("src") or image_url
+
+        return {
+            "title": product["title"],
+            "price": float(price),
+            "image_url": image_url,
+            "description": strip_tags(product.get("desc"))[:500],
+        }
+
+    def parse_html(self, html):
+        # ? ranked alongside the markup strategies, see scrape_daraz
+        strategies = {"module_data": lambda: self.module_data(html)}
+        return parse_product(html, self.store, strategies)
+
+    def module_data(self, html):
+        match = _DARAZ_MODULE_DATA.search(html)
+        if not match:
+            return None
+        payload, _ = json.JSONDecoder().raw_decode(html, match.end())
+        return self.parse_json(payload)
+
+    def listing_url(self, url):
+        # ? catalog, search and campaign pages return their items as JSON
+        parsed = urlparse(url)
+        query = parse_qs(parsed.query)
+        query["ajax"] = ["true"]
+        return parsed._replace(query=urlencode(query, doseq=True)).geturl()
+
+    def parse_listing(self, body):
+        items = {}
+        for item in json.loads(body).get("mods", {}).get("listItems", []):
+            # ? sold out items are left to their own page scrape
+            if not item.get("itemId") or item.get("inStock") is False:
+                continue
+            price = parse_amount(item.get("price") or item.get("priceShow"))
+            if not price:
+                continue
+            data = {
+                "title": item.get("name", ""),
+                "price": price,
+                "image_url": item.get("image", ""),
+                "strategy": "listing",
+            }
+            # ? the price is the listed SKU's, which is also what a product
+            # ? URL without a SKU shows
+            items[f"{self.store}:{item['itemId']}"] = data
+            if item.get("skuId"):
+                items[f"{self.store}:{item['itemId']}-s{item['skuId']}"] = data
+        return items
+
+
+class ShopifyAdapter(StoreAdapter):
+    """Storefronts serving a product's JSON at `/products/<handle>.js`"""
+
+    store = "generic"
+
+    def endpoint_url(self, url):
+        if not re.search(r"/products/[^/]+/?$", urlparse(url).path):
+            return None
+        return super().endpoint_url(url)
+
+    def parse_json(self, payload):
+        if "price" not in payload or not payload.get("title"):
+            return None
+
+        image_url = payload.get("featured_image") or ""
+        if image_url.startswith("//"):
+            image_url = f"https:{image_url}"
+
+        return {
+            "title": payload["title"],
+            "price": payload["price"] / 100,  # ? in cents
+            "image_url": image_url,
+            "description": strip_tags(payload.get("description"))[:500],
+        }
+
+
+ADAPTERS = {
+    "daraz": DarazAdapter(),
+    "amazon": StoreAdapter("amazon"),
+    "aliexpress": StoreAdapter("aliexpress"),
+    "flipkart": StoreAdapter("flipkart"),
+    "generic": ShopifyAdapter(),
+}
+
+
+def get_adapter(store):
+    return ADAPTERS.get(store) or ADAPTERS["generic"]
+
+
+def fetch_product(url, store):
+    """Download a product's data through its store adapter, as `(kind, body)`"""
+    return get_adapter(store).fetch(url)
+
+
+def parse_fetched(kind, body, store):
+    """Parse what `fetch_product` downloaded"""
+    return get_adapter(store).parse(kind, body)
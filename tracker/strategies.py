@@ -0,0 +1,189 @@
+import hashlib
+import logging
+import re
+import threading
+from contextlib import contextmanager
+from datetime import timedelta
+
+from .tracing import span
+
+logger = logging.getLogger(__name__)
+
+# Weight kept by a strategy's score on every new attempt, so a store's markup
+# change shows up within a few pages
+DECAY = 0.8
+# Score of a strategy never tried on a store, between a winner and a loser
+PRIOR = 0.5
+# Template fingerprints not seen for this long are forgotten
+FINGERPRINT_TTL = timedelta(days=30)
+
+_STYLESHEET = re.compile(r'<link[^>]+href="([^"]+?\.css)')
+_VERSION = re.compile(r"/\d+(?:\.\d+)+/")
+
+
+def page_fingerprint(html, limit=64 * 1024):
+    """
+    Short hash of the stylesheets in a page's head, with version numbers
+    dropped, naming the template that rendered it. Empty if it has none.
+    """
+    assets = sorted(
+        {_VERSION.sub("/", href) for href in _STYLESHEET.findall(html[:limit])}
+    )
+    if not assets:
+        return ""
+    return hashlib.sha1("\n".join(assets).encode()).hexdigest()[:12]
+
+
+class StrategyRanking:
+    """
+    Decayed success scores of extraction strategies, per store and per page
+    template fingerprint. Scores are kept per store too (fingerprint "") for
+    templates not seen before.
+    """
+
+    def __init__(self, scores=None):
+        # ? {(store, fingerprint): {strategy: [score, attempts]}}
+        self.scores = scores or {}
+        self.touched = set()  # ? keys recorded since the scores were loaded
+        self.loaded = False
+        self._lock = threading.Lock()
+
+    def replace(self, scores):
+        with self._lock:
+            self.scores = scores
+            self.touched = set()
+            self.loaded = True
+
+    def score(self, store, fingerprint, strategy):
+        for key in [(store, fingerprint), (store, "")]:
+            entry = self.scores.get(key, {}).get(strategy)
+            if entry:
+                return entry[0]
+        return PRIOR
+
+    def order(self, store, fingerprint, strategies):
+        """`strategies` best first; ties keep their given order"""
+        with self._lock:
+            return sorted(
+                strategies, key=lambda name: -self.score(store, fingerprint, name)
+            )
+
+    def record(self, store, fingerprint, tried, winner):
+        """Score the strategies `tried` on a page, `winner` being the one that worked"""
+        with self._lock:
+            for key in {(store, fingerprint), (store, "")}:
+                self.touched.add(key)
+                entries = self.scores.setdefault(key, {})
+                for name in tried:
+                    score, attempts = entries.get(name, [PRIOR, 0])
+                    score = score * DECAY + (1 - DECAY) * (name == winner)
+                    entries[name] = [score, attempts + 1]
+
+        capturing = getattr(_local, "outcomes", None)
+        if capturing is not None:
+            capturing.append((store, fingerprint, list(tried), winner))
+
+    def apply(self, outcomes):
+        """Record outcomes captured in another process"""
+        for outcome in outcomes:
+            self.record(*outcome)
+
+    def as_dict(self, touched=False):
+        with self._lock:
+            return {
+                key: {name: list(entry) for name, entry in entries.items()}
+                for key, entries in self.scores.items()
+                if not touched or key in self.touched
+            }
+
+
+# This process's ranking. Parser processes get a copy from the pipeline
+ranking = StrategyRanking()
+_local = threading.local()
+
+
+def set_ranking(scores):
+    """Process pool initializer, seeding a parser process's ranking"""
+    ranking.replace(scores)
+
+
+@contextmanager
+def capture_outcomes():
+    """Collect the outcomes recorded on this thread, to hand to another process"""
+    _local.outcomes = outcomes = []
+    try:
+        yield outcomes
+    finally:
+        _local.outcomes = None
+
+
+def run_ranked(store, fingerprint, strategies):
+    """
+    Try `strategies`, a dict of name to callable returning product data, best
+    first, and return the first result with a price, or None. Every strategy
+    tried is scored.
+    """
+    tried = []
+    for name in ranking.order(store, fingerprint, list(strategies)):
+        tried.append(name)
+        try:
+            with span(name):
+                result = strategies[name]()
+        except Exception as e:
+            logger.error(f"{store} {name} extraction failed: {str(e)}")
+            result = None
+        if result and result.get("price"):
+            ranking.record(store, fingerprint, tried, name)
+            return {**result, "strategy": name}
+
+    ranking.record(store, fingerprint, tried, None)
+    return None
+
+
+def load_ranking(reload=True):
+    """
+    Replace this process's ranking with the stored scores. With `reload`
+    False, only if it hasn't been loaded yet
+    """
+    from .models import ExtractionStrategyScore
+
+    if ranking.loaded and not reload:
+        return ranking
+
+    scores = {}
+    for row in ExtractionStrategyScore.objects.all():
+        key = (row.store, row.fingerprint)
+        scores.setdefault(key, {})[row.strategy] = [row.score, row.attempts]
+    ranking.replace(scores)
+    return ranking
+
+
+def save_ranking():
+    """
+    Store the scores recorded since the ranking was loaded, and forget
+    templates not seen for a while
+    """
+    from django.utils import timezone
+
+    from .models import ExtractionStrategyScore
+
+    rows = [
+        ExtractionStrategyScore(
+            store=store,
+            fingerprint=fingerprint,
+            strategy=name,
+            score=score,
+            attempts=attempts,
+        )
+        for (store, fingerprint), entries in ranking.as_dict(touched=True).items()
+        for name, (score, attempts) in entries.items()
+    ]
+    ExtractionStrategyScore.objects.bulk_create(
+        rows,
+        update_conflicts=True,
+        unique_fields=["store", "fingerprint", "strategy"],
+        update_fields=["score", "attempts", "updated_at"],
+    )
+    ExtractionStrategyScore.objects.exclude(fingerprint="").filter(
+        updated_at__lt=timezone.now() - FINGERPRINT_TTL
+    ).delete()
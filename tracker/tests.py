@@ -1,3 +1,1862 @@
-from django.test import TestCase
+import csv
+import functools
+import gzip
+import json
+import multiprocessing
+import re
+import tempfile
+import threading
+from datetime import timedelta
+from io import StringIO
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from pathlib import Path
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+import requests
+
+from django.core import mail
+from django.core.management import CommandError, call_command
+from django.db import connection
+from django.db.models import F
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.test import APIClient
+
+from accounts.models import User
+from .cleanup import archive_and_delete
+from .digests import send_chunk, DigestStats
+from .exports import export_products
+from .failures import classify_error
+from .history import MAX_POINTS, decode_series, encode_series
+from .management.commands.importtime import TARGETS, measure_imports
+from .listings import listing_pages_for
+from .metrics import Histogram, start_exporter
+from .pipeline import run_refresh_pipeline
+from .stores import DarazAdapter, fetch_product, parse_fetched
+from .utils import accept_encoding, fetch_page, parse_product, transfer_stats
+from .models import (
+    AlertOutbox,
+    CollectionVersion,
+    ExtractionStrategyScore,
+    ListingPage,
+    PriceDropEvent,
+    Product,
+    ScrapeFailure,
+    UserPreference,
+    canonical_product_key,
+)
+from .queries import query_budget, query_shape
+from .refresh import refresh_products
+from .renderers import ORJSONRenderer
+from .strategies import (
+    StrategyRanking,
+    load_ranking,
+    page_fingerprint,
+    run_ranked,
+    save_ranking,
+)
+from .alerts import find_triggered_watchers
+from .tasks import (
+    check_daily_price_drops,
+    delete_old_products,
+    send_pending_alerts,
+    update_all_products,
+)
+
+# Maximum queries per endpoint, regardless of how many products a user tracks
+QUERY_BUDGETS = {
+    "product-list": 2,
+    "product-detail": 2,
+    "product-history": 2,
+    "product-create": 7,
+    "preferences": 2,
+    "admin-product-changelist": 5,
+    "daily-digest": 1,
+}
+
+
+class ProductListTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("lister@example.com", "lister")
+        cls.products = []
+        for i in range(5):
+            product = Product.objects.create(
+                url=f"https://example.com/list/{i}",
+                title=f"Product {i}",
+                current_price=100,
+                lowest_price=0,
+                highest_price=0,
+                description="Long description",
+                user=cls.user,
+            )
+            # ? distinct, known creation times for the cursor ordering
+            Product.objects.filter(pk=product.pk).update(
+                created_at=timezone.now() - timedelta(hours=i)
+            )
+            cls.products.append(product)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_cursor_pages_newest_first(self):
+        titles = []
+        url = "/api/products/?page_size=2"
+        while url:
+            page = self.client.get(url).json()
+            self.assertLessEqual(len(page["results"]), 2)
+            titles += [product["title"] for product in page["results"]]
+            url = page["next"]
+
+        self.assertEqual(titles, [f"Product {i}" for i in range(5)])
+
+    def test_heavy_fields_left_out_of_list_by_default(self):
+        product = self.client.get("/api/products/").json()["results"][0]
+        self.assertNotIn("description", product)
+        self.assertNotIn("price_history", product)
+
+        expanded = self.client.get("/api/products/?expand=true").json()["results"][0]
+        self.assertEqual(expanded["description"], "Long description")
+        self.assertEqual(expanded["price_history"], [])
+
+        detail = self.client.get(f"/api/products/{self.products[0].pk}/").json()
+        self.assertIn("description", detail)
+
+    def test_sparse_fields(self):
+        response = self.client.get("/api/products/?fields=title, id,nope")
+        product = response.json()["results"][0]
+        # ? unknown names are ignored, and fields keep the serializer's order
+        self.assertEqual(list(product), ["id", "title"])
+
+        detail = self.client.get(
+            f"/api/products/{self.products[0].pk}/?fields=description"
+        ).json()
+        self.assertEqual(detail, {"description": "Long description"})
+
+
+@override_settings(REFRESH_PARSE_WORKERS=0)
+class ETagTests(TestCase):
+    URL = "https://www.daraz.com.np/products/etag-i1-s1.html"
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("etag@example.com", "etag")
+        UserPreference.objects.create(user=cls.user)
+        cls.product = Product.objects.create(
+            url=cls.URL,
+            title="ETag",
+            current_price=100,
+            lowest_price=0,
+            highest_price=0,
+            user=cls.user,
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def assertChanges(self, path, change):
+        """`path` answers 304 until `change()` runs, then 200 with a new ETag"""
+        etag = self.client.get(path)["ETag"]
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        change()
+
+        response = self.client.get(path, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response["ETag"], etag)
+        return response
+
+    def test_product_save(self):
+        def save():
+            self.product.current_price = 90
+            self.product.save()
+
+        for path in ["/api/products/", f"/api/products/{self.product.pk}/"]:
+            with self.subTest(path=path):
+                self.assertChanges(path, save)
+
+    def test_preference_change(self):
+        def change():
+            preferences = UserPreference.objects.get(user=self.user)
+            preferences.notification_frequency = "weekly"
+            preferences.save()
+
+        self.assertChanges("/api/products/", change)
+
+    def test_etags_are_per_user_and_query(self):
+        etag = self.client.get("/api/products/")["ETag"]
+        self.assertNotEqual(self.client.get("/api/products/?expand=1")["ETag"], etag)
+
+        other = User.objects.create_user("other-etag@example.com", "other-etag")
+        self.client.force_authenticate(other)
+        response = self.client.get("/api/products/", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+    @mock.patch("tracker.pipeline.fetch_product")
+    def test_refresh_marking_items_out_of_stock(self, fetch_product):
+        fetch_product.side_effect = http_error(404)
+
+        response = self.assertChanges("/api/products/", update_all_products)
+
+        self.assertFalse(response.json()["results"][0]["is_in_stock"])
+
+    @mock.patch("tracker.pipeline.parse_fetched")
+    @mock.patch("tracker.pipeline.fetch_product")
+    def test_refresh_updating_prices(self, fetch_product, parse_fetched):
+        fetch_product.return_value = ("html", "<html></html>")
+        parse_fetched.return_value = {"title": "ETag", "price": 80.0}
+
+        response = self.assertChanges("/api/products/", update_all_products)
+
+        self.assertEqual(response.json()["results"][0]["current_price"], 80.0)
+
+    def test_cleanup_deleting_products(self):
+        Product.objects.update(last_checked=timezone.now() - timedelta(days=31))
+
+        def cleanup():
+            with tempfile.TemporaryDirectory() as directory:
+                with override_settings(CLEANUP_ARCHIVE_DIR=directory):
+                    delete_old_products()
+
+        response = self.assertChanges("/api/products/", cleanup)
+
+        self.assertEqual(response.json()["results"], [])
+
+
+class HotQueryPlanTests(TestCase):
+    """EXPLAIN the hot queries and fail if any of them falls back to a table scan"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(f"user{i}@example.com", f"user{i}", "password")
+            for i in range(5)
+        ]
+        stores = ["daraz", "amazon", "aliexpress", "flipkart"]
+        for user in cls.users:
+            for i in range(40):
+                Product.objects.create(
+                    url=f"https://example.com/{user.pk}/{i}",
+                    title=f"Product {i}",
+                    current_price=100 + i,
+                    lowest_price=0,
+                    highest_price=0,
+                    user=user,
+                    store=stores[i % len(stores)],
+                    is_in_stock=bool(i % 3),
+                )
+        # ? give half of the products a price below their highest price
+        dropped = Product.objects.values_list("pk", flat=True)[::2]
+        Product.objects.filter(pk__in=list(dropped)).update(
+            current_price=F("current_price") - 10
+        )
+
+    def explain(self, queryset):
+        if connection.vendor == "postgresql":
+            # ? tiny test tables make sequential scans look cheap, so only allow
+            # ? them when no usable index exists
+            with connection.cursor() as cursor:
+                cursor.execute("SET LOCAL enable_seqscan = off")
+        return queryset.explain()
+
+    def assertUsesIndex(self, queryset, table=Product._meta.db_table):
+        plan = self.explain(queryset)
+        table = re.escape(table)
+
+        if connection.vendor == "postgresql":
+            full_scan = re.search(rf"Seq Scan on {table}\b", plan)
+        else:
+            full_scan = re.search(rf"\bSCAN {table}\b(?! USING)", plan)
+
+        self.assertIsNone(full_scan, f"Full table scan in query plan:\n{plan}")
+        return plan
+
+    def test_product_list(self):
+        queryset = Product.objects.filter(user=self.users[0]).order_by("-created_at")
+        plan = self.assertUsesIndex(queryset)
+        self.assertNotIn("TEMP B-TREE", plan)
+
+    def test_digest_price_drops(self):
+        since = timezone.now() - timedelta(days=1)
+        self.assertUsesIndex(
+            PriceDropEvent.objects.filter(created_at__gte=since),
+            PriceDropEvent._meta.db_table,
+        )
+        self.assertUsesIndex(
+            PriceDropEvent.objects.filter(user=self.users[0], created_at__gte=since),
+            PriceDropEvent._meta.db_table,
+        )
+
+    def test_old_products_cleanup(self):
+        cutoff = timezone.now() - timedelta(days=30)
+        self.assertUsesIndex(Product.objects.filter(last_checked__lt=cutoff))
+
+    def test_alert_watcher_matching(self):
+        key = Product.objects.first().canonical_key
+        self.assertUsesIndex(
+            Product.objects.filter(canonical_key=key, alert_threshold__gte=100)
+        )
+
+    def test_store_and_stock_filters(self):
+        self.assertUsesIndex(Product.objects.filter(store="daraz"))
+        self.assertUsesIndex(Product.objects.filter(store="daraz", is_in_stock=False))
+
+
+class QueryBudgetTests(TestCase):
+    """Per-endpoint query budgets, independent of the number of products"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("owner@example.com", "owner", "password")
+        UserPreference.objects.create(user=cls.user)
+        cls.products = [
+            Product.objects.create(
+                url=f"https://example.com/{i}",
+                title=f"Product {i}",
+                current_price=100 + i,
+                lowest_price=0,
+                highest_price=0,
+                user=cls.user,
+            )
+            for i in range(30)
+        ]
+        # ? budgets cover the steady state, once the version row exists
+        CollectionVersion.current(cls.user.pk)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_product_list(self):
+        with query_budget(QUERY_BUDGETS["product-list"], max_repeats=1):
+            response = self.client.get("/api/products/?expand=true")
+        self.assertEqual(response.status_code, 200)
+
+    def test_product_detail(self):
+        product = self.products[0]
+        with query_budget(QUERY_BUDGETS["product-detail"], max_repeats=1):
+            response = self.client.get(f"/api/products/{product.pk}/")
+        self.assertEqual(response.status_code, 200)
+
+    def test_product_history(self):
+        product = self.products[0]
+        with query_budget(QUERY_BUDGETS["product-history"], max_repeats=1):
+            response = self.client.get(f"/api/products/{product.pk}/history/")
+        self.assertEqual(response.status_code, 200)
+
+    @mock.patch("tracker.views.scrape_product")
+    def test_product_create(self, scrape_product):
+        scrape_product.return_value = {"title": "New product", "price": 50.0}
+        with query_budget(QUERY_BUDGETS["product-create"], max_repeats=2):
+            response = self.client.post(
+                "/api/products/", {"url": "https://example.com/new"}
+            )
+        self.assertEqual(response.status_code, 201)
+
+    def test_preferences(self):
+        with query_budget(QUERY_BUDGETS["preferences"], max_repeats=1):
+            response = self.client.get("/api/preferences/")
+        self.assertEqual(response.status_code, 200)
+
+    def test_admin_product_changelist(self):
+        admin = User.objects.create_superuser("admin@example.com", "admin", "password")
+        self.client.force_login(admin)
+        with query_budget(QUERY_BUDGETS["admin-product-changelist"], max_repeats=1):
+            response = self.client.get("/admin/tracker/product/")
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(QUERY_INSTRUMENTATION=True)
+    def test_middleware_reports_query_count(self):
+        response = self.client.get("/api/products/")
+        self.assertEqual(response["X-Query-Count"], "2")
+
+    def test_query_budget_flags_repeated_shapes(self):
+        with self.assertRaisesMessage(AssertionError, "Query budget exceeded"):
+            with query_budget(100, max_repeats=1):
+                for product in Product.objects.all()[:3]:
+                    product.user.email
+
+    def test_query_shape_ignores_literals(self):
+        self.assertEqual(
+            query_shape("SELECT * FROM t WHERE id IN (1, 2, 3) AND name = 'x'"),
+            query_shape("SELECT * FROM t WHERE id IN (4) AND name = 'y'"),
+        )
+
+
+class DigestTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        for i, frequency in enumerate(["daily", "daily", "daily", "weekly"]):
+            user = User.objects.create_user(f"digest{i}@example.com", f"digest{i}")
+            UserPreference.objects.create(user=user, notification_frequency=frequency)
+            for j in range(3):
+                product = Product.objects.create(
+                    url=f"https://example.com/{i}/{j}",
+                    title=f"Product {j}",
+                    current_price=200,
+                    lowest_price=0,
+                    highest_price=0,
+                    user=user,
+                )
+                product.current_price = 150
+                product.save()
+                PriceDropEvent.record(product, 200, 150)
+
+    def test_daily_digest_uses_one_query(self):
+        with query_budget(QUERY_BUDGETS["daily-digest"]):
+            stats = check_daily_price_drops()
+
+        self.assertEqual(stats["sent"], 3)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertIn("Rs. 50.0 (25.0% off)", mail.outbox[0].alternatives[0][0])
+        self.assertEqual(
+            sorted(message.to[0] for message in mail.outbox),
+            ["digest0@example.com", "digest1@example.com", "digest2@example.com"],
+        )
+
+    @mock.patch("tracker.digests.time.sleep")
+    def test_failed_chunk_is_retried_without_duplicates(self, sleep):
+        connection = mock.Mock()
+        connection.send_messages.side_effect = [1, ConnectionError("reset"), 1, 1]
+        stats = DigestStats("daily")
+
+        send_chunk(connection, ["a", "b", "c"], stats, max_retries=2, retry_delay=1)
+
+        self.assertEqual(stats.sent, 3)
+        self.assertEqual(stats.retries, 1)
+        sent = [call.args[0] for call in connection.send_messages.call_args_list]
+        self.assertEqual(sent, [["a"], ["b"], ["b"], ["c"]])
+
+    @mock.patch("tracker.digests.time.sleep")
+    def test_failed_reconnect_uses_a_retry(self, sleep):
+        connection = mock.Mock()
+        connection.send_messages.side_effect = [ConnectionError("reset"), 1, 1]
+        connection.open.side_effect = [ConnectionError("refused"), True]
+        stats = DigestStats("daily")
+
+        send_chunk(connection, ["a", "b"], stats, max_retries=2, retry_delay=1)
+
+        self.assertEqual((stats.sent, stats.retries, stats.failed), (2, 2, 0))
+
+        connection.send_messages.side_effect = ConnectionError("reset")
+        connection.open.side_effect = ConnectionError("refused")
+        stats = DigestStats("daily")
+
+        send_chunk(connection, ["a", "b"], stats, max_retries=2, retry_delay=1)
+
+        self.assertEqual((stats.sent, stats.failed), (0, 2))
+
+
+class AlertOutboxTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("alerts@example.com", "alerts")
+        UserPreference.objects.create(user=cls.user, notification_frequency="instant")
+        cls.product = Product.objects.create(
+            url="https://example.com/alert",
+            title="Alert product",
+            current_price=200,
+            lowest_price=0,
+            highest_price=0,
+            user=cls.user,
+        )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    @mock.patch("tracker.views.scrape_product")
+    def test_refresh_queues_alert_instead_of_sending(self, scrape_product):
+        scrape_product.return_value = {"title": "Alert product", "price": 150.0}
+
+        for _ in range(2):
+            self.client.post(f"/api/products/{self.product.pk}/refresh/")
+
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(AlertOutbox.objects.count(), 1)
+
+        self.assertEqual(send_pending_alerts()["sent"], 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ["alerts@example.com"])
+        self.assertEqual(AlertOutbox.objects.get().status, "sent")
+
+    @mock.patch("tracker.alerts.get_connection")
+    def test_failed_alert_backs_off(self, get_connection):
+        get_connection.return_value.send_messages.side_effect = ConnectionError
+        AlertOutbox.objects.create(
+            user=self.user, subject="Drop", message="Cheaper", dedupe_key="test"
+        )
+
+        self.assertEqual(send_pending_alerts()["retried"], 1)
+        alert = AlertOutbox.objects.get()
+        self.assertEqual(alert.status, "pending")
+        self.assertEqual(alert.attempts, 1)
+        self.assertGreater(alert.next_attempt_at, timezone.now())
+
+        # ? not due yet, so the next drain leaves it alone
+        self.assertEqual(send_pending_alerts(), {"sent": 0, "retried": 0, "failed": 0})
+
+
+class WatcherFanOutTests(TestCase):
+    URL = "https://www.daraz.com.np/products/airpods-i290709810-s1342209012.html"
+
+    @classmethod
+    def setUpTestData(cls):
+        # ? (threshold, target % drop, frequency) per watcher of the same item
+        watchers = [
+            (160, 10, "instant"),  # threshold crossed
+            (120, 10, "instant"),  # threshold not reached
+            (None, 20, "instant"),  # 25% below highest price
+            (None, 30, "instant"),  # 25% is not enough
+            (160, 10, "daily"),  # not on instant alerts
+        ]
+        for i, (threshold, target, frequency) in enumerate(watchers):
+            user = User.objects.create_user(f"watcher{i}@example.com", f"watcher{i}")
+            UserPreference.objects.create(
+                user=user,
+                notification_frequency=frequency,
+                target_price_drop=target,
+            )
+            Product.objects.create(
+                url=f"{cls.URL}?spm={i}",
+                title="AirPods",
+                current_price=200,
+                lowest_price=0,
+                highest_price=0,
+                alert_threshold=threshold,
+                user=user,
+            )
+
+    def test_find_triggered_watchers(self):
+        with query_budget(1):
+            watchers = list(find_triggered_watchers("daraz:290709810-s1342209012", 150))
+
+        self.assertEqual(
+            [watcher.user.email for watcher in watchers],
+            ["watcher0@example.com", "watcher2@example.com"],
+        )
+
+    @override_settings(REFRESH_PARSE_WORKERS=0)
+    @mock.patch("tracker.pipeline.parse_fetched")
+    @mock.patch("tracker.pipeline.fetch_product")
+    def test_update_all_products_scrapes_each_item_once(
+        self, fetch_product, parse_fetched
+    ):
+        fetch_product.return_value = ("html", "<html></html>")
+        parse_fetched.return_value = {"title": "AirPods", "price": 150.0}
+
+        update_all_products()
+
+        self.assertEqual(fetch_product.call_count, 1)
+        self.assertEqual(parse_fetched.call_count, 1)
+        self.assertEqual(AlertOutbox.objects.count(), 2)
+        self.assertEqual(PriceDropEvent.objects.count(), 5)
+        self.assertFalse(Product.objects.exclude(current_price=150).exists())
+
+
+class CanonicalKeyTests(TestCase):
+    def test_daraz_sku_variants_are_separate_items(self):
+        base = "https://www.daraz.com.np/products/shirt-i290709810"
+        keys = [
+            canonical_product_key(f"{base}-s1.html?spm=a", "daraz"),
+            canonical_product_key(f"{base}-s1.html", "daraz"),
+            canonical_product_key(f"{base}-s2.html", "daraz"),
+            canonical_product_key(f"{base}.html", "daraz"),
+        ]
+        self.assertEqual(
+            keys,
+            [
+                "daraz:290709810-s1",
+                "daraz:290709810-s1",
+                "daraz:290709810-s2",
+                "daraz:290709810",
+            ],
+        )
+
+    def test_rekey_products(self):
+        user = User.objects.create_user("rekey@example.com", "rekey")
+        product = Product.objects.create(
+            url="https://www.daraz.com.np/products/shirt-i7-s2.html",
+            title="Shirt",
+            current_price=100,
+            lowest_price=0,
+            highest_price=0,
+            user=user,
+        )
+        Product.objects.filter(pk=product.pk).update(canonical_key="daraz:7")
+
+        out = StringIO()
+        call_command("rekey_products", stdout=out)
+
+        self.assertIn("1 of 1 canonical keys updated", out.getvalue())
+        product.refresh_from_db()
+        self.assertEqual(product.canonical_key, "daraz:7-s2")
+
+    @override_settings(REFRESH_PARSE_WORKERS=0)
+    @mock.patch("tracker.pipeline.parse_fetched")
+    @mock.patch("tracker.pipeline.fetch_product")
+    def test_refresh_derives_blank_keys(self, fetch_product, parse_fetched):
+        user = User.objects.create_user("blank@example.com", "blank")
+        for asin in ["B000000001", "B000000002", "B000000003"]:
+            Product.objects.create(
+                url=f"https://www.amazon.in/dp/{asin}",
+                title=asin,
+                current_price=100,
+                lowest_price=0,
+                highest_price=0,
+                store="amazon",
+                user=user,
+            )
+        # ? as saved before canonical keys existed
+        Product.objects.update(canonical_key="")
+        fetch_product.side_effect = lambda url, store: ("html", url)
+        parse_fetched.side_effect = lambda kind, url, store: {
+            "title": "Item",
+            "price": float(url[-1]),
+        }
+
+        refresh_products(Product.objects.all(), listings=False, dry_run=True)
+        self.assertEqual(fetch_product.call_count, 3)
+        self.assertEqual(Product.objects.filter(canonical_key="").count(), 3)
+
+        refresh_products(Product.objects.all(), listings=False)
+
+        self.assertEqual(
+            sorted(Product.objects.values_list("canonical_key", "current_price")),
+            [
+                ("amazon:B000000001", 1.0),
+                ("amazon:B000000002", 2.0),
+                ("amazon:B000000003", 3.0),
+            ],
+        )
+
+
+class CleanupTests(TestCase):
+    def test_old_products_are_archived_in_batches(self):
+        user = User.objects.create_user("cleanup@example.com", "cleanup")
+        for i in range(5):
+            Product.objects.create(
+                url=f"https://example.com/{i}",
+                title=f"Product {i}",
+                current_price=100,
+                lowest_price=0,
+                highest_price=0,
+                price_points=[{"date": "2025-01-01T00:00:00", "price": 100}],
+                user=user,
+            )
+        Product.objects.exclude(url="https://example.com/4").update(
+            last_checked=timezone.now() - timedelta(days=31)
+        )
+
+        with tempfile.TemporaryDirectory() as directory:
+            with override_settings(
+                CLEANUP_ARCHIVE_DIR=directory,
+                CLEANUP_BATCH_SIZE=3,
+                CLEANUP_BATCH_PAUSE=0,
+            ):
+                self.assertEqual(delete_old_products(), "Deleted 4 old products")
+
+            (archive,) = Path(directory).iterdir()
+            with gzip.open(archive, "rt") as f:
+                rows = [json.loads(line) for line in f]
+
+        self.assertEqual(len(rows), 4)
+        self.assertEqual(rows[0]["price_history"][0]["price"], 100)
+        self.assertEqual(
+            list(Product.objects.values_list("url", flat=True)),
+            ["https://example.com/4"],
+        )
+
+    def test_owners_are_bumped_once_per_batch(self):
+        users = [
+            User.objects.create_user(f"owner{i}@example.com", f"owner{i}")
+            for i in range(2)
+        ]
+        for user in users:
+            CollectionVersion.current(user.pk)
+            for i in range(3):
+                Product.objects.create(
+                    url=f"https://example.com/{user.pk}/{i}",
+                    title=f"Product {i}",
+                    current_price=100,
+                    lowest_price=0,
+                    highest_price=0,
+                    user=user,
+                )
+        versions = {user.pk: CollectionVersion.current(user.pk) for user in users}
+
+        with tempfile.TemporaryDirectory() as directory:
+            with CaptureQueriesContext(connection) as queries:
+                archive_and_delete(
+                    Product.objects.all(), Path(directory) / "archive.ndjson.gz"
+                )
+
+        bumps = [
+            query
+            for query in queries.captured_queries
+            if query["sql"].startswith('UPDATE "tracker_collectionversion"')
+        ]
+        self.assertEqual(len(bumps), 2)
+        for user in users:
+            self.assertEqual(CollectionVersion.current(user.pk), versions[user.pk] + 1)
+
+
+class PriceSeriesTests(TestCase):
+    def test_round_trip_collapses_unchanged_prices(self):
+        timestamps = 1_700_000_000 + np.arange(1000) * 3600
+        prices = np.where(np.arange(1000) % 100 < 50, 1650.0, 1499.5)
+
+        blob = encode_series(timestamps, prices)
+        decoded_timestamps, decoded_prices = decode_series(blob)
+
+        self.assertLess(len(blob), 200)
+        self.assertEqual(decoded_timestamps.size, 40)
+        # ? the step function is unchanged at every original point
+        latest = np.searchsorted(decoded_timestamps, timestamps, side="right") - 1
+        np.testing.assert_array_equal(decoded_prices[latest], prices)
+        self.assertEqual(decoded_timestamps[-1], timestamps[-1])
+
+    def test_product_history_keeps_api_shape(self):
+        user = User.objects.create_user("series@example.com", "series")
+        product = Product.objects.create(
+            url="https://example.com/series",
+            title="Series",
+            current_price=100,
+            lowest_price=0,
+            highest_price=0,
+            user=user,
+        )
+        for price in [90, 95.5]:
+            product.current_price = price
+            product.save()
+
+        product.refresh_from_db()
+        history = product.price_points
+        self.assertEqual([point["price"] for point in history], [90, 95.5])
+        self.assertEqual(set(history[0]), {"date", "price"})
+
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get(f"/api/products/{product.pk}/")
+        self.assertEqual(response.json()["price_history"], history)
+
+    def test_legacy_history_is_read_before_encoding(self):
+        user = User.objects.create_user("unconverted@example.com", "unconverted")
+        product = Product.objects.create(
+            url="https://example.com/unconverted",
+            title="Unconverted",
+            current_price=100,
+            lowest_price=0,
+            highest_price=0,
+            user=user,
+        )
+        Product.objects.filter(pk=product.pk).update(
+            price_series=b"",
+            price_history=[
+                {"date": "2025-01-01T00:00:00", "price": 120},
+                {"date": "2025-02-01T00:00:00", "price": 100},
+            ],
+        )
+        expected = [
+            {"date": "2025-01-01T00:00:00", "price": 120.0},
+            {"date": "2025-02-01T00:00:00", "price": 100.0},
+        ]
+        client = APIClient()
+        client.force_authenticate(user)
+
+        for fast_reads in [True, False]:
+            with self.settings(PRODUCT_FAST_READS=fast_reads):
+                detail = client.get(f"/api/products/{product.pk}/").json()
+                listed = client.get("/api/products/?expand=true").json()
+            self.assertEqual(detail["price_history"], expected)
+            self.assertEqual(listed["results"][0]["price_history"], expected)
+
+        response = client.get(f"/api/products/{product.pk}/history/?resolution=day")
+        self.assertEqual(
+            [point["last"] for point in response.json()["points"]], [120.0, 100.0]
+        )
+        exported = b"".join(export_products(Product.objects.all(), "ndjson", "history"))
+        self.assertEqual(len(exported.splitlines()), 2)
+
+    def test_legacy_history_is_encoded(self):
+        user = User.objects.create_user("legacy@example.com", "legacy")
+        product = Product.objects.create(
+            url="https://example.com/legacy",
+            title="Legacy",
+            current_price=100,
+            lowest_price=0,
+            highest_price=0,
+            user=user,
+        )
+        product.price_points = [{"date": "2025-03-01T00:00:00", "price": 80}]
+        Product.objects.filter(pk=product.pk).update(
+            price_series=product.price_series,
+            price_history=[
+                {"date": "2025-01-01T10:00:00.250000", "price": 120},
+                {"date": "2025-02-01T00:00:00", "price": 100},
+            ],
+        )
+
+        out = StringIO()
+        call_command("encode_price_history", stdout=out)
+        call_command("encode_price_history", stdout=out)
+
+        self.assertIn("Encoded 2 points of 1 products", out.getvalue())
+        self.assertIn("Encoded 0 points of 0 products", out.getvalue())
+        product.refresh_from_db()
+        self.assertEqual(product.price_history, [])
+        self.assertEqual(
+            product.price_points,
+            [
+                {"date": "2025-01-01T10:00:00", "price": 120.0},
+                {"date": "2025-02-01T00:00:00", "price": 100.0},
+                {"date": "2025-03-01T00:00:00", "price": 80.0},
+            ],
+        )
+
+    def test_history_endpoint_is_bounded(self):
+        user = User.objects.create_user("chart@example.com", "chart")
+        product = Product.objects.create(
+            url="https://example.com/chart",
+            title="Chart",
+            current_price=100,
+            lowest_price=0,
+            highest_price=0,
+            user=user,
+        )
+        timestamps = 1_700_000_000 + np.arange(20_000) * 1800
+        Product.objects.filter(pk=product.pk).update(
+            price_series=encode_series(timestamps, 100 + np.arange(20_000) % 7)
+        )
+
+        client = APIClient()
+        client.force_authenticate(user)
+        response = client.get(f"/api/products/{product.pk}/history/?resolution=day")
+
+        points = response.json()["points"]
+        self.assertLessEqual(len(points), MAX_POINTS)
+        self.assertEqual(min(point["min"] for point in points), 100)
+        self.assertEqual(max(point["max"] for point in points), 106)
+
+
+class StartupTests(SimpleTestCase):
+    def test_web_process_does_not_load_scraper_stack(self):
+        rows, loaded = measure_imports(TARGETS["web"])
+
+        self.assertIn("tracker.views", loaded)
+        self.assertNotIn("bs4", loaded)
+        self.assertTrue(rows)
+
+
+class RefreshPipelineTests(SimpleTestCase):
+    @mock.patch("tracker.stores.fetch_page")
+    def test_pages_are_parsed_in_worker_processes(self, fetch_page):
+        html = Path("daraz_raw.html").read_text(encoding="utf-8")
+
+        def fake_fetch(url, store):
+            if url.endswith("offline"):
+                raise ConnectionError("offline")
+            return html
+
+        fetch_page.side_effect = fake_fetch
+
+        written = {}
+        items = [
+            (f"item-{i}", f"https://www.daraz.com.np/item-{i}.html", "daraz")
+            for i in range(3)
+        ]
+        items.append(("offline", "https://www.daraz.com.np/offline", "daraz"))
+
+        stages = run_refresh_pipeline(
+            items, written.__setitem__, fetch_workers=2, parse_workers=2
+        )
+
+        self.assertEqual(written["item-0"]["price"], 1650.0)
+        self.assertEqual(len(written), 4)
+        self.assertIsNone(written["offline"])
+        self.assertEqual(stages["fetch"]["items"], 4)
+        self.assertEqual(stages["fetch"]["errors"], 1)
+        self.assertEqual(stages["parse"]["items"], 3)
+        self.assertEqual(stages["write"]["items"], 4)
+
+    @override_settings(REFRESH_QUEUE_SIZE=2)
+    @mock.patch("tracker.pipeline.fetch_product", return_value=("html", ""))
+    def test_interrupted_write_stops_every_stage(self, fetch_product):
+        items = [
+            (f"item-{i}", f"https://example.com/{i}", "generic") for i in range(50)
+        ]
+        raised = []
+
+        def write(key, data):
+            raise KeyboardInterrupt
+
+        def run():
+            try:
+                run_refresh_pipeline(items, write, fetch_workers=4, parse_workers=1)
+            except KeyboardInterrupt:
+                raised.append(True)
+
+        # ? fetchers and the dispatcher were left blocked on full queues
+        thread = threading.Thread(target=run, daemon=True)
+        thread.start()
+        thread.join(timeout=10)
+
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(raised, [True])
+        self.assertLess(fetch_product.call_count, len(items))
+
+    @mock.patch("tracker.stores.fetch_page")
+    def test_daemonic_processes_parse_in_threads(self, fetch_page):
+        fetch_page.return_value = Path("daraz_raw.html").read_text(encoding="utf-8")
+        written = {}
+
+        # ? as in a Celery prefork child, where starting a process would fail
+        with mock.patch.dict(multiprocessing.current_process()._config, daemon=True):
+            run_refresh_pipeline(
+                [("item", "https://www.daraz.com.np/item.html", "daraz")],
+                written.__setitem__,
+                parse_workers=2,
+            )
+
+        self.assertEqual(written["item"]["price"], 1650.0)
+
+    @override_settings(SCRAPE_TRACING=True)
+    @mock.patch("tracker.stores.fetch_page")
+    def test_traces_join_spans_from_every_stage(self, fetch_page):
+        fetch_page.return_value = Path("daraz_raw.html").read_text(encoding="utf-8")
+        items = [("item", "https://www.daraz.com.np/item.html", "daraz")]
+
+        with self.assertLogs("tracker.tracing") as logs:
+            run_refresh_pipeline(items, lambda key, data: None, parse_workers=1)
+
+        trace = json.loads(logs.records[0].getMessage())
+        self.assertEqual(trace["key"], "item")
+        self.assertEqual(
+            [(span["name"], span["depth"]) for span in trace["spans"]],
+            [
+                ("fetch", 0),
+                ("parse", 0),
+                ("scrape_html", 1),
+                ("module_data", 2),
+                ("write", 0),
+            ],
+        )
+
+    @mock.patch("tracker.stores.fetch_page", return_value="<html></html>")
+    def test_tracing_is_off_by_default(self, fetch_page):
+        with self.assertNoLogs("tracker.tracing"):
+            run_refresh_pipeline(
+                [("item", "https://example.com/item", "generic")],
+                lambda key, data: None,
+                parse_workers=0,
+            )
+
+
+@override_settings(REFRESH_PARSE_WORKERS=2)
+@mock.patch("tracker.stores.fetch_page")
+class RefreshTaskParseWorkersTests(TestCase):
+    """The scheduled refresh with parser processes, as the settings ship"""
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user("workers@example.com", "workers")
+        cls.product = Product.objects.create(
+            url="https://www.daraz.com.np/products/airpods-i1-s1.html",
+            title="AirPods",
+            current_price=2000,
+            lowest_price=0,
+            highest_price=0,
+            user=user,
+        )
+
+    def setUp(self):
+        self.html = Path("daraz_raw.html").read_text(encoding="utf-8")
+
+    def test_parses_in_worker_processes(self, fetch_page):
+        fetch_page.return_value = self.html
+
+        result = update_all_products()
+
+        self.assertEqual(result["updated"], 1)
+        self.assertEqual(Product.objects.get().current_price, 1650.0)
+
+    def test_dry_run_saves_no_strategy_scores(self, fetch_page):
+        fetch_page.return_value = self.html
+
+        result = refresh_products(Product.objects.all(), listings=False, dry_run=True)
+
+        self.assertEqual(result["updated"], 1)
+        self.assertFalse(ExtractionStrategyScore.objects.exists())
+        self.assertEqual(Product.objects.get().current_price, 2000)
+
+        update_all_products()
+        self.assertTrue(ExtractionStrategyScore.objects.exists())
+
+    def test_parses_in_threads_in_celery_prefork_children(self, fetch_page):
+        fetch_page.return_value = self.html
+
+        with mock.patch.dict(multiprocessing.current_process()._config, daemon=True):
+            result = update_all_products()
+
+        self.assertEqual(result["updated"], 1)
+
+
+class ProfileScrapeTests(TestCase):
+    def test_profile_scrape_reports_stages(self):
+        out = StringIO()
+        call_command("profile_scrape", "--top", "5", stdout=out)
+
+        report = out.getvalue()
+        self.assertIn("daraz, module_data, price 1650.0", report)
+        self.assertIn("module_data", report.split("Stages")[1])
+        self.assertIn("peak", report)
+
+
+class StandInStoreHandler(BaseHTTPRequestHandler):
+    """
+    Serves recorded store responses from `server.pages`, keyed by path, as
+    `(content_type, body)` or `(content_type, body, extra_headers)`.
+    """
+
+    def do_GET(self):
+        self.server.request_headers.append(dict(self.headers))
+        if self.path not in self.server.pages:
+            self.send_error(404)
+            return
+
+        content_type, body, *headers = self.server.pages[self.path]
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        for name, value in (headers[0] if headers else {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        try:
+            self.wfile.write(body)
+        except (BrokenPipeError, ConnectionResetError):
+            pass  # ? the client stopped reading early
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StandInStoreMixin:
+    """Runs a local HTTP server standing in for the stores' sites"""
+
+    pages = {}
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), StandInStoreHandler)
+        cls.server.pages = cls.pages
+        cls.server.request_headers = []
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.base_url = f"http://127.0.0.1:{cls.server.server_port}"
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        super().tearDownClass()
+
+
+class StandInStoreTestCase(StandInStoreMixin, SimpleTestCase):
+    pass
+
+
+DARAZ_PAGE = Path("daraz_raw.html").read_bytes()
+
+
+class StreamingFetchTests(StandInStoreTestCase):
+    pages = {"/daraz.html": ("text/html; charset=utf-8", DARAZ_PAGE)}
+
+    def test_download_stops_after_stop_marker(self):
+        before = transfer_stats.as_dict().get("daraz", {})
+        full_html = self.pages["/daraz.html"][1].decode("utf-8")
+
+        html = fetch_page(f"{self.base_url}/daraz.html", "daraz")
+
+        after = transfer_stats.as_dict()["daraz"]
+        self.assertIn("app.run(", html)
+        self.assertLess(len(html), len(full_html))
+        self.assertEqual(after["early_stops"], before.get("early_stops", 0) + 1)
+        self.assertGreater(after["bytes_saved"], before.get("bytes_saved", 0))
+        self.assertEqual(
+            parse_product(html, "daraz"), parse_product(full_html, "daraz")
+        )
+
+    @override_settings(SCRAPER_STREAMING=False)
+    def test_full_download_without_streaming(self):
+        html = fetch_page(f"{self.base_url}/daraz.html", "daraz")
+
+        self.assertEqual(len(html), len(self.pages["/daraz.html"][1].decode("utf-8")))
+
+
+class CompressionTests(StandInStoreTestCase):
+    pages = {
+        "/gzip.html": (
+            "text/html; charset=utf-8",
+            gzip.compress(DARAZ_PAGE),
+            {"Content-Encoding": "gzip"},
+        ),
+        "/compress.html": (
+            "text/html; charset=utf-8",
+            DARAZ_PAGE,
+            {"Content-Encoding": "compress"},
+        ),
+    }
+
+    def test_advertises_only_decodable_encodings(self):
+        encodings = accept_encoding().split(",")
+        self.assertIn("gzip", encodings)
+        try:
+            import brotli  # noqa: F401
+
+            self.assertIn("br", encodings)
+        except ImportError:
+            self.assertNotIn("br", encodings)
+
+        fetch_page(f"{self.base_url}/gzip.html", "generic")
+        self.assertEqual(
+            self.server.request_headers[-1]["Accept-Encoding"], accept_encoding()
+        )
+
+    def test_records_wire_and_decoded_bytes(self):
+        before = transfer_stats.as_dict().get("generic", {})
+
+        html = fetch_page(f"{self.base_url}/gzip.html", "generic")
+
+        after = transfer_stats.as_dict()["generic"]
+        wire = after["wire_bytes"] - before.get("wire_bytes", 0)
+        decoded = after["decoded_bytes"] - before.get("decoded_bytes", 0)
+        self.assertEqual(html, DARAZ_PAGE.decode("utf-8"))
+        self.assertEqual(wire, len(self.pages["/gzip.html"][1]))
+        self.assertEqual(decoded, len(DARAZ_PAGE))
+        self.assertEqual(after["gzip_pages"], before.get("gzip_pages", 0) + 1)
+
+    def test_undecodable_response_fails_loudly(self):
+        import requests
+
+        with self.assertRaises(requests.exceptions.ContentDecodingError):
+            fetch_page(f"{self.base_url}/compress.html", "generic")
+
+
+def daraz_module_data():
+    html = DARAZ_PAGE.decode("utf-8")
+    start = html.index("{", html.index("var __moduleData__ = "))
+    return json.JSONDecoder().raw_decode(html, start)[0]
+
+
+SHOP_PAGE = b"""<html><head><title>Lamp</title>
+<meta property="og:title" content="Lamp">
+<meta itemprop="price" content="12.50"></head><body><h1>Lamp</h1></body></html>"""
+
+
+@override_settings(STORE_JSON_ENDPOINTS={"generic": "{origin}{path}.js"})
+class StoreAdapterTests(StandInStoreTestCase):
+    pages = {
+        "/products/airpods.js": (
+            "application/json",
+            json.dumps(
+                {
+                    "title": "AirPods",
+                    "price": 165000,
+                    "featured_image": "//cdn.example.com/airpods.jpg",
+                    "description": "<p>True wireless</p>",
+                }
+            ).encode(),
+        ),
+        "/products/legacy": ("text/html", b"<html><h1>Legacy</h1></html>"),
+        # ? a storefront answering every path with its app's page
+        "/products/lamp.js": ("text/html; charset=utf-8", SHOP_PAGE),
+        "/products/lamp": ("text/html", SHOP_PAGE),
+        "/products/sold-out.js": ("application/json", b'{"title": "Sold out"}'),
+        "/products/sold-out": ("text/html", SHOP_PAGE),
+        "/daraz/290709810.json": (
+            "application/json",
+            json.dumps(daraz_module_data()).encode(),
+        ),
+    }
+
+    def test_prefers_json_endpoint(self):
+        kind, body = fetch_product(f"{self.base_url}/products/airpods", "generic")
+
+        self.assertEqual(kind, "json")
+        self.assertEqual(
+            parse_fetched(kind, body, "generic"),
+            {
+                "title": "AirPods",
+                "price": 1650.0,
+                "image_url": "https://cdn.example.com/airpods.jpg",
+                "description": "True wireless",
+                "strategy": "json_endpoint",
+            },
+        )
+
+    def test_falls_back_to_html(self):
+        before = transfer_stats.as_dict().get("generic", {})
+
+        kind, body = fetch_product(f"{self.base_url}/products/legacy", "generic")
+
+        self.assertEqual((kind, body), ("html", "<html><h1>Legacy</h1></html>"))
+        self.assertEqual(
+            transfer_stats.as_dict()["generic"]["json_fallbacks"],
+            before.get("json_fallbacks", 0) + 1,
+        )
+
+    def test_html_answer_to_json_endpoint_falls_back(self):
+        kind, body = fetch_product(f"{self.base_url}/products/lamp", "generic")
+
+        self.assertEqual(kind, "html")
+        self.assertEqual(parse_fetched(kind, body, "generic")["price"], 12.5)
+
+    def test_json_without_price_falls_back(self):
+        kind, body = fetch_product(f"{self.base_url}/products/sold-out", "generic")
+
+        self.assertEqual(kind, "html")
+        self.assertEqual(parse_fetched(kind, body, "generic")["price"], 12.5)
+
+    def test_no_endpoint_by_default(self):
+        before = transfer_stats.as_dict().get("generic", {})
+
+        with self.settings(STORE_JSON_ENDPOINTS={}):
+            kind, _ = fetch_product(f"{self.base_url}/products/lamp", "generic")
+
+        self.assertEqual(kind, "html")
+        self.assertEqual(
+            transfer_stats.as_dict()["generic"].get("json_fallbacks", 0),
+            before.get("json_fallbacks", 0),
+        )
+
+    def test_daraz_endpoint_from_settings(self):
+        url = f"{self.base_url}/products/airpods-i290709810-s1342209012.html"
+        endpoints = {"daraz": self.base_url + "/daraz/{item_id}.json"}
+
+        with self.settings(STORE_JSON_ENDPOINTS=endpoints):
+            kind, body = fetch_product(url, "daraz")
+
+        self.assertEqual(kind, "json")
+        self.assertLess(len(body), len(DARAZ_PAGE) / 5)
+        data = parse_fetched(kind, body, "daraz")
+        self.assertEqual(data["price"], 1650.0)
+        self.assertTrue(data["title"].startswith("Airpods True Wirelees"))
+
+    @mock.patch("tracker.utils.make_soup")
+    def test_daraz_page_parsed_from_module_data(self, make_soup):
+        with mock.patch("tracker.strategies.ranking", StrategyRanking()):
+            data = DarazAdapter().parse_html(DARAZ_PAGE.decode("utf-8"))
+
+        make_soup.assert_not_called()
+        self.assertEqual(data["strategy"], "module_data")
+        self.assertEqual(data["price"], 1650.0)
+        self.assertTrue(data["image_url"].endswith(".jpg"))
+
+
+class ListingRefreshTests(StandInStoreMixin, TestCase):
+    LISTED = "https://www.daraz.com.np/products/airpods-i290709810-s1342209012.html"
+    UNLISTED = "https://www.daraz.com.np/products/charger-i111-s222.html"
+
+    pages = {
+        "/catalog/?q=airpods&ajax=true": (
+            "application/json",
+            json.dumps(
+                {
+                    "mods": {
+                        "listItems": [
+                            {
+                                "itemId": "290709810",
+                                "skuId": "1342209012",
+                                "name": "Airpods True Wireless",
+                                "price": "1499.00",
+                                "image": "https://img.example.com/airpods.jpg",
+                                "inStock": True,
+                            },
+                            {
+                                "itemId": "333",
+                                "name": "Sold out",
+                                "price": "10.00",
+                                "inStock": False,
+                            },
+                        ]
+                    }
+                }
+            ).encode(),
+        ),
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        for i in range(2):
+            user = User.objects.create_user(f"lister{i}@example.com", f"lister{i}")
+            for url in [cls.LISTED, cls.UNLISTED]:
+                Product.objects.create(
+                    url=url,
+                    title="Tracked",
+                    current_price=1650,
+                    lowest_price=0,
+                    highest_price=0,
+                    user=user,
+                )
+
+    def setUp(self):
+        self.listing = ListingPage.objects.create(
+            url=f"{self.base_url}/catalog/?q=airpods", name="AirPods search"
+        )
+
+    @override_settings(REFRESH_PARSE_WORKERS=0)
+    @mock.patch("tracker.pipeline.parse_fetched")
+    @mock.patch("tracker.pipeline.fetch_product")
+    def test_listed_items_skip_page_scrape(self, fetch_product, parse_fetched):
+        fetch_product.return_value = ("html", "<html></html>")
+        parse_fetched.return_value = {"title": "Charger", "price": 500.0}
+
+        result = update_all_products()
+
+        fetch_product.assert_called_once_with(self.UNLISTED, "daraz")
+        self.assertEqual(result["listed"], 1)
+        self.assertEqual(result["updated"], 4)
+        self.assertEqual(
+            set(Product.objects.values_list("url", "current_price")),
+            {(self.LISTED, 1499.0), (self.UNLISTED, 500.0)},
+        )
+        self.assertEqual(PriceDropEvent.objects.count(), 4)
+
+        self.listing.refresh_from_db()
+        self.assertEqual(
+            self.listing.item_keys,
+            ["daraz:290709810", "daraz:290709810-s1342209012"],
+        )
+        self.assertIsNotNone(self.listing.last_fetched)
+
+    def test_pages_without_tracked_items_wait_for_rediscovery(self):
+        ListingPage.objects.filter(pk=self.listing.pk).update(
+            item_keys=["daraz:999"], last_fetched=timezone.now()
+        )
+        self.assertEqual(listing_pages_for({"daraz:290709810"}), [])
+
+        ListingPage.objects.filter(pk=self.listing.pk).update(
+            last_fetched=timezone.now() - timedelta(days=2)
+        )
+        self.assertEqual(listing_pages_for({"daraz:290709810"}), [self.listing])
+
+
+class MetricsTests(TestCase):
+    def test_histogram_buckets_are_cumulative(self):
+        histogram = Histogram("test_seconds", "Test", ["store"], buckets=(0.1, 1))
+        for value in [0.05, 0.5, 5]:
+            histogram.observe(value, store="daraz")
+
+        self.assertEqual(
+            histogram.render().splitlines()[2:],
+            [
+                'test_seconds_bucket{store="daraz",le="0.1"} 1',
+                'test_seconds_bucket{store="daraz",le="1"} 2',
+                'test_seconds_bucket{store="daraz",le="+Inf"} 3',
+                'test_seconds_sum{store="daraz"} 5.55',
+                'test_seconds_count{store="daraz"} 3',
+            ],
+        )
+
+    def test_endpoint_is_staff_only(self):
+        user = User.objects.create_user("metrics@example.com", "metrics")
+        client = APIClient()
+        client.force_authenticate(user)
+        client.get("/api/products/")
+        self.assertEqual(client.get("/api/metrics/").status_code, 403)
+
+        user.is_staff = True
+        user.save()
+        response = client.get("/api/metrics/")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response["Content-Type"].startswith("text/plain"))
+        self.assertIn(
+            'dealdoko_http_request_seconds_count{view="product-list",method="GET",'
+            'status="200"}',
+            response.content.decode(),
+        )
+
+    def test_exporter_listens_on_loopback_from_first_free_port(self):
+        taken = ThreadingHTTPServer(("127.0.0.1", 0), BaseHTTPRequestHandler)
+        port = taken.server_port
+        server = start_exporter(port, tries=2)
+        self.addCleanup(taken.server_close)
+        if server is None:
+            self.skipTest(f"port {port + 1} is in use")
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        self.assertEqual(server.server_address, ("127.0.0.1", port + 1))
+        response = requests.get(f"http://127.0.0.1:{port + 1}/metrics", timeout=5)
+        self.assertIn("dealdoko_fetch_seconds", response.text)
+        self.assertIsNone(start_exporter(port, tries=1))
+
+
+@override_settings(REFRESH_PARSE_WORKERS=0)
+@mock.patch("tracker.pipeline.parse_fetched")
+@mock.patch("tracker.pipeline.fetch_product")
+class RefreshCommandTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user("operator@example.com", "operator")
+        for i, store in enumerate(["daraz", "daraz", "daraz", "amazon"]):
+            Product.objects.create(
+                url=f"https://www.{store}.com/products/item-i{i}.html",
+                title=f"Item {i}",
+                current_price=200,
+                lowest_price=0,
+                highest_price=0,
+                store=store,
+                user=user,
+            )
+
+    def setUp(self):
+        self.checkpoint = Path(tempfile.mkdtemp()) / "checkpoint.json"
+
+    def refresh(self, *args):
+        out = StringIO()
+        call_command(
+            "refresh_products",
+            *args,
+            "--no-listings",
+            f"--checkpoint={self.checkpoint}",
+            stdout=out,
+        )
+        return out.getvalue()
+
+    def test_dry_run_saves_nothing(self, fetch_product, parse_fetched):
+        fetch_product.return_value = ("html", "<html></html>")
+        parse_fetched.return_value = {"title": "Item", "price": 150.0}
+
+        report = self.refresh("--store", "daraz", "--dry-run")
+
+        self.assertEqual(fetch_product.call_count, 3)
+        self.assertIn("3 products updated, 3 price drops", report)
+        self.assertFalse(Product.objects.exclude(current_price=200).exists())
+        self.assertFalse(self.checkpoint.exists())
+
+    def test_resumes_after_the_last_checkpointed_batch(
+        self, fetch_product, parse_fetched
+    ):
+        fetch_product.return_value = ("html", "<html></html>")
+        parse_fetched.return_value = {"title": "Item", "price": 150.0}
+        real_refresh = refresh_products
+        calls = []
+
+        def interrupted(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 2:
+                raise KeyboardInterrupt
+            return real_refresh(*args, **kwargs)
+
+        with mock.patch(
+            "tracker.management.commands.refresh_products.refresh_products",
+            side_effect=interrupted,
+        ):
+            report = self.refresh("--store", "daraz", "--batch-size", "1")
+        self.assertIn("run again with --resume", report)
+        self.assertEqual(
+            json.loads(self.checkpoint.read_text())["counts"]["updated"], 1
+        )
+
+        with self.assertRaises(CommandError):
+            self.refresh("--store", "amazon", "--resume")
+
+        report = self.refresh("--store", "daraz", "--batch-size", "1", "--resume")
+
+        self.assertEqual(fetch_product.call_count, 3)
+        self.assertIn("3 products updated", report)
+        self.assertEqual(
+            Product.objects.filter(store="daraz", current_price=150).count(), 3
+        )
+        self.assertEqual(Product.objects.get(store="amazon").current_price, 200)
+        self.assertFalse(self.checkpoint.exists())
+
+    def test_alerts_only_watchers_in_the_selection(self, fetch_product, parse_fetched):
+        fetch_product.return_value = ("html", "<html></html>")
+        parse_fetched.return_value = {"title": "Item", "price": 50.0}
+        product = Product.objects.filter(store="daraz").first()
+        product.alert_threshold = 160
+        product.save()
+        watcher = User.objects.create_user("watcher@example.com", "watcher")
+        for user in [product.user, watcher]:
+            UserPreference.objects.create(user=user, notification_frequency="instant")
+        other = Product.objects.create(
+            url=product.url,
+            title=product.title,
+            current_price=200,
+            lowest_price=0,
+            highest_price=0,
+            alert_threshold=160,
+            store="daraz",
+            user=watcher,
+        )
+
+        self.refresh("--user", "operator")
+
+        self.assertTrue(AlertOutbox.objects.filter(product=product).exists())
+        self.assertFalse(AlertOutbox.objects.filter(user=watcher).exists())
+        other.refresh_from_db()
+        self.assertEqual(other.current_price, 200)
+
+    def test_resume_keeps_the_checkpointed_skips(self, fetch_product, parse_fetched):
+        fetch_product.return_value = ("html", "<html></html>")
+        parse_fetched.return_value = {"title": "Item", "price": 150.0}
+        # ? parked after the first batch, which is where the run stops
+        product = Product.objects.filter(store="daraz").order_by("canonical_key").last()
+        ScrapeFailure.objects.create(
+            canonical_key=product.canonical_key,
+            url=product.url,
+            store="daraz",
+            kind="blocked",
+            failures=5,
+            first_failed_at=timezone.now(),
+            retry_at=timezone.now(),
+            parked=True,
+        )
+        real_refresh = refresh_products
+        calls = []
+
+        def interrupted(*args, **kwargs):
+            calls.append(args)
+            if len(calls) == 2:
+                raise KeyboardInterrupt
+            return real_refresh(*args, **kwargs)
+
+        with mock.patch(
+            "tracker.management.commands.refresh_products.refresh_products",
+            side_effect=interrupted,
+        ):
+            self.refresh("--store", "daraz", "--batch-size", "1")
+
+        report = self.refresh("--store", "daraz", "--batch-size", "1", "--resume")
+
+        self.assertIn("2 products updated", report)
+        self.assertIn("1 backed off after failing", report)
+
+
+@mock.patch("tracker.strategies.ranking", new_callable=StrategyRanking)
+class StrategyRankingTests(TestCase):
+    def run_page(self, prices):
+        """Scrape one page where strategy `name` finds `prices[name]`"""
+        tried = []
+
+        def strategy(name):
+            tried.append(name)
+            return {"title": "Item", "price": prices[name]}
+
+        strategies = {name: functools.partial(strategy, name) for name in prices}
+        result = run_ranked("daraz", "template", strategies)
+        return result and result["strategy"], tried
+
+    def test_winning_strategy_is_tried_first(self, ranking):
+        self.assertEqual(
+            self.run_page({"app_run": 0, "html": 10}), ("html", ["app_run", "html"])
+        )
+        self.assertEqual(self.run_page({"app_run": 0, "html": 10}), ("html", ["html"]))
+
+        # ? the store changes its markup: the old winner fails, the other works
+        prices = {"app_run": 10, "html": 0}
+        self.assertEqual(self.run_page(prices), ("app_run", ["html", "app_run"]))
+        for _ in range(3):
+            self.run_page(prices)
+        self.assertEqual(self.run_page(prices), ("app_run", ["app_run"]))
+
+    def test_new_templates_start_from_the_store_ranking(self, ranking):
+        self.run_page({"app_run": 0, "html": 10})
+
+        self.assertEqual(
+            ranking.order("daraz", "new-template", ["app_run", "html"]),
+            ["html", "app_run"],
+        )
+        self.assertEqual(
+            ranking.order("amazon", "", ["app_run", "html"]), ["app_run", "html"]
+        )
+
+    def test_scores_persist(self, ranking):
+        self.run_page({"app_run": 0, "html": 10})
+        save_ranking()
+        ExtractionStrategyScore.objects.create(
+            store="daraz", fingerprint="retired", strategy="html", score=1
+        )
+        ExtractionStrategyScore.objects.filter(fingerprint="retired").update(
+            updated_at=timezone.now() - timedelta(days=60)
+        )
+        ranking.replace({})
+
+        self.assertEqual(ExtractionStrategyScore.objects.count(), 5)
+        load_ranking()
+        self.assertEqual(
+            ranking.order("daraz", "template", ["app_run", "html"]),
+            ["html", "app_run"],
+        )
+
+        save_ranking()
+        self.assertFalse(
+            ExtractionStrategyScore.objects.filter(fingerprint="retired").exists()
+        )
+
+    def test_fingerprint_ignores_asset_versions(self, ranking):
+        html = DARAZ_PAGE.decode("utf-8")
+
+        self.assertTrue(page_fingerprint(html))
+        self.assertEqual(
+            page_fingerprint(html.replace("pdp-modules/1.5.31", "pdp-modules/1.6.0")),
+            page_fingerprint(html),
+        )
+        self.assertNotEqual(
+            page_fingerprint(html.replace("pdp-modules", "pdp-next")),
+            page_fingerprint(html),
+        )
+
+
+def http_error(status):
+    response = requests.Response()
+    response.status_code = status
+    return requests.HTTPError(f"{status} error", response=response)
+
+
+@override_settings(REFRESH_PARSE_WORKERS=0)
+@mock.patch("tracker.pipeline.parse_fetched")
+@mock.patch("tracker.pipeline.fetch_product")
+class ScrapeFailureTests(TestCase):
+    URL = "https://www.daraz.com.np/products/gone-i404-s1.html"
+
+    @classmethod
+    def setUpTestData(cls):
+        user = User.objects.create_user("failures@example.com", "failures")
+        cls.product = Product.objects.create(
+            url=cls.URL,
+            title="Gone",
+            current_price=100,
+            lowest_price=0,
+            highest_price=0,
+            user=user,
+        )
+
+    def test_errors_are_classified(self, fetch_product, parse_fetched):
+        self.assertEqual(classify_error("fetch", http_error(404)), "gone")
+        self.assertEqual(classify_error("fetch", http_error(429)), "blocked")
+        self.assertEqual(classify_error("fetch", http_error(503)), "error")
+        self.assertEqual(classify_error("fetch", requests.ReadTimeout()), "timeout")
+        self.assertEqual(classify_error("parse", None), "parse")
+
+    def test_dead_items_back_off_then_park(self, fetch_product, parse_fetched):
+        fetch_product.side_effect = http_error(404)
+        last_checked = Product.objects.get().last_checked
+        version = CollectionVersion.current(self.product.user_id)
+
+        update_all_products()
+
+        # ? marked out of stock without save(), the ETag must still change
+        self.assertEqual(CollectionVersion.current(self.product.user_id), version + 1)
+
+        failure = ScrapeFailure.objects.get()
+        self.assertEqual((failure.kind, failure.failures), ("gone", 1))
+        self.assertGreater(failure.retry_at, timezone.now())
+        product = Product.objects.get()
+        self.assertFalse(product.is_in_stock)
+        # ? so delete_old_products can still retire it
+        self.assertEqual(product.last_checked, last_checked)
+
+        self.assertEqual(update_all_products()["skipped"], 1)
+        self.assertEqual(fetch_product.call_count, 1)
+
+        for _ in range(2):
+            ScrapeFailure.objects.update(retry_at=timezone.now())
+            update_all_products()
+        failure.refresh_from_db()
+        self.assertEqual(failure.failures, 3)
+        self.assertTrue(failure.parked)
+
+        ScrapeFailure.objects.update(retry_at=timezone.now())
+        update_all_products()
+        self.assertEqual(fetch_product.call_count, 3)
+
+    def test_success_clears_failures(self, fetch_product, parse_fetched):
+        fetch_product.return_value = ("html", "<html></html>")
+        parse_fetched.return_value = {"title": "Back", "price": 90.0}
+        ScrapeFailure.objects.create(
+            canonical_key=self.product.canonical_key,
+            url=self.URL,
+            store="daraz",
+            kind="timeout",
+            failures=2,
+            first_failed_at=timezone.now(),
+            retry_at=timezone.now() - timedelta(minutes=1),
+        )
+
+        update_all_products()
+
+        self.assertFalse(ScrapeFailure.objects.exists())
+        self.assertEqual(Product.objects.get().current_price, 90.0)
+
+
+class FastReadTests(TestCase):
+    """The `.values()` read path renders exactly what the serializer did"""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("reader@example.com", "reader")
+        cls.products = []
+        for i, (current, highest) in enumerate([(330, 400), (100, 0), (80, 80)]):
+            product = Product.objects.create(
+                url=f"https://example.com/read/{i}",
+                title=f"Read {i}",
+                current_price=current,
+                lowest_price=current,
+                highest_price=highest,
+                description="Heavy",
+                user=cls.user,
+            )
+            # ? save() would track the highest price itself
+            Product.objects.filter(pk=product.pk).update(
+                highest_price=highest,
+                price_series=encode_series(
+                    1_700_000_000 + np.arange(3) * 86400, [highest, current, current]
+                ),
+            )
+            cls.products.append(product)
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    def test_matches_serializer(self):
+        pk = self.products[0].pk
+        for path in [
+            "/api/products/",
+            "/api/products/?expand=true&page_size=2",
+            "/api/products/?fields=id,price_drop_percentage,price_history",
+            f"/api/products/{pk}/",
+            f"/api/products/{pk}/?fields=title,last_checked",
+        ]:
+            with self.subTest(path=path):
+                with override_settings(PRODUCT_FAST_READS=False):
+                    expected = self.client.get(path)
+                response = self.client.get(path)
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(response.content, expected.content)
+
+        # ? 0.175 rounds down in Python, whatever SQL ROUND would say
+        response = self.client.get(f"/api/products/{pk}/")
+        self.assertEqual(response.json()["price_drop_percentage"], 0.17)
+
+    def test_missing_product(self):
+        other = User.objects.create_user("other@example.com", "other")
+        product = Product.objects.create(
+            url="https://example.com/theirs",
+            title="Theirs",
+            current_price=1,
+            lowest_price=1,
+            highest_price=1,
+            user=other,
+        )
+        for pk in [product.pk, "nope"]:
+            response = self.client.get(f"/api/products/{pk}/")
+            self.assertEqual(response.status_code, 404)
+
+    def test_orjson_renders_like_json(self):
+        data = {
+            "at": timezone.now(),
+            "price": 1.5,
+            "title": "Ünïcode",
+            "nested": [{"ok": True, "none": None}],
+        }
+        self.assertEqual(
+            json.loads(ORJSONRenderer().render(data)),
+            json.loads(JSONRenderer().render(data)),
+        )
+
+    def test_list_is_gzipped(self):
+        response = self.client.get(
+            "/api/products/?expand=true", HTTP_ACCEPT_ENCODING="gzip"
+        )
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        self.assertEqual(
+            len(json.loads(gzip.decompress(response.content))["results"]), 3
+        )
+
+
+class ExportTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = User.objects.create_user("exporter@example.com", "exporter")
+        other = User.objects.create_user("other@example.com", "other")
+        for i, user in enumerate([cls.user, cls.user, other]):
+            product = Product.objects.create(
+                url=f"https://example.com/export/{i}",
+                title=f"Export, {i}",
+                current_price=100 + i,
+                lowest_price=100,
+                highest_price=100,
+                user=user,
+            )
+            Product.objects.filter(pk=product.pk).update(
+                price_series=encode_series(
+                    1_700_000_000 + np.arange(4) * 86400, [120, 110, 110, 100 + i]
+                )
+            )
+
+    def setUp(self):
+        self.client = APIClient()
+        self.client.force_authenticate(self.user)
+
+    @mock.patch("tracker.exports.BLOCK_SIZE", 100)
+    def test_csv_catalog(self):
+        response = self.client.get("/api/products/export/", HTTP_ACCEPT="text/csv")
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response["Content-Type"], "text/csv")
+        blocks = list(response.streaming_content)
+        self.assertGreater(len(blocks), 1)
+        rows = list(csv.DictReader(b"".join(blocks).decode().splitlines()))
+        self.assertEqual([row["title"] for row in rows], ["Export, 0", "Export, 1"])
+        self.assertNotIn("price_history", rows[0])
+
+    def test_ndjson_history_gzipped(self):
+        response = self.client.get(
+            "/api/products/export/?export_format=ndjson&data=history",
+            HTTP_ACCEPT_ENCODING="gzip",
+        )
+
+        self.assertEqual(response["Content-Encoding"], "gzip")
+        body = gzip.decompress(b"".join(response.streaming_content))
+        points = [json.loads(line) for line in body.decode().splitlines()]
+        self.assertEqual(len(points), 8)
+        self.assertEqual(
+            set(points[0]), {"product_id", "url", "store", "date", "price"}
+        )
+        self.assertEqual(points[3]["price"], 100.0)
+
+    def test_unknown_format(self):
+        response = self.client.get("/api/products/export/?export_format=xml")
+        self.assertEqual(response.status_code, 400)
+
+    def test_command(self):
+        with tempfile.TemporaryDirectory() as directory:
+            output = Path(directory) / "history.csv.gz"
+            call_command(
+                "export_products",
+                "--data",
+                "history",
+                "--user",
+                "exporter",
+                "--output",
+                str(output),
+                stderr=StringIO(),
+            )
+            rows = list(
+                csv.DictReader(
+                    gzip.decompress(output.read_bytes()).decode().splitlines()
+                )
+            )
+        self.assertEqual(len(rows), 8)
+        self.assertEqual(rows[0]["date"], "2023-11-14T22:13:20")
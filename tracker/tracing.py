@@ -0,0 +1,119 @@
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+class Trace:
+    """
+    Timing spans of one scrape. Spans are recorded by `span` blocks run while
+    the trace is active on the current thread, with their start offset and
+    nesting depth.
+    """
+
+    def __init__(self, name, **attrs):
+        self.name = name
+        self.attrs = attrs
+        self.spans = []
+        self.started = time.perf_counter()
+        self._depth = 0
+
+    @contextmanager
+    def activate(self):
+        previous = getattr(_local, "trace", None)
+        _local.trace = self
+        try:
+            yield self
+        finally:
+            _local.trace = previous
+
+    def add(self, name, start, seconds, depth=0, **attrs):
+        self.spans.append(
+            {
+                "name": name,
+                "start_ms": round((start - self.started) * 1000, 3),
+                "ms": round(seconds * 1000, 3),
+                "depth": depth,
+                **attrs,
+            }
+        )
+
+    def merge(self, spans, start):
+        """Add spans recorded by a trace in another process, begun at `start`"""
+        for span in spans:
+            self.spans.append(
+                {
+                    **span,
+                    "start_ms": round(
+                        (start - self.started) * 1000 + span["start_ms"], 3
+                    ),
+                    "depth": self._depth + span["depth"],
+                }
+            )
+
+    def as_dict(self):
+        return {
+            "trace": self.name,
+            **self.attrs,
+            "ms": round((time.perf_counter() - self.started) * 1000, 3),
+            "spans": sorted(self.spans, key=lambda span: span["start_ms"]),
+        }
+
+    def emit(self):
+        logger.info(json.dumps(self.as_dict()))
+
+
+def current_trace():
+    return getattr(_local, "trace", None)
+
+
+@contextmanager
+def span(name, **attrs):
+    """Time the block as a span of the active trace, if there is one"""
+    trace = current_trace()
+    if trace is None:
+        yield
+        return
+
+    depth = trace._depth
+    trace._depth += 1
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace._depth = depth
+        trace.add(name, start, time.perf_counter() - start, depth, **attrs)
+
+
+def tracing_enabled():
+    from django.conf import settings
+
+    return getattr(settings, "SCRAPE_TRACING", False)
+
+
+@contextmanager
+def start_trace(name, **attrs):
+    """
+    Trace the block and log its spans when SCRAPE_TRACING is on. Yields the
+    trace, or None when tracing is off.
+    """
+    if not tracing_enabled():
+        yield None
+        return
+
+    trace = Trace(name, **attrs)
+    with trace.activate():
+        try:
+            yield trace
+        finally:
+            trace.emit()
+
+
+def activated(trace):
+    """`trace.activate()`, or nothing when `trace` is None"""
+    return trace.activate() if trace else nullcontext()
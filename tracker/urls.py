@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import ProductViewSet, UserPreferenceView
+from .views import MetricsView, ProductViewSet, UserPreferenceView
 
 router = DefaultRouter()
 router.register(r"products", ProductViewSet, basename="product")
@@ -8,4 +8,5 @@ router.register(r"products", ProductViewSet, basename="product")
 urlpatterns = [
     path("", include(router.urls)),
     path("preferences/", UserPreferenceView.as_view(), name="user-preferences"),
+    path("metrics/", MetricsView.as_view(), name="metrics"),
 ]
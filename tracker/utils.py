@@ -1,91 +1,273 @@
-import requests
+import codecs
+import functools
 import re
 import json
 import logging
-from bs4 import BeautifulSoup
+import threading
+import time
+from collections import Counter, defaultdict
 from urllib.parse import urlparse
 
+from django.conf import settings
+
+from .metrics import FETCH_RESPONSES, FETCH_SECONDS
+from .strategies import page_fingerprint, run_ranked
+from .tracing import span, start_trace
+
+# ? requests and BeautifulSoup are imported where used, so processes that
+# ? never scrape don't load them. Log handlers are set up in settings.LOGGING
+
 logger = logging.getLogger(__name__)
 
-# Configure logging
-logging.basicConfig(
-    level=logging.INFO,
-    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s",
-    handlers=[logging.FileHandler("scraper.log"), logging.StreamHandler()],
-)
 
+REQUEST_HEADERS = {
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36",
+    "Accept-Language": "en-US,en;q=0.9",
+    "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8",
+    "Connection": "keep-alive",
+    "Sec-Fetch-Dest": "document",
+    "Sec-Fetch-Mode": "navigate",
+    "Sec-Fetch-Site": "none",
+    "Sec-Fetch-User": "?1",
+    "Upgrade-Insecure-Requests": "1",
+}
 
-def scrape_product(url, store=None):
+
+def detect_store(url):
+    """Determine the store from a product URL"""
+    domain = urlparse(url).netloc
+    if "daraz" in domain:
+        return "daraz"
+    elif "amazon" in domain:
+        return "amazon"
+    elif "aliexpress" in domain:
+        return "aliexpress"
+    elif "flipkart" in domain:
+        return "flipkart"
+    return "generic"
+
+
+# Text after which a store's page holds everything its parser reads, so the
+# rest of the download can be skipped. Pages of other stores are read fully
+STREAM_STOP_MARKERS = {
+    # ? __moduleData__ and the price markup all come before the app bootstrap
+    "daraz": "app.run(",
+}
+STREAM_CHUNK_SIZE = 16 * 1024
+
+
+class TransferStats:
+    """Per-store download counters, shared by the fetcher threads"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.stores = defaultdict(Counter)
+
+    def record(self, store, **counts):
+        with self._lock:
+            self.stores[store].update(counts)
+
+    def as_dict(self):
+        with self._lock:
+            return {store: dict(counts) for store, counts in self.stores.items()}
+
+
+transfer_stats = TransferStats()
+
+
+def accept_encoding():
     """
-    Scrape product information from various e-commerce platforms.
+    Content codings this process can decode: gzip and deflate, plus br and
+    zstd when the Brotli and zstandard packages are installed.
     """
-    # Determine store from URL if not provided
-    if not store:
-        domain = urlparse(url).netloc
-        if "daraz" in domain:
-            store = "daraz"
-        elif "amazon" in domain:
-            store = "amazon"
-        elif "aliexpress" in domain:
-            store = "aliexpress"
-        elif "flipkart" in domain:
-            store = "flipkart"
-        else:
-            store = "generic"
+    from urllib3.util.request import ACCEPT_ENCODING
 
-    logger.info(f"Scraping product from {store}: {url}")
+    return ACCEPT_ENCODING
 
-    headers = {
-        "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/122.0.0.0 Safari/537.36",
-        "Accept-Language": "en-US,en;q=0.9",
-        "Accept": "text/html,application/xhtml+xml,application/xml;q=0.9,image/avif,image/webp,image/apng,*/*;q=0.8",
-        "Accept-Encoding": "gzip, deflate, br",
-        "Connection": "keep-alive",
-        "Sec-Fetch-Dest": "document",
-        "Sec-Fetch-Mode": "navigate",
-        "Sec-Fetch-Site": "none",
-        "Sec-Fetch-User": "?1",
-        "Upgrade-Insecure-Requests": "1",
-    }
+
+def read_until_marker(response, marker):
+    """
+    Decode a streamed response until `marker` has been seen, then stop.
+    Returns the text read, whether the download was cut short and the number
+    of decoded bytes read.
+    """
+    decoder = codecs.getincrementaldecoder(response.encoding or "utf-8")("replace")
+    parts = []
+    tail = ""
+    decoded_bytes = 0
+
+    for chunk in response.iter_content(STREAM_CHUNK_SIZE):
+        decoded_bytes += len(chunk)
+        text = decoder.decode(chunk)
+        parts.append(text)
+        if marker:
+            # ? only scan the new text, plus enough of the old for a split marker
+            window = tail + text
+            if marker in window:
+                return "".join(parts), True, decoded_bytes
+            tail = window[-len(marker) :]
+
+    parts.append(decoder.decode(b"", final=True))
+    return "".join(parts), False, decoded_bytes
+
+
+HTML_TYPES = {"text/html", "application/xhtml+xml"}
+
+
+def fetch_page(url, store, accept=None):
+    """
+    Download a product page and return its HTML. I/O-bound; raises
+    `requests.RequestException` on network and HTTP errors.
+
+    Only content codings that can be decoded here are advertised. With
+    SCRAPER_STREAMING on, the body is streamed and the download stops as soon
+    as the store's stop marker has arrived. Passing `accept` requests another
+    kind of document, such as JSON, which is always read in full; getting an
+    HTML page instead raises.
+    """
+    import requests
+
+    streaming = getattr(settings, "SCRAPER_STREAMING", True)
+    encodings = accept_encoding()
+    headers = {**REQUEST_HEADERS, "Accept-Encoding": encodings}
+    if accept:
+        headers["Accept"] = accept
+    start = time.perf_counter()
+    try:
+        # ? DNS, connect, TLS and waiting for the response headers
+        with span("connect", url=url):
+            response = requests.get(url, headers=headers, timeout=15, stream=streaming)
+    except requests.RequestException:
+        FETCH_RESPONSES.inc(store=store, status="error")
+        raise
+    FETCH_RESPONSES.inc(store=store, status=response.status_code)
 
     try:
-        response = requests.get(url, headers=headers, timeout=15)
         response.raise_for_status()  # Raise exception for 4XX/5XX status codes
 
-        # Save raw HTML for debugging
+        # ? e.g. a storefront's catch-all route answering a JSON URL with a page
+        content_type = response.headers.get("Content-Type", "").split(";")[0]
+        if accept and content_type.strip().lower() in HTML_TYPES:
+            raise requests.RequestException(
+                f"Expected {accept} from {url}, got {content_type}"
+            )
+
+        # ? urllib3 passes unknown codings through undecoded, which would
+        # ? otherwise only show up later as a page without a price
+        content_encoding = response.headers.get("Content-Encoding", "identity")
+        content_encoding = content_encoding.strip().lower() or "identity"
+        if content_encoding not in ["identity", *encodings.split(",")]:
+            raise requests.exceptions.ContentDecodingError(
+                f"Cannot decode {content_encoding} response from {url}"
+            )
+
+        # ? downloading, decompressing and decoding happen chunk by chunk
+        with span("download", content_encoding=content_encoding):
+            if streaming:
+                html, stopped_early, decoded_bytes = read_until_marker(
+                    response, None if accept else STREAM_STOP_MARKERS.get(store)
+                )
+            else:
+                html, stopped_early = response.text, False
+                decoded_bytes = len(response.content)
+    finally:
+        response.close()
+    FETCH_SECONDS.observe(time.perf_counter() - start, store=store)
+
+    # ? bytes as sent on the wire, before content decoding
+    wire_bytes = response.raw.tell()
+    counts = {
+        "pages": 1,
+        f"{content_encoding}_pages": 1,
+        "wire_bytes": wire_bytes,
+        "decoded_bytes": decoded_bytes,
+    }
+    if stopped_early:
+        counts["early_stops"] = 1
+        content_length = response.headers.get("Content-Length")
+        if content_length and content_length.isdigit():
+            counts["bytes_saved"] = max(int(content_length) - wire_bytes, 0)
+    transfer_stats.record(store, **counts)
+
+    # Save raw HTML for debugging
+    if getattr(settings, "SCRAPER_DEBUG_HTML", False):
         with open(f"{store}_raw.html", "w", encoding="utf-8") as f:
-            f.write(response.text)
+            f.write(html)
         logger.info(f"Saved raw HTML for {store}")
 
-        # Route to appropriate scraper based on store
+    return html
+
+
+def make_soup(html):
+    from bs4 import BeautifulSoup
+
+    with span("soup"):
+        return BeautifulSoup(html, "html.parser")
+
+
+def parse_product(html, store, strategies=None):
+    """
+    Extract product data from a fetched page. CPU-bound and free of Django
+    state, so it can run in a separate process. `strategies` are extra
+    extraction strategies for scrapers that rank theirs, see scrape_daraz.
+    """
+    # Route to appropriate scraper based on store
+    with span("scrape_html", store=store):
         if store == "daraz":
-            result = scrape_daraz(response)
+            result = scrape_daraz(html, strategies)
         elif store == "amazon":
-            result = scrape_amazon(response)
+            result = scrape_amazon(html)
         elif store == "aliexpress":
-            result = scrape_aliexpress(response)
+            result = scrape_aliexpress(html)
         elif store == "flipkart":
-            result = scrape_flipkart(response)
+            result = scrape_flipkart(html)
         else:
-            result = scrape_generic(response)
+            result = scrape_generic(html)
 
-        # Double-check if price is 0 and try generic method as fallback
-        if result and result.get("price", 0) == 0:
-            logger.warning(
-                f"{store} scraper returned price 0.0, trying fallback extraction"
-            )
-            fallback_prices = extract_any_price(response.text)
-            if fallback_prices:
-                # Use median price if we have multiple
-                fallback_prices.sort()
-                if len(fallback_prices) > 2:
-                    result["price"] = fallback_prices[
-                        len(fallback_prices) // 2
-                    ]  # median
-                else:
-                    result["price"] = fallback_prices[0]
-                logger.info(f"Fallback price extraction found: {result['price']}")
+    if result:
+        # ? which extraction found the data, reported in the refresh metrics
+        result.setdefault("strategy", "html")
+
+    # Double-check if price is 0 and try generic method as fallback
+    if result and result.get("price", 0) == 0:
+        logger.warning(
+            f"{store} scraper returned price 0.0, trying fallback extraction"
+        )
+        with span("fallback_regex"):
+            fallback_prices = extract_any_price(html)
+        if fallback_prices:
+            # Use median price if we have multiple
+            fallback_prices.sort()
+            if len(fallback_prices) > 2:
+                result["price"] = fallback_prices[len(fallback_prices) // 2]  # median
+            else:
+                result["price"] = fallback_prices[0]
+            result["strategy"] = "fallback"
+            logger.info(f"Fallback price extraction found: {result['price']}")
+
+    return result
+
+
+def scrape_product(url, store=None):
+    """
+    Scrape product information from various e-commerce platforms.
+    """
+    import requests
 
+    from .stores import fetch_product, parse_fetched
+    from .strategies import load_ranking
+
+    # Determine store from URL if not provided
+    if not store:
+        store = detect_store(url)
+
+    logger.info(f"Scraping product from {store}: {url}")
+
+    try:
+        # ? what refreshes learned about each store's markup, read once
+        load_ranking(reload=False)
+        with start_trace("scrape", url=url, store=store):
+            result = parse_fetched(*fetch_product(url, store), store)
         logger.info(f"Final scraped data: {result}")
         return result
 
@@ -172,219 +354,193 @@ def extract_any_price(html_content):
     return found_prices
 
 
-def scrape_daraz(response):
+def scrape_daraz(html, strategies=None):
     """
-    Scrape Daraz product page.
+    Scrape Daraz product page, trying first the extraction strategies that
+    have worked best on its template. `strategies` adds the caller's own, as
+    name to callable.
     """
-    soup = BeautifulSoup(response.text, "html.parser")
+    # ? the page is only parsed into a soup if a markup strategy runs
+    soup = functools.cache(lambda: make_soup(html))
+    markup = functools.cache(lambda: daraz_markup(soup()))
+
+    result = run_ranked(
+        "daraz",
+        page_fingerprint(html),
+        {
+            **(strategies or {}),
+            "data_module": lambda: daraz_data_module(soup()),
+            "app_run": lambda: daraz_app_run(soup()),
+            "html": markup,
+        },
+    )
+    if result:
+        return result
 
+    # No strategy found a price, keep what the markup has for the fallback
     try:
-        # Debug: Save HTML to analyze
-        with open("daraz_debug.html", "w", encoding="utf-8") as f:
-            f.write(response.text)
+        return markup()
+    except Exception as e:
+        logger.error(f"Daraz parsing failed: {str(e)}", exc_info=True)
+        return None
 
-        # Set default values
-        title = ""
-        price = 0.0
-        image_url = ""
-        description = ""
 
-        # Try script-based parsing first - look for the data-module="item-price" attribute
-        price_data_script = soup.find("script", attrs={"data-module": "item-price"})
-        if price_data_script:
-            try:
-                script_text = price_data_script.string
-                if script_text:
-                    match = re.search(
-                        r"data:\s*({.+?}),\s*exports:", script_text, re.DOTALL
-                    )
-                    if match:
-                        price_data = json.loads(match.group(1))
-                        if price_data and "price" in price_data:
-                            price_str = str(price_data.get("price", "0"))
-                            price = extract_price(price_str)
-                            logger.info(f"Found price from data-module script: {price}")
-                            if price > 0:
-                                # Continue with other data extraction
-                                # Ensure we have a title
-                                title_elem = soup.find(
-                                    "h1", class_="pdp-mod-product-badge-title"
-                                )
-                                if not title_elem:
-                                    title_elem = soup.find("span", class_="pdp-title")
-                                if title_elem:
-                                    title = title_elem.text.strip()
-
-                                # Extract image URL and description as in original code
-                                image_elem = soup.find(
-                                    "img", class_="pdp-mod-common-image"
-                                )
-                                if not image_elem:
-                                    image_elem = soup.find(
-                                        "img", attrs={"data-src": True}
-                                    )
-                                image_url = (
-                                    image_elem.get("src") or image_elem.get("data-src")
-                                    if image_elem
-                                    else ""
-                                )
-
-                                desc_elem = soup.find("div", class_="html-content")
-                                if not desc_elem:
-                                    desc_elem = soup.find(
-                                        "div", class_="pdp-product-detail"
-                                    )
-                                description = (
-                                    desc_elem.text.strip() if desc_elem else ""
-                                )
-
-                                return {
-                                    "title": title,
-                                    "price": price,
-                                    "image_url": image_url,
-                                    "description": description,
-                                }
-            except Exception as e:
-                logger.error(f"Error parsing price data-module script: {str(e)}")
-
-        # Try the app.run approach as before
-        scripts = soup.find_all("script", type="text/javascript")
-        for script in scripts:
-            script_text = script.string
-            if script_text and "app.run" in script_text:
-                match = re.search(r"app\.run\((.*?)\);", script_text, re.DOTALL)
-                if match:
-                    try:
-                        data = json.loads(match.group(1))
-                        product_data = (
-                            data.get("data", {}).get("root", {}).get("fields", {})
-                        )
-                        if product_data:
-                            title = product_data.get("title", "")
-                            price_info = product_data.get("price", {})
-                            if isinstance(price_info, dict):
-                                # Try to get the actual price value rather than display text
-                                price_str = str(
-                                    price_info.get("value", price_info.get("text", "0"))
-                                )
-                            else:
-                                price_str = str(price_info)
-
-                            logger.info(f"Found price from app.run: {price_str}")
-                            price = extract_price(price_str)
-                            images = product_data.get("images", [])
-                            image_url = images[0] if images else ""
-                            description = product_data.get("description", "")
+def daraz_title(soup):
+    title_elem = soup.find("h1", class_="pdp-mod-product-badge-title")
+    if not title_elem:
+        title_elem = soup.find("span", class_="pdp-title")
+    return title_elem.text.strip() if title_elem else ""
 
-                            # If price was successfully extracted, return immediately
-                            if price > 0:
-                                return {
-                                    "title": title,
-                                    "price": price,
-                                    "image_url": image_url,
-                                    "description": description,
-                                }
-                    except Exception as e:
-                        logger.error(f"Daraz JSON parse error: {str(e)}")
-
-        # HTML fallback parsing - improved to find more price elements
-        logger.info(
-            "JSON extraction failed or returned 0 price, trying HTML extraction"
-        )
 
-        # Try to find the title first
-        title_elem = soup.find("h1", class_="pdp-mod-product-badge-title")
-        if not title_elem:
-            title_elem = soup.find("span", class_="pdp-title")
-        if title_elem:
-            title = title_elem.text.strip()
-            logger.info(f"Found title: {title}")
+def daraz_image_url(soup):
+    image_elem = soup.find("img", class_="pdp-mod-common-image")
+    if not image_elem:
+        image_elem = soup.find("img", attrs={"data-src": True})
+    return image_elem.get("src") or image_elem.get("data-src") if image_elem else ""
 
-        # Enhanced price element search - try multiple class patterns
-        price_candidates = [
-            # First try the price with 'color_orange' class which usually indicates the current price
-            soup.find(
-                "span", class_=lambda x: x and "color_orange" in x and "pdp-price" in x
-            ),
-            soup.find("span", class_="pdp-price_type_normal pdp-price_color_orange"),
-            # Then try the general selectors
-            soup.find("span", class_="pdp-price_type_normal"),
-            soup.find("span", class_=lambda x: x and "pdp-price_type_normal" in x),
-            soup.find("span", class_=lambda x: x and "pdp-price" in x),
-            soup.find("div", class_=lambda x: x and "pdp-price" in x),
-            soup.find("span", class_="price-val"),
-            # Try the special price if it exists (but this is usually the crossed-out price)
-            soup.find("span", class_="pdp-price_type_deleted"),
-        ]
 
-        for price_elem in price_candidates:
-            if price_elem:
-                price_str = price_elem.text.strip()
-                logger.info(f"Found price element text: '{price_str}'")
-                # Remove 'Rs.' and any commas
-                price_str = price_str.replace("Rs.", "").replace(",", "").strip()
-                try:
-                    price = float(price_str)
-                    logger.info(f"Successfully converted Daraz price to float: {price}")
-                    if price > 0:
-                        break
-                except ValueError as e:
-                    logger.error(
-                        f"Failed to convert price string '{price_str}' to float: {str(e)}"
-                    )
+def daraz_description(soup):
+    desc_elem = soup.find("div", class_="html-content")
+    if not desc_elem:
+        desc_elem = soup.find("div", class_="pdp-product-detail")
+    return desc_elem.text.strip() if desc_elem else ""
 
-        # Add a specific check for the price container which often has multiple elements
-        if price == 0.0:
-            price_container = soup.find("div", class_="pdp-product-price")
-            if price_container:
-                # Try to find the most prominent price in the container
-                price_spans = price_container.find_all("span")
-                for span in price_spans:
-                    span_text = span.text.strip()
-                    if "Rs." in span_text or "₹" in span_text:
-                        price_str = (
-                            span_text.replace("Rs.", "")
-                            .replace("₹", "")
-                            .replace(",", "")
-                            .strip()
-                        )
-                        try:
-                            price = float(price_str)
-                            logger.info(f"Found price from price container: {price}")
-                            if price > 0:
-                                break
-                        except ValueError:
-                            continue
 
-        # Extract image URL
-        image_elem = soup.find("img", class_="pdp-mod-common-image")
-        if not image_elem:
-            image_elem = soup.find("img", attrs={"data-src": True})
-        image_url = (
-            image_elem.get("src") or image_elem.get("data-src") if image_elem else ""
-        )
+def daraz_data_module(soup):
+    """Price from the `data-module="item-price"` script"""
+    price_data_script = soup.find("script", attrs={"data-module": "item-price"})
+    script_text = price_data_script.string if price_data_script else None
+    if not script_text:
+        return None
 
-        # Extract description
-        desc_elem = soup.find("div", class_="html-content")
-        if not desc_elem:
-            desc_elem = soup.find("div", class_="pdp-product-detail")
-        description = desc_elem.text.strip() if desc_elem else ""
+    match = re.search(r"data:\s*({.+?}),\s*exports:", script_text, re.DOTALL)
+    if not match:
+        return None
+    price_data = json.loads(match.group(1))
+    if not price_data or "price" not in price_data:
+        return None
 
-        return {
-            "title": title,
-            "price": price,
-            "image_url": image_url,
-            "description": description,
-        }
+    price = extract_price(str(price_data.get("price", "0")))
+    logger.info(f"Found price from data-module script: {price}")
+    return {
+        "title": daraz_title(soup),
+        "price": price,
+        "image_url": daraz_image_url(soup),
+        "description": daraz_description(soup),
+    }
 
-    except Exception as e:
-        logger.error(f"Daraz parsing failed: {str(e)}", exc_info=True)
-        return None
+
+def daraz_app_run(soup):
+    """Product data from the JSON passed to `app.run`"""
+    for script in soup.find_all("script", type="text/javascript"):
+        script_text = script.string
+        if not script_text or "app.run" not in script_text:
+            continue
+        match = re.search(r"app\.run\((.*?)\);", script_text, re.DOTALL)
+        if not match:
+            continue
+
+        try:
+            data = json.loads(match.group(1))
+        except ValueError as e:
+            logger.error(f"Daraz JSON parse error: {str(e)}")
+            continue
+        product_data = data.get("data", {}).get("root", {}).get("fields", {})
+        if not product_data:
+            continue
+
+        price_info = product_data.get("price", {})
+        if isinstance(price_info, dict):
+            # Try to get the actual price value rather than display text
+            price_str = str(price_info.get("value", price_info.get("text", "0")))
+        else:
+            price_str = str(price_info)
+        logger.info(f"Found price from app.run: {price_str}")
+
+        price = extract_price(price_str)
+        if price > 0:
+            images = product_data.get("images", [])
+            return {
+                "title": product_data.get("title", ""),
+                "price": price,
+                "image_url": images[0] if images else "",
+                "description": product_data.get("description", ""),
+            }
+    return None
+
+
+def daraz_markup(soup):
+    """Product data from the page's price elements; the price may be 0"""
+    title = daraz_title(soup)
+    price = 0.0
+
+    # Enhanced price element search - try multiple class patterns
+    price_candidates = [
+        # First try the price with 'color_orange' class which usually indicates the current price
+        soup.find(
+            "span", class_=lambda x: x and "color_orange" in x and "pdp-price" in x
+        ),
+        soup.find("span", class_="pdp-price_type_normal pdp-price_color_orange"),
+        # Then try the general selectors
+        soup.find("span", class_="pdp-price_type_normal"),
+        soup.find("span", class_=lambda x: x and "pdp-price_type_normal" in x),
+        soup.find("span", class_=lambda x: x and "pdp-price" in x),
+        soup.find("div", class_=lambda x: x and "pdp-price" in x),
+        soup.find("span", class_="price-val"),
+        # Try the special price if it exists (but this is usually the crossed-out price)
+        soup.find("span", class_="pdp-price_type_deleted"),
+    ]
+
+    for price_elem in price_candidates:
+        if price_elem:
+            price_str = price_elem.text.strip()
+            logger.info(f"Found price element text: '{price_str}'")
+            # Remove 'Rs.' and any commas
+            price_str = price_str.replace("Rs.", "").replace(",", "").strip()
+            try:
+                price = float(price_str)
+                logger.info(f"Successfully converted Daraz price to float: {price}")
+                if price > 0:
+                    break
+            except ValueError as e:
+                logger.error(
+                    f"Failed to convert price string '{price_str}' to float: {str(e)}"
+                )
+
+    # Add a specific check for the price container which often has multiple elements
+    if price == 0.0:
+        price_container = soup.find("div", class_="pdp-product-price")
+        if price_container:
+            # Try to find the most prominent price in the container
+            for span in price_container.find_all("span"):
+                span_text = span.text.strip()
+                if "Rs." in span_text or "₹" in span_text:
+                    price_str = (
+                        span_text.replace("Rs.", "")
+                        .replace("₹", "")
+                        .replace(",", "")
+                        .strip()
+                    )
+                    try:
+                        price = float(price_str)
+                        logger.info(f"Found price from price container: {price}")
+                        if price > 0:
+                            break
+                    except ValueError:
+                        continue
+
+    return {
+        "title": title,
+        "price": price,
+        "image_url": daraz_image_url(soup),
+        "description": daraz_description(soup),
+        "strategy": "html",
+    }
 
 
-def scrape_amazon(response):
+def scrape_amazon(html):
     """Scrape Amazon product page"""
-    soup = BeautifulSoup(response.text, "html.parser")
+    soup = make_soup(html)
 
     try:
         title_elem = soup.find("span", id="productTitle")
@@ -446,9 +602,9 @@ def scrape_amazon(response):
         return None
 
 
-def scrape_flipkart(response):
+def scrape_flipkart(html):
     """Scrape Flipkart product page"""
-    soup = BeautifulSoup(response.text, "html.parser")
+    soup = make_soup(html)
 
     try:
         title_elem = soup.find("span", class_="B_NuCI")
@@ -486,9 +642,9 @@ def scrape_flipkart(response):
         return None
 
 
-def scrape_aliexpress(response):
+def scrape_aliexpress(html):
     """Scrape AliExpress product page"""
-    soup = BeautifulSoup(response.text, "html.parser")
+    soup = make_soup(html)
 
     try:
         # Try to extract structured data
@@ -616,9 +772,9 @@ def scrape_aliexpress(response):
         return None
 
 
-def scrape_generic(response):
+def scrape_generic(html):
     """Generic scraper for unknown sites - tries common patterns"""
-    soup = BeautifulSoup(response.text, "html.parser")
+    soup = make_soup(html)
 
     try:
         # Check for structured data first (best source if available)
@@ -821,8 +977,9 @@ def scrape_generic(response):
 
         # Try meta description if no detailed description found
         if not description:
+            # ? attrs, since find()'s own first parameter is called name
             meta_desc = soup.find("meta", property="og:description") or soup.find(
-                "meta", name="description"
+                "meta", attrs={"name": "description"}
             )
             if meta_desc and meta_desc.get("content"):
                 description = meta_desc.get("content", "")
@@ -1,24 +1,131 @@
 from accounts.models import User
 from rest_framework import viewsets, status, permissions
 from rest_framework.decorators import action
+from rest_framework.generics import get_object_or_404 as get_row_or_404
 from rest_framework.response import Response
 from rest_framework.views import APIView
+from django.conf import settings
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
-from django.core.mail import send_mail
-from django.db import IntegrityError
-from .models import Product, UserPreference
-from .serializers import ProductSerializer, UserPreferenceSerializer
+from django.db import IntegrityError, transaction
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from .alerts import queue_watcher_alerts
+from .exports import EXPORT_FIELDS, EXPORT_FORMATS, export_products
+from .failures import clear_failures
+from .history import downsample, parse_bound
+from .metrics import CONTENT_TYPE, registry
+from .models import CollectionVersion, PriceDropEvent, Product, UserPreference
+from .pagination import ProductCursorPagination
+from .renderers import ExportNegotiation
+from .serializers import (
+    ProductSerializer,
+    UserPreferenceSerializer,
+    product_rows,
+    render_product_row,
+)
 from .utils import scrape_product
+import hashlib
 import logging
 
 logger = logging.getLogger(__name__)
 
 
+def product_collection_etag(request, *args, **kwargs):
+    """ETag for a user's product responses, derived from their collection version"""
+    if not request.user.is_authenticated:
+        return None
+
+    version = CollectionVersion.current(request.user.pk)
+    key = ":".join(
+        [
+            str(request.user.pk),
+            str(version),
+            request.get_full_path(),
+            request.META.get("HTTP_ACCEPT", ""),
+        ]
+    )
+    return 'W/"%s"' % hashlib.md5(key.encode()).hexdigest()
+
+
 class ProductViewSet(viewsets.ModelViewSet):
     serializer_class = ProductSerializer
+    pagination_class = ProductCursorPagination
 
     def get_queryset(self):
-        return Product.objects.filter(user=self.request.user).order_by("-created_at")
+        queryset = Product.objects.filter(user=self.request.user).order_by(
+            "-created_at"
+        )
+
+        if self.action in ("list", "retrieve"):
+            # ? don't load heavy columns we are not going to render
+            deferred = [
+                column
+                for name, columns in ProductSerializer.HEAVY_FIELDS.items()
+                if name not in self.get_requested_fields()
+                for column in columns
+            ]
+            if deferred:
+                queryset = queryset.defer(*deferred)
+        elif self.action == "history":
+            queryset = queryset.only("id", "price_series", "price_history")
+
+        return queryset
+
+    def get_requested_fields(self):
+        """
+        Fields to render for list/retrieve.
+
+        `?fields=id,title,current_price` selects a sparse subset. Without it, the
+        list view leaves out heavy fields unless `?expand=true` is passed, while
+        the detail view renders everything.
+        """
+        all_fields = ProductSerializer.Meta.fields
+        requested = self.request.query_params.get("fields")
+
+        if requested:
+            names = {name.strip() for name in requested.split(",")}
+            return [name for name in all_fields if name in names]
+
+        expand = self.request.query_params.get("expand", "").lower()
+        if self.action == "list" and expand not in ("1", "true", "yes"):
+            return [
+                name
+                for name in all_fields
+                if name not in ProductSerializer.HEAVY_FIELDS
+            ]
+
+        return list(all_fields)
+
+    # ? conditional GETs answer If-None-Match with 304 before touching products
+    @method_decorator(condition(etag_func=product_collection_etag))
+    def list(self, request, *args, **kwargs):
+        if not settings.PRODUCT_FAST_READS:
+            return super().list(request, *args, **kwargs)
+
+        fields = self.get_requested_fields()
+        rows = product_rows(self.filter_queryset(self.get_queryset()), fields)
+        page = self.paginate_queryset(rows)
+        if page is None:
+            return Response([render_product_row(row, fields) for row in rows])
+        return self.get_paginated_response(
+            [render_product_row(row, fields) for row in page]
+        )
+
+    @method_decorator(condition(etag_func=product_collection_etag))
+    def retrieve(self, request, *args, **kwargs):
+        if not settings.PRODUCT_FAST_READS:
+            return super().retrieve(request, *args, **kwargs)
+
+        fields = self.get_requested_fields()
+        rows = product_rows(self.get_queryset(), fields)
+        row = get_row_or_404(rows, pk=kwargs["pk"])
+        return Response(render_product_row(row, fields))
+
+    def get_serializer(self, *args, **kwargs):
+        if self.action in ("list", "retrieve"):
+            kwargs.setdefault("fields", self.get_requested_fields())
+        return super().get_serializer(*args, **kwargs)
 
     def create(self, request, *args, **kwargs):
         url = request.data.get("url")
@@ -34,55 +141,36 @@ class ProductViewSet(viewsets.ModelViewSet):
                 )
 
             try:
-                product, created = Product.objects.get_or_create(
-                    url=url,
-                    user=request.user,
-                    defaults={
-                        "title": data["title"],
-                        "current_price": data["price"],
-                        "image_url": data.get("image_url", ""),
-                        "description": data.get("description", ""),
-                        "store": store,
-                    },
-                )
-                if not created:
-                    # ? if the product exists, update
-                    product.current_price = data["price"]
-                    if "image_url" in data:
-                        product.image_url = data["image_url"]
-                    if "description" in data:
-                        product.description = data["description"]
-                    product.save()
-
-                # ? check if the price dropped below threshold for notification
-                should_notify = False
-                user_preferences = self.request.user.preferences
-
-                if not created and data["price"] < product.lowest_price:
-                    # ? price hit alltime low
-                    should_notify = True
-                elif (
-                    product.alert_threshold and data["price"] <= product.alert_threshold
-                ):
-                    # ? price hit users target
-                    should_notify = True
-
-                # ?send notification if needed and user prefers instant notifications
-                if (
-                    should_notify
-                    and user_preferences.email_notifications
-                    and user_preferences.notification_frequency == "instant"
-                ):
-                    try:
-                        send_mail(
-                            "🔥 Price Drop Alert!",
-                            f"The price of {product.title} has dropped to Rs. {data['price']}!",
-                            "aviralale@gmail.com",
-                            [request.user.email],
-                            fail_silently=False,
+                with transaction.atomic():
+                    product, created = Product.objects.get_or_create(
+                        url=url,
+                        user=request.user,
+                        defaults={
+                            "title": data["title"],
+                            "current_price": data["price"],
+                            "image_url": data.get("image_url", ""),
+                            "description": data.get("description", ""),
+                            "store": store,
+                        },
+                    )
+                    if not created:
+                        # ? if the product exists, update
+                        old_price = product.current_price
+
+                        # ? alerts are matched against the stored price, and
+                        # ? go out from the outbox once this commits
+                        queue_watcher_alerts(
+                            product.canonical_key, data["price"], [product.pk]
                         )
-                    except Exception as e:
-                        logger.error(f"Failed to send email: {str(e)}")
+
+                        product.current_price = data["price"]
+                        if "image_url" in data:
+                            product.image_url = data["image_url"]
+                        if "description" in data:
+                            product.description = data["description"]
+                        product.save()
+
+                        PriceDropEvent.record(product, old_price, data["price"])
 
                 return Response(
                     ProductSerializer(product).data,
@@ -123,6 +211,65 @@ class ProductViewSet(viewsets.ModelViewSet):
                 {"error": "Invalid threshold value"}, status=status.HTTP_400_BAD_REQUEST
             )
 
+    @action(detail=True, methods=["get"])
+    @method_decorator(condition(etag_func=product_collection_etag))
+    def history(self, request, pk=None):
+        """
+        Downsampled price history for charts.
+
+        Accepts `from`/`to` (ISO date or datetime) and `resolution`
+        (`auto`, `hour`, `day` or `week`).
+        """
+        product = self.get_object()
+        resolution = request.query_params.get("resolution", "auto")
+
+        try:
+            start = parse_bound(request.query_params.get("from"))
+            end = parse_bound(request.query_params.get("to"))
+            timestamps, prices = product.price_arrays()
+            width, points = downsample(timestamps, prices, start, end, resolution)
+        except ValueError as e:
+            return Response({"error": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        return Response(
+            {
+                "id": product.id,
+                "resolution": resolution,
+                "bucket_seconds": width,
+                "points": points,
+            }
+        )
+
+    @action(detail=False, methods=["get"], content_negotiation_class=ExportNegotiation)
+    def export(self, request):
+        """
+        Stream every product as a download.
+
+        Accepts `export_format` (`csv` or `ndjson`) and `data` (`products`, or
+        `history` for one row per price point).
+        """
+        export_format = request.query_params.get("export_format", "csv")
+        data = request.query_params.get("data", "products")
+        if export_format not in EXPORT_FORMATS:
+            return Response(
+                {"error": f"export_format must be one of {', '.join(EXPORT_FORMATS)}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+        if data not in EXPORT_FIELDS:
+            return Response(
+                {"error": f"data must be one of {', '.join(EXPORT_FIELDS)}"},
+                status=status.HTTP_400_BAD_REQUEST,
+            )
+
+        response = StreamingHttpResponse(
+            export_products(self.get_queryset(), export_format, data),
+            content_type=EXPORT_FORMATS[export_format],
+        )
+        response["Content-Disposition"] = (
+            f'attachment; filename="{data}.{export_format}"'
+        )
+        return response
+
     @action(detail=True, methods=["post"])
     def refresh(self, request, pk=None):
         product = self.get_object()
@@ -136,34 +283,24 @@ class ProductViewSet(viewsets.ModelViewSet):
                     status=status.HTTP_400_BAD_REQUEST,
                 )
 
-            old_price = product.current_price
-            product.current_price = data["price"]
-
-            if "image_url" in data:
-                product.image_url = data["image_url"]
-            if "description" in data:
-                product.description = data["description"]
-
-            product.save()
-
-            # ? check for price drop notification
-
-            if data["price"] < old_price:
-                user_preferences = request.user.preferences
-                if (
-                    user_preferences.email_notifications
-                    and user_preferences.notification_frequency == "instant"
-                ):
-                    try:
-                        send_mail(
-                            "🔥 Price Drop Alert!",
-                            f"The price of {product.title} has dropped from Rs. {old_price} to Rs. {data['price']}!",
-                            "your-email@example.com",
-                            [request.user.email],
-                            fail_silently=False,
-                        )
-                    except Exception as e:
-                        logger.error(f"Failed to send email: {str(e)}")
+            with transaction.atomic():
+                old_price = product.current_price
+
+                # ? check for price drop notification before the price changes
+                queue_watcher_alerts(product.canonical_key, data["price"], [product.pk])
+
+                product.current_price = data["price"]
+
+                if "image_url" in data:
+                    product.image_url = data["image_url"]
+                if "description" in data:
+                    product.description = data["description"]
+
+                product.save()
+
+                PriceDropEvent.record(product, old_price, data["price"])
+                # ? the item is alive after all, so refreshes pick it up again
+                clear_failures([product.canonical_key])
 
             return Response(ProductSerializer(product).data)
 
@@ -190,3 +327,15 @@ class UserPreferenceView(APIView):
             return Response(serializer.data)
 
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+
+class MetricsView(APIView):
+    """
+    This process's metrics in the Prometheus text format, for staff. Each
+    web worker keeps its own, so only the one serving the request is reported.
+    """
+
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request):
+        return HttpResponse(registry.render(), content_type=CONTENT_TYPE)